@@ -1,5 +1,15 @@
 from abc import ABC, abstractmethod
 from typing import Optional, Dict, Any, List
+from utils.metrics import registry
+from utils.tracing import record_span
+
+# AI 调用指标
+AI_CALL_DURATION = registry.histogram(
+    'tf_ai_call_duration_seconds', 'AI接口调用耗时', ('provider', 'status')
+)
+AI_TOKENS = registry.counter(
+    'tf_ai_tokens_total', 'AI接口消耗的token数量', ('provider', 'kind')
+)
 
 class BaseAIProvider(ABC):
     """AI提供者的基类"""
@@ -27,4 +37,24 @@ class BaseAIProvider(ABC):
     @abstractmethod
     async def initialize(self, **kwargs) -> None:
         """初始化AI提供者"""
-        pass
\ No newline at end of file
+        pass
+
+    def record_call(self, provider: str, elapsed: float, success: bool,
+                    input_tokens: Optional[int] = None, output_tokens: Optional[int] = None) -> None:
+        """
+        记录一次AI接口调用的耗时和token用量
+        
+        Args:
+            provider: 提供商名称
+            elapsed: 调用耗时（秒）
+            success: 是否成功
+            input_tokens: 输入token数（接口未返回时为None）
+            output_tokens: 输出token数（接口未返回时为None）
+        """
+        status = 'ok' if success else 'error'
+        AI_CALL_DURATION.observe(elapsed, provider, status)
+        record_span(f'ai:{provider}', elapsed, status, input_tokens=input_tokens, output_tokens=output_tokens)
+        if input_tokens:
+            AI_TOKENS.inc(provider, 'input', amount=input_tokens)
+        if output_tokens:
+            AI_TOKENS.inc(provider, 'output', amount=output_tokens)
\ No newline at end of file
@@ -2,6 +2,7 @@ from typing import Optional, List, Dict
 import anthropic
 from .base import BaseAIProvider
 import os
+import time
 import logging
 
 logger = logging.getLogger(__name__)
@@ -38,6 +39,7 @@ class ClaudeProvider(BaseAIProvider):
                             images: Optional[List[Dict[str, str]]] = None,
                             **kwargs) -> str:
         """处理消息"""
+        started = None
         try:
             if not self.client:
                 await self.initialize(**kwargs)
@@ -77,6 +79,7 @@ class ClaudeProvider(BaseAIProvider):
                 messages.append({"role": "user", "content": message})
             
             # 使用流式输出 - 按照官方文档正确实现
+            started = time.perf_counter()
             with self.client.messages.stream(
                 model=self.model,
                 max_tokens=4096,
@@ -86,9 +89,14 @@ class ClaudeProvider(BaseAIProvider):
                 full_response = ""
                 for text in stream.text_stream:
                     full_response += text
+                usage = stream.get_final_message().usage
         
+            self.record_call('claude', time.perf_counter() - started, True,
+                             usage.input_tokens, usage.output_tokens)
             return full_response
             
         except Exception as e:
+            if started is not None:
+                self.record_call('claude', time.perf_counter() - started, False)
             logger.error(f"Claude API 调用失败: {str(e)}")
             return f"AI处理失败: {str(e)}" 
\ No newline at end of file
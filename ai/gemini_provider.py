@@ -5,6 +5,7 @@ import google.generativeai as genai
 from .base import BaseAIProvider
 from .openai_base_provider import OpenAIBaseProvider
 import os
+import time
 import logging
 import base64
 
@@ -83,6 +84,7 @@ class GeminiProvider(BaseAIProvider):
                             images: Optional[List[Dict[str, str]]] = None,
                             **kwargs) -> str:
         """处理消息"""
+        started = None
         try:
             if not self.provider and not self.model:
                 await self.initialize(**kwargs)
@@ -93,6 +95,7 @@ class GeminiProvider(BaseAIProvider):
                 
             # 使用Gemini API的流式处理
             logger.info(f"实际使用的Gemini模型: {self.model_name}")
+            started = time.perf_counter()
 
             # 组合提示词和消息
             if prompt:
@@ -144,12 +147,21 @@ class GeminiProvider(BaseAIProvider):
             
             # 收集完整响应
             full_response = ""
+            usage = None
             for chunk in response_stream:
                 if hasattr(chunk, 'text'):
                     full_response += chunk.text
+                if getattr(chunk, 'usage_metadata', None):
+                    usage = chunk.usage_metadata
             
+            self.record_call(
+                'gemini', time.perf_counter() - started, True,
+                getattr(usage, 'prompt_token_count', None), getattr(usage, 'candidates_token_count', None)
+            )
             return full_response
             
         except Exception as e:
+            if started is not None:
+                self.record_call('gemini', time.perf_counter() - started, False)
             logger.error(f"Gemini处理消息时出错: {str(e)}")
             return f"AI处理失败: {str(e)}" 
\ No newline at end of file
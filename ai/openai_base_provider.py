@@ -2,6 +2,7 @@ from typing import Optional, List, Dict
 from openai import AsyncOpenAI
 from .base import BaseAIProvider
 import os
+import time
 import logging
 
 logger = logging.getLogger(__name__)
@@ -52,6 +53,8 @@ class OpenAIBaseProvider(BaseAIProvider):
                             images: Optional[List[Dict[str, str]]] = None,
                             **kwargs) -> str:
         """处理消息"""
+        provider = self.env_prefix.lower()
+        started = None
         try:
             if not self.client:
                 await self.initialize(**kwargs)
@@ -89,6 +92,7 @@ class OpenAIBaseProvider(BaseAIProvider):
             logger.info(f"实际使用的OpenAI模型: {self.model}")
 
             # 所有模型统一使用流式调用
+            started = time.perf_counter()
             completion = await self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
@@ -98,8 +102,12 @@ class OpenAIBaseProvider(BaseAIProvider):
             # 收集所有内容
             collected_content = ""
             collected_reasoning = ""
+            usage = None
 
             async for chunk in completion:
+                # 部分接口会在最后一个分块中返回token用量
+                if getattr(chunk, 'usage', None):
+                    usage = chunk.usage
                 if not chunk.choices:
                     continue
 
@@ -113,6 +121,11 @@ class OpenAIBaseProvider(BaseAIProvider):
                 if hasattr(delta, 'content') and delta.content is not None:
                     collected_content += delta.content
 
+            self.record_call(
+                provider, time.perf_counter() - started, True,
+                getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None)
+            )
+
             # 如果没有内容但有思考过程，可能是思考模型只返回了思考过程
             if not collected_content and collected_reasoning:
                 logger.warning("模型只返回了思考过程，没有最终回答")
@@ -121,5 +134,7 @@ class OpenAIBaseProvider(BaseAIProvider):
             return collected_content
 
         except Exception as e:
+            if started is not None:
+                self.record_call(provider, time.perf_counter() - started, False)
             logger.error(f"{self.env_prefix} API 调用失败: {str(e)}", exc_info=True)
             return f"AI处理失败: {str(e)}"
@@ -2,6 +2,7 @@ from typing import Optional, List, Dict
 from openai import AsyncOpenAI
 from .base import BaseAIProvider
 import os
+import time
 import logging
 from .openai_base_provider import OpenAIBaseProvider
 
@@ -21,6 +22,7 @@ class OpenAIProvider(OpenAIBaseProvider):
                             images: Optional[List[Dict[str, str]]] = None,
                             **kwargs) -> str:
         """处理消息"""
+        started = None
         try:
             if not self.client:
                 await self.initialize(**kwargs)
@@ -54,13 +56,21 @@ class OpenAIProvider(OpenAIBaseProvider):
                 # 没有图片，只添加文本
                 messages.append({"role": "user", "content": message})
             
+            started = time.perf_counter()
             response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=messages
             )
             
+            usage = getattr(response, 'usage', None)
+            self.record_call(
+                'openai', time.perf_counter() - started, True,
+                getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None)
+            )
             return response.choices[0].message.content
             
         except Exception as e:
+            if started is not None:
+                self.record_call('openai', time.perf_counter() - started, False)
             logger.error(f"OpenAI处理消息时出错: {str(e)}", exc_info=True)
             return f"AI处理失败: {str(e)}"
\ No newline at end of file
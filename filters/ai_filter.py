@@ -5,13 +5,11 @@ from utils.common import check_keywords
 from utils.common import get_main_module
 from ai import get_ai_provider
 from utils.constants import DEFAULT_AI_MODEL,DEFAULT_SUMMARY_PROMPT,DEFAULT_AI_PROMPT
+from utils.image_prep import image_preparer
 from datetime import datetime, timedelta
 import asyncio
 import re
 import base64
-import os
-import io
-import mimetypes
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +18,10 @@ class AIFilter(BaseFilter):
     AI处理过滤器，使用AI处理消息文本
     """
     
+    def is_applicable(self, rule):
+        """仅在启用AI处理时需要"""
+        return bool(rule.is_ai)
+    
     async def _process(self, context):
         """
         使用AI处理消息文本
@@ -49,97 +51,25 @@ class AIFilter(BaseFilter):
             has_media_to_process = False
             
             if rule.enable_ai_upload_image:
-                # 检查是否有已下载的媒体文件
-                if context.media_files:
-                    # 已经下载好的文件，需要读取到内存
-                    for file_path in context.media_files:
-                        try:
-                            # 检查文件是否存在
-                            if not os.path.exists(file_path):
-                                logger.warning(f"文件不存在: {file_path}")
-                                continue
-                                
-                            # 读取文件内容
-                            with open(file_path, 'rb') as f:
-                                file_content = f.read()
-                                
-                            # 获取MIME类型
-                            mime_type = mimetypes.guess_type(file_path)[0] or "image/jpeg"
-                            
-                            # 保存到内存图片列表
-                            image_files.append({
-                                "data": base64.b64encode(file_content).decode('utf-8'),
-                                "mime_type": mime_type
-                            })
-                            logger.info(f"已加载图片到内存，类型: {mime_type}，大小: {len(file_content) // 1024} KB")
-                        except Exception as e:
-                            logger.error(f"读取文件到内存时出错: {str(e)}")
-                            
-                    has_media_to_process = len(image_files) > 0
-                    logger.info(f"已加载 {len(image_files)} 个文件到内存")
-                    
-                # 如果没有已下载的文件，但有媒体组消息，则直接下载到内存
-                elif context.is_media_group and context.media_group_messages:
-                    logger.info(f"检测到媒体组消息: {len(context.media_group_messages)}条，直接下载到内存")
-                    # 下载媒体组中的图片到内存
-                    for msg in context.media_group_messages:
-                        if msg.photo or (msg.document and hasattr(msg.document, 'mime_type') and msg.document.mime_type.startswith('image/')):
-                            try:
-                                # 创建内存缓冲区
-                                buffer = io.BytesIO()
-                                # 直接下载到内存缓冲区
-                                await msg.download_media(file=buffer)
-                                # 获取图片内容
-                                buffer.seek(0)
-                                content = buffer.read()
-                                
-                                # 获取MIME类型
-                                mime_type = "image/jpeg"  # 默认类型
-                                if msg.photo:
-                                    mime_type = "image/jpeg"
-                                elif msg.document and hasattr(msg.document, 'mime_type'):
-                                    mime_type = msg.document.mime_type
-                                
-                                # 保存到内存图片列表
-                                image_files.append({
-                                    "data": base64.b64encode(content).decode('utf-8'),
-                                    "mime_type": mime_type
-                                })
-                                logger.info(f"已下载媒体组图片到内存，类型: {mime_type}，大小: {len(content) // 1024} KB")
-                            except Exception as e:
-                                logger.error(f"下载媒体组图片到内存时出错: {str(e)}")
-                    
-                    has_media_to_process = len(image_files) > 0
-                    logger.info(f"共下载了 {len(image_files)} 张图片到内存")
-                    
-                # 检查单条消息是否有媒体并下载到内存
+                # 媒体组取组内所有消息，单条消息取自身；只上传图片
+                if context.is_media_group and context.media_group_messages:
+                    media_messages = context.media_group_messages
                 elif event.message and event.message.media:
-                    logger.info("检测到单条消息有媒体，下载到内存")
-                    try:
-                        # 创建内存缓冲区
-                        buffer = io.BytesIO()
-                        # 直接下载到内存
-                        await event.message.download_media(file=buffer)
-                        # 获取图片内容
-                        buffer.seek(0)
-                        content = buffer.read()
-                        
-                        # 获取MIME类型
-                        mime_type = "image/jpeg"  # 默认类型
-                        if hasattr(event.message.media, 'photo'):
-                            mime_type = "image/jpeg"
-                        elif hasattr(event.message.media, 'document') and hasattr(event.message.media.document, 'mime_type'):
-                            mime_type = event.message.media.document.mime_type
-                        
-                        # 保存到内存图片列表
-                        image_files.append({
-                            "data": base64.b64encode(content).decode('utf-8'),
-                            "mime_type": mime_type
-                        })
-                        has_media_to_process = True
-                        logger.info(f"已下载单条消息媒体到内存，类型: {mime_type}，大小: {len(content) // 1024} KB")
-                    except Exception as e:
-                        logger.error(f"下载单条消息媒体到内存时出错: {str(e)}")
+                    media_messages = [event.message]
+                else:
+                    media_messages = []
+
+                if media_messages:
+                    # 并发处理：从共享媒体缓存获取文件，缩放压缩后编码，多条规则共用处理结果
+                    results = await asyncio.gather(
+                        *(image_preparer.prepare(msg) for msg in media_messages)
+                    )
+                    image_files = [image for image in results if image]
+                    for image in image_files:
+                        logger.info(f"已准备图片，类型: {image['mime_type']}，编码后大小: {len(image['data']) // 1024} KB")
+
+                    has_media_to_process = len(image_files) > 0
+                    logger.info(f"共准备了 {len(image_files)} 张图片")
             
             # 如果有消息文本或图片，使用AI处理
             if context.message_text or has_media_to_process:
@@ -186,22 +116,24 @@ async def _ai_handle(message: str, rule, image_files=None) -> str:
             logger.info("AI处理未开启，返回原始消息")
             return message
         # 先读取数据库，如果ai模型为空，则使用.env中的默认模型
-        if not rule.ai_model:
-            rule.ai_model = DEFAULT_AI_MODEL
-            logger.info(f"使用默认AI模型: {rule.ai_model}")
+        # 规则快照只读，默认值保存在局部变量中
+        ai_model = rule.ai_model
+        if not ai_model:
+            ai_model = DEFAULT_AI_MODEL
+            logger.info(f"使用默认AI模型: {ai_model}")
         else:
-            logger.info(f"使用规则配置的AI模型: {rule.ai_model}")
+            logger.info(f"使用规则配置的AI模型: {ai_model}")
             
-        provider = await get_ai_provider(rule.ai_model)
+        provider = await get_ai_provider(ai_model)
         
-        if not rule.ai_prompt:
-            rule.ai_prompt = DEFAULT_AI_PROMPT
+        prompt = rule.ai_prompt
+        if not prompt:
+            prompt = DEFAULT_AI_PROMPT
             logger.info("使用默认AI提示词")
         else:
             logger.info("使用规则配置的AI提示词")
         
         # 处理特殊提示词格式
-        prompt = rule.ai_prompt
         if prompt:
             # 处理聊天记录提示词
             
@@ -289,7 +221,7 @@ async def _ai_handle(message: str, rule, image_files=None) -> str:
         processed_text = await provider.process_message(
             message=message,
             prompt=prompt,
-            model=rule.ai_model,
+            model=ai_model,
             images=img_data if img_data else None
         )
         logger.info(f"AI处理完成: {processed_text}")
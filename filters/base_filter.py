@@ -17,6 +17,18 @@ class BaseFilter(ABC):
         """
         self.name = name or self.__class__.__name__
         
+    def is_applicable(self, rule):
+        """
+        判断过滤器对该规则是否可能起作用，用于编译规则的过滤器链
+        
+        Args:
+            rule: 转发规则
+            
+        Returns:
+            bool: 返回False时该过滤器不会加入此规则的过滤器链
+        """
+        return True
+        
     async def process(self, context):
         """
         处理消息上下文
@@ -16,6 +16,10 @@ class CommentButtonFilter(BaseFilter):
     评论区按钮过滤器，用于在消息中添加指向关联群组消息的按钮
     """
     
+    def is_applicable(self, rule):
+        """仅在启用评论区按钮且不是只转发到RSS时需要"""
+        return bool(rule.enable_comment_button and not rule.only_rss)
+    
     async def _process(self, context):
         """
         为消息添加评论区按钮
@@ -98,26 +102,14 @@ class CommentButtonFilter(BaseFilter):
                     
                     if hasattr(event.message, 'grouped_id') and event.message.grouped_id:
                         logger.info(f"检测到媒体组消息，组ID: {event.message.grouped_id}")
-                        # 获取同一媒体组的所有消息
-                        media_group_messages = []
                         
                         try:
-                            # 获取频道历史消息
-                            async for message in client.iter_messages(
-                                channel_entity,
-                                limit=20,  # 限制查询消息数量
-                                offset_date=event.message.date,  # 从当前消息时间开始查询
-                                reverse=False  # 从新到旧
-                            ):
-                                # 检查是否属于同一媒体组
-                                if (hasattr(message, 'grouped_id') and 
-                                    message.grouped_id == event.message.grouped_id):
-                                    media_group_messages.append(message)
+                            # 获取同一媒体组的所有消息（已按ID排序）
+                            media_group_messages = await context.prepared.get_group_messages()
                             
                             if media_group_messages:
-                                # 找出ID最小的消息
-                                min_id_message = min(media_group_messages, key=lambda x: x.id)
-                                channel_msg_id = min_id_message.id
+                                # 使用ID最小的消息
+                                channel_msg_id = media_group_messages[0].id
                                 logger.info(f"使用媒体组中ID最小的消息: {channel_msg_id}")
                         except Exception as e:
                             logger.error(f"获取媒体组消息失败: {e}")
@@ -1,11 +1,12 @@
 import copy
+from utils.tracing import current_trace_id
 
 class MessageContext:
     """
     消息上下文类，包含处理消息所需的所有信息
     """
     
-    def __init__(self, client, event, chat_id, rule):
+    def __init__(self, client, event, chat_id, rule, prepared=None):
         """
         初始化消息上下文
         
@@ -14,12 +15,19 @@ class MessageContext:
             event: 消息事件
             chat_id: 聊天ID
             rule: 转发规则
+            prepared: 多条规则共享的消息预处理结果
         """
         self.client = client
         self.event = event
         self.chat_id = chat_id
         self.rule = rule
         
+        # 所属追踪的ID，用于关联同一条消息在各环节的日志和耗时
+        self.trace_id = current_trace_id()
+        
+        # 共享的预处理结果（媒体组消息、发送者信息、已下载的媒体）
+        self.prepared = prepared
+        
         # 初始消息文本，保持不变用于引用
         self.original_message_text = event.message.text or ''
         
@@ -31,6 +39,12 @@ class MessageContext:
         
         # 记录处理过程中的媒体文件
         self.media_files = []
+
+        # 等待直接引用发送、暂未下载的媒体消息
+        self.deferred_media = []
+
+        # 媒体的发送方式：reference（引用原文件）或 upload（下载后上传）
+        self.send_path = None
         
         # 记录发送者信息
         self.sender_info = ''
@@ -1,4 +1,5 @@
 import asyncio
+import copy
 import logging
 from filters.base_filter import BaseFilter
 from utils.common import get_main_module
@@ -14,6 +15,10 @@ class DelayFilter(BaseFilter):
     重新获取消息的最新内容再进行处理。
     """
     
+    def is_applicable(self, rule):
+        """仅在启用延迟处理时需要"""
+        return bool(rule.enable_delay and rule.delay_seconds > 0)
+    
     async def _process(self, context):
         """
         根据规则配置，决定是否等待并获取最新的消息内容
@@ -68,7 +73,8 @@ class DelayFilter(BaseFilter):
                     context.message_text = updated_text
                     context.check_message_text = updated_text
                     
-                    # 更新事件中的消息对象
+                    # 更新事件中的消息对象（事件在多条规则间共享，先复制再修改）
+                    context.event = copy.copy(context.event)
                     context.event.message = updated_message
                     
                     # 更新其他相关字段
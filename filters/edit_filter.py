@@ -14,6 +14,10 @@ class EditFilter(BaseFilter):
     仅在频道消息中生效
     """
     
+    def is_applicable(self, rule):
+        """仅在编辑模式下需要"""
+        return rule.handle_mode == HandleMode.EDIT
+    
     async def _process(self, context):
         """
         处理消息编辑
@@ -1,9 +1,29 @@
 import logging
+import time
 from filters.base_filter import BaseFilter
 from filters.context import MessageContext
+from filters.prepared_message import PreparedMessage
+from managers.dedup_journal import dedup_journal
+from utils.metrics import registry, Histogram
+from utils.tracing import span
 
 logger = logging.getLogger(__name__)
 
+# 过滤器执行指标，导出的指标不带规则ID标签，避免序列数随规则数增长；单条规则的细节见追踪 span
+FILTER_DURATION = registry.histogram(
+    'tf_filter_duration_seconds', '单个过滤器的执行耗时', ('filter', 'outcome')
+)
+FILTER_OUTCOMES = registry.counter(
+    'tf_filter_outcomes_total', '过滤器执行结果计数（pass/stop/error）', ('filter', 'outcome')
+)
+CHAIN_DURATION = registry.histogram(
+    'tf_chain_duration_seconds', '整条过滤器链的执行耗时', ('outcome',)
+)
+# 按规则统计的过滤器链耗时，不注册到 registry（不导出），只用于定期日志汇总
+RULE_CHAIN_DURATION = Histogram(
+    'tf_rule_chain_duration_seconds', '单条规则的过滤器链执行耗时', ('rule_id', 'outcome')
+)
+
 class FilterChain:
     """
     过滤器链，用于组织和执行多个过滤器
@@ -25,7 +45,7 @@ class FilterChain:
         self.filters.append(filter_obj)
         return self
         
-    async def process(self, client, event, chat_id, rule):
+    async def process(self, client, event, chat_id, rule, prepared=None):
         """
         处理消息
         
@@ -34,26 +54,55 @@ class FilterChain:
             event: 消息事件
             chat_id: 聊天ID
             rule: 转发规则
+            prepared: 共享的消息预处理结果，为空时由本次处理单独创建并负责清理
             
         Returns:
             bool: 表示处理是否成功
         """
+        # 重启或重连后重放的消息，已经投递过则跳过
+        if await dedup_journal.is_delivered(chat_id, event.message.id, rule.id):
+            logger.info(f"消息 {event.message.id} 已通过规则 {rule.id} 转发过，跳过")
+            FILTER_OUTCOMES.inc('DedupJournal', 'stop')
+            return False
+
+        owns_prepared = prepared is None
+        if owns_prepared:
+            prepared = PreparedMessage(event)
+
         # 创建消息上下文
-        context = MessageContext(client, event, chat_id, rule)
+        context = MessageContext(client, event, chat_id, rule, prepared)
         
         logger.info(f"开始过滤器链处理，共 {len(self.filters)} 个过滤器")
         
-        # 依次执行每个过滤器
-        for filter_obj in self.filters:
-            try:
-                should_continue = await filter_obj.process(context)
-                if not should_continue:
-                    logger.info(f"过滤器 {filter_obj.name} 中断了处理链")
+        chain_started = time.perf_counter()
+        chain_outcome = 'error'
+        try:
+            # 依次执行每个过滤器
+            for filter_obj in self.filters:
+                started = time.perf_counter()
+                outcome = 'error'
+                try:
+                    with span(f'filter:{filter_obj.name}', rule_id=rule.id):
+                        should_continue = await filter_obj.process(context)
+                    outcome = 'pass' if should_continue else 'stop'
+                    if not should_continue:
+                        logger.info(f"过滤器 {filter_obj.name} 中断了处理链")
+                        chain_outcome = 'stop'
+                        return False
+                except Exception as e:
+                    logger.error(f"过滤器 {filter_obj.name} 处理出错: {str(e)}")
+                    context.errors.append(f"过滤器 {filter_obj.name} 错误: {str(e)}")
                     return False
-            except Exception as e:
-                logger.error(f"过滤器 {filter_obj.name} 处理出错: {str(e)}")
-                context.errors.append(f"过滤器 {filter_obj.name} 错误: {str(e)}")
-                return False
-        
-        logger.info("过滤器链处理完成")
-        return True 
\ No newline at end of file
+                finally:
+                    FILTER_DURATION.observe(time.perf_counter() - started, filter_obj.name, outcome)
+                    FILTER_OUTCOMES.inc(filter_obj.name, outcome)
+            
+            logger.info("过滤器链处理完成")
+            chain_outcome = 'pass'
+            return True
+        finally:
+            chain_elapsed = time.perf_counter() - chain_started
+            CHAIN_DURATION.observe(chain_elapsed, chain_outcome)
+            RULE_CHAIN_DURATION.observe(chain_elapsed, rule.id, chain_outcome)
+            if owns_prepared:
+                prepared.cleanup()
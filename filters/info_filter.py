@@ -12,6 +12,10 @@ class InfoFilter(BaseFilter):
     信息过滤器，添加原始链接和发送者信息
     """
     
+    def is_applicable(self, rule):
+        """仅在需要附加原始链接、发送者或时间信息时需要"""
+        return bool(rule.is_original_link or rule.is_original_sender or rule.is_original_time)
+    
     async def _process(self, context):
         """
         添加原始链接和发送者信息
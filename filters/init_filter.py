@@ -34,22 +34,17 @@ class InitFilter(BaseFilter):
                 # 等待更长时间让所有媒体消息到达
                 # await asyncio.sleep(1)
                 
-                # 收集媒体组的所有消息
+                # 收集媒体组的所有消息（多条规则共享同一次获取）
                 try:
-                    async for message in event.client.iter_messages(
-                        event.chat_id,
-                        limit=20,
-                        min_id=event.message.id - 10,
-                        max_id=event.message.id + 10
-                    ):
-                        if message.grouped_id == event.message.grouped_id:
-                            if message.text:    
-                                # 保存第一条消息的文本和按钮
-                                context.message_text = message.text or ''
-                                context.original_message_text = message.text or ''
-                                context.check_message_text = message.text or ''
-                                context.buttons = message.buttons if hasattr(message, 'buttons') else None
+                    for message in await context.prepared.get_group_messages():
+                        if message.text:
+                            # 保存第一条消息的文本和按钮
+                            context.message_text = message.text or ''
+                            context.original_message_text = message.text or ''
+                            context.check_message_text = message.text or ''
+                            context.buttons = message.buttons if hasattr(message, 'buttons') else None
                             logger.info(f'获取到媒体组文本并添加到context: {message.text}')
+                            break
                         
                 except Exception as e:
                     logger.error(f'收集媒体组消息时出错: {str(e)}')
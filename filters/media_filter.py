@@ -1,15 +1,9 @@
 import logging
 import os
-import asyncio
-from utils.media import get_media_size
-from utils.constants import TEMP_DIR
+from utils.constants import TEMP_DIR, SEND_BY_REFERENCE
 from filters.base_filter import BaseFilter
 from utils.media import get_max_media_size
 from enums.enums import PreviewMode
-from models.models import MediaTypes
-from models.models import get_session
-from sqlalchemy import text
-from utils.common import get_db_ops
 from enums.enums import AddMode
 logger = logging.getLogger(__name__)
 
@@ -53,67 +47,45 @@ class MediaFilter(BaseFilter):
         
         logger.info(f'处理媒体组消息 组ID: {event.message.grouped_id}')
         
-        # 等待更长时间让所有媒体消息到达
-        await asyncio.sleep(1)
-        
         # 获取媒体类型设置
-        media_types = None
-        if rule.enable_media_type_filter:
-            session = get_session()
-            try:
-                media_types = session.query(MediaTypes).filter_by(rule_id=rule.id).first()
-            finally:
-                session.close()
+        media_types = rule.media_types if rule.enable_media_type_filter else None
         
         # 收集媒体组的所有消息
         total_media_count = 0  # 总媒体数量
         blocked_media_count = 0  # 被屏蔽的媒体数量
         try:
-            async for message in event.client.iter_messages(
-                event.chat_id,
-                limit=20,
-                min_id=event.message.id - 10,
-                max_id=event.message.id + 10
-            ):
-                if message.grouped_id == event.message.grouped_id:
-                    if message.media:
-                        total_media_count += 1
-                        # 检查媒体类型
-                        if rule.enable_media_type_filter and media_types and message.media:
-                            if await self._is_media_type_blocked(message.media, media_types):
-                                logger.info(f'媒体类型被屏蔽，跳过消息 ID={message.id}')
-                                blocked_media_count += 1
-                                continue
-                        
-                        # 检查媒体扩展名
-                        if rule.enable_extension_filter and message.media:
-                            if not await self._is_media_extension_allowed(rule, message.media):
-                                logger.info(f'媒体扩展名被屏蔽，跳过消息 ID={message.id}')
-                                blocked_media_count += 1
-                                continue
+            for message in await context.prepared.get_group_messages():
+                if message.media:
+                    total_media_count += 1
+                    # 检查媒体类型
+                    if rule.enable_media_type_filter and media_types and message.media:
+                        if await self._is_media_type_blocked(message.media, media_types):
+                            logger.info(f'媒体类型被屏蔽，跳过消息 ID={message.id}')
+                            blocked_media_count += 1
+                            continue
                     
-                    # 检查媒体大小
-                    if message.media:
-                        file_size = await get_media_size(message.media)
-                        file_size = round(file_size/1024/1024, 2)  # 转换为MB
-                        logger.info(f'媒体文件大小: {file_size}MB')
-                        logger.info(f'规则最大媒体大小: {rule.max_media_size}MB')
-                        logger.info(f'是否启用媒体大小过滤: {rule.enable_media_size_filter}')
-                        logger.info(f'是否发送媒体大小超限提醒: {rule.is_send_over_media_size_message}')
-                        
-                        if rule.max_media_size and (file_size > rule.max_media_size) and rule.enable_media_size_filter:
-                            file_name = ''
-                            if hasattr(message.media, 'document') and message.media.document:
-                                for attr in message.media.document.attributes:
-                                    if hasattr(attr, 'file_name'):
-                                        file_name = attr.file_name
-                                        break
-                            logger.info(f'媒体文件 {file_name} 超过大小限制 ({rule.max_media_size}MB)')
-                            context.skipped_media.append((message, file_size, file_name))
+                    # 检查媒体扩展名
+                    if rule.enable_extension_filter and message.media:
+                        if not await self._is_media_extension_allowed(rule, message.media):
+                            logger.info(f'媒体扩展名被屏蔽，跳过消息 ID={message.id}')
+                            blocked_media_count += 1
                             continue
+                
+                # 检查媒体大小
+                if message.media:
+                    file_size, file_name = await context.prepared.get_media_info(message)
+                    logger.info(f'媒体文件大小: {file_size}MB')
+                    logger.info(f'规则最大媒体大小: {rule.max_media_size}MB')
+                    logger.info(f'是否启用媒体大小过滤: {rule.enable_media_size_filter}')
+                    logger.info(f'是否发送媒体大小超限提醒: {rule.is_send_over_media_size_message}')
                     
-                    context.media_group_messages.append(message)
-                    logger.info(f'找到媒体组消息: ID={message.id}, 类型={type(message.media).__name__ if message.media else "无媒体"}')
+                    if rule.max_media_size and (file_size > rule.max_media_size) and rule.enable_media_size_filter:
+                        logger.info(f'媒体文件 {file_name} 超过大小限制 ({rule.max_media_size}MB)')
+                        context.skipped_media.append((message, file_size, file_name))
+                        continue
+                
+                context.media_group_messages.append(message)
+                logger.info(f'找到媒体组消息: ID={message.id}, 类型={type(message.media).__name__ if message.media else "无媒体"}')
         except Exception as e:
             logger.error(f'收集媒体组消息时出错: {str(e)}')
             context.errors.append(f"收集媒体组消息错误: {str(e)}")
@@ -175,20 +147,16 @@ class MediaFilter(BaseFilter):
         if has_media:
             # 检查媒体类型是否被屏蔽
             if rule.enable_media_type_filter:
-                session = get_session()
-                try:
-                    media_types = session.query(MediaTypes).filter_by(rule_id=rule.id).first()
-                    if media_types and await self._is_media_type_blocked(event.message.media, media_types):
-                        logger.info(f'媒体类型被屏蔽，跳过消息 ID={event.message.id}')
-                        # 检查是否允许文本通过
-                        if rule.media_allow_text:
-                            logger.info('媒体被屏蔽但允许文本通过')
-                            context.media_blocked = True  # 标记媒体被屏蔽
-                        else:
-                            context.should_forward = False
-                        return True
-                finally:
-                    session.close()
+                media_types = rule.media_types
+                if media_types and await self._is_media_type_blocked(event.message.media, media_types):
+                    logger.info(f'媒体类型被屏蔽，跳过消息 ID={event.message.id}')
+                    # 检查是否允许文本通过
+                    if rule.media_allow_text:
+                        logger.info('媒体被屏蔽但允许文本通过')
+                        context.media_blocked = True  # 标记媒体被屏蔽
+                    else:
+                        context.should_forward = False
+                    return True
             
             # 检查媒体扩展名
             if rule.enable_extension_filter and event.message.media:
@@ -203,8 +171,7 @@ class MediaFilter(BaseFilter):
                     return True
             
             # 检查媒体大小
-            file_size = await get_media_size(event.message.media)
-            file_size = round(file_size/1024/1024, 2)
+            file_size, file_name = await context.prepared.get_media_info(event.message)
             logger.info(f'event.message.document: {event.message.document}')
             
             logger.info(f'媒体文件大小: {file_size}MB')
@@ -212,14 +179,6 @@ class MediaFilter(BaseFilter):
             
             logger.info(f'是否启用媒体大小过滤: {rule.enable_media_size_filter}')
             if rule.max_media_size and (file_size > rule.max_media_size) and rule.enable_media_size_filter:
-                file_name = ''
-                if event.message.document:
-                    # 正确地从文档属性中获取文件名
-                    for attr in event.message.document.attributes:
-                        if hasattr(attr, 'file_name'):
-                            file_name = attr.file_name
-                            break
-                
                 logger.info(f'媒体文件超过大小限制 ({rule.max_media_size}MB)')
                 if rule.is_send_over_media_size_message:
                     logger.info(f'是否发送媒体大小超限提醒: {rule.is_send_over_media_size_message}')
@@ -239,12 +198,15 @@ class MediaFilter(BaseFilter):
                 # 如果只转发到RSS，则跳过下载媒体文件，交给RSS处理下载
                 if rule.only_rss:
                     return True
+                # 可以直接引用原文件发送时暂不下载，由发送阶段决定是否需要下载
+                if SEND_BY_REFERENCE:
+                    context.deferred_media.append(event.message)
+                    return True
                 try:
-                    # 下载媒体文件
-                    file_path = await event.message.download_media(TEMP_DIR)
+                    # 下载媒体文件（多条规则共享同一份下载）
+                    file_path = await context.prepared.download(event.message)
                     if file_path:
                         context.media_files.append(file_path)
-                        logger.info(f'媒体文件已下载到: {file_path}')
                 except Exception as e:
                     logger.error(f'下载媒体文件时出错: {str(e)}')
                     context.errors.append(f"下载媒体文件错误: {str(e)}")
@@ -259,7 +221,7 @@ class MediaFilter(BaseFilter):
         
         Args:
             media: 媒体对象
-            media_types: MediaTypes对象
+            media_types: 媒体类型设置（规则快照中的 media_types）
             
         Returns:
             bool: 如果媒体类型被屏蔽返回True，否则返回False
@@ -327,37 +289,22 @@ class MediaFilter(BaseFilter):
         else:
             logger.info(f"文件 {file_name} 的扩展名: {extension}")
         
-        # 获取规则中保存的扩展名列表
-        db_ops = await get_db_ops()
-        session = get_session()
-        allowed = True
-        try:
-            # 使用db_operations中的函数获取扩展名列表
-            extensions = await db_ops.get_media_extensions(session, rule.id)
-            extension_list = [ext["extension"].lower() for ext in extensions]
-            
-            # 判断是否允许该扩展名
-            if rule.extension_filter_mode == AddMode.BLACKLIST:
-                # 黑名单模式：如果扩展名在列表中，则不允许
-                if extension in extension_list:
-                    logger.info(f"扩展名 {extension} 在黑名单中，不允许")
-                    allowed = False
-                else:
-                    logger.info(f"扩展名 {extension} 不在黑名单中，允许")
-                    allowed = True
-            else:
-                # 白名单模式：如果扩展名不在列表中，则不允许
-                if extension in extension_list:
-                    logger.info(f"扩展名 {extension} 在白名单中，允许")
-                    allowed = True
-                else:
-                    logger.info(f"扩展名 {extension} 不在白名单中，不允许")
-                    allowed = False
-        except Exception as e:
-            logger.error(f"检查媒体扩展名时出错: {str(e)}")
-            allowed = True  # 出错时默认允许
-        finally:
-            session.close()
-            
-        return allowed
+        # 规则快照中保存的扩展名列表（已转为小写）
+        extension_list = rule.media_extensions
+        
+        # 判断是否允许该扩展名
+        if rule.extension_filter_mode == AddMode.BLACKLIST:
+            # 黑名单模式：如果扩展名在列表中，则不允许
+            if extension in extension_list:
+                logger.info(f"扩展名 {extension} 在黑名单中，不允许")
+                return False
+            logger.info(f"扩展名 {extension} 不在黑名单中，允许")
+            return True
+        
+        # 白名单模式：如果扩展名不在列表中，则不允许
+        if extension in extension_list:
+            logger.info(f"扩展名 {extension} 在白名单中，允许")
+            return True
+        logger.info(f"扩展名 {extension} 不在白名单中，不允许")
+        return False
 
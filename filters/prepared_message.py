@@ -0,0 +1,193 @@
+import asyncio
+import logging
+
+from telethon.tl import types
+
+from managers.media_cache import media_cache
+from utils.common import get_sender_info
+from utils.media import get_media_size
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class PreparedMessage:
+    """
+    一条消息的共享预处理结果
+
+    同一条消息命中多条规则时，所有规则的过滤器链共享同一个 PreparedMessage：
+    媒体组消息、发送者信息、媒体元数据只获取一次，媒体文件按需从共享媒体缓存获取。
+    PreparedMessage 持有缓存文件的引用，所有规则处理完成后统一释放。
+    """
+
+    def __init__(self, event, group_messages=None):
+        """
+        初始化共享预处理结果
+
+        Args:
+            event: 消息事件
+            group_messages: 监听器汇总的媒体组消息列表，非媒体组消息为空
+        """
+        self.event = event
+        self._group_messages = sorted(group_messages, key=lambda m: m.id) if group_messages else None
+        self._sender_info = None
+        self._sender_loaded = False
+        self._sender_lock = asyncio.Lock()
+        self._media_info = {}
+        self._downloads = {}
+        self._owned_files = set()
+        self._references = {}
+
+    async def get_group_messages(self):
+        """
+        获取媒体组中的所有消息（按ID排序）
+
+        Returns:
+            list: 媒体组消息列表，非媒体组消息返回空列表
+        """
+        message = self.event.message
+        if not getattr(message, 'grouped_id', None):
+            return []
+        if self._group_messages is None:
+            # 媒体组由监听器汇总后传入，不再查询历史消息；未传入时只包含当前消息
+            logger.warning(f'媒体组 {message.grouped_id} 未传入组内消息，只处理当前消息')
+            self._group_messages = [message]
+        return self._group_messages
+
+    async def get_sender_info(self, rule_id=None):
+        """获取发送者名称，只解析一次"""
+        if self._sender_loaded:
+            return self._sender_info
+        async with self._sender_lock:
+            if not self._sender_loaded:
+                with span('telegram:get_sender'):
+                    self._sender_info = await get_sender_info(self.event, rule_id)
+                self._sender_loaded = True
+        return self._sender_info
+
+    async def get_media_info(self, message):
+        """
+        获取消息媒体的元数据
+
+        Returns:
+            tuple: (大小MB, 文件名)
+        """
+        cached = self._media_info.get(message.id)
+        if cached is not None:
+            return cached
+
+        file_size = await get_media_size(message.media)
+        file_size = round(file_size / 1024 / 1024, 2)
+        file_name = ''
+        document = getattr(message.media, 'document', None)
+        if document:
+            for attr in document.attributes:
+                if hasattr(attr, 'file_name'):
+                    file_name = attr.file_name
+                    break
+
+        self._media_info[message.id] = (file_size, file_name)
+        return file_size, file_name
+
+    async def download(self, message):
+        """
+        获取消息媒体的本地文件，同一条消息只获取一次
+
+        文件来自共享媒体缓存：其他消息或规则已下载过同一媒体时不会重新下载。
+
+        Args:
+            message: 包含媒体的消息
+
+        Returns:
+            str: 缓存文件路径，失败时返回 None
+        """
+        task = self._downloads.get(message.id)
+        if task is None:
+            task = asyncio.ensure_future(self._acquire(message))
+            self._downloads[message.id] = task
+        return await asyncio.shield(task)
+
+    async def download_all(self, messages):
+        """
+        并发获取多条消息（如媒体组）的媒体文件，受下载引擎的并发和带宽限制
+
+        Returns:
+            list: 与 messages 顺序一致的文件路径列表，下载失败的位置为 None
+        """
+        results = await asyncio.gather(
+            *(self.download(message) for message in messages),
+            return_exceptions=True
+        )
+        file_paths = []
+        for message, result in zip(messages, results):
+            if isinstance(result, BaseException):
+                logger.error(f'下载消息 {message.id} 的媒体文件时出错: {str(result)}')
+                result = None
+            file_paths.append(result)
+        return file_paths
+
+    async def _acquire(self, message):
+        file_path = await media_cache.acquire(message)
+        if file_path:
+            self._owned_files.add(file_path)
+        return file_path
+
+    async def get_media_references(self, client, messages):
+        """
+        获取 client 可以直接引用发送的媒体，无需下载后重新上传
+
+        消息由用户客户端接收，其中的文件引用只对该账号有效。由其他客户端（机器人）发送时，
+        需要用该客户端重新获取同一批消息，每个客户端只获取一次。
+
+        Args:
+            client: 发送消息的客户端
+            messages: 包含媒体的消息列表
+
+        Returns:
+            tuple: (媒体列表, None)，无法直接引用时为 (None, 原因)
+        """
+        chat = getattr(self.event, 'chat', None)
+        if getattr(chat, 'noforwards', False) or any(getattr(m, 'noforwards', False) for m in messages):
+            return None, 'protected'
+
+        if client is self.event.client:
+            resolved = messages
+        else:
+            key = (client, tuple(m.id for m in messages))
+            task = self._references.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._fetch_messages(client, [m.id for m in messages]))
+                self._references[key] = task
+            resolved = await asyncio.shield(task)
+            if resolved is None:
+                return None, 'client_mismatch'
+
+        media = []
+        for message in resolved:
+            if message is None or not isinstance(
+                message.media, (types.MessageMediaPhoto, types.MessageMediaDocument)
+            ):
+                return None, 'unsupported'
+            media.append(message.media)
+        return media, None
+
+    async def _fetch_messages(self, client, ids):
+        """用指定客户端重新获取消息，该客户端无法访问源聊天时返回 None"""
+        try:
+            with span('telegram:get_messages', count=len(ids)):
+                return list(await client.get_messages(self.event.chat_id, ids=ids))
+        except Exception as e:
+            logger.info(f'发送客户端无法获取源消息，改为下载上传: {str(e)}')
+            return None
+
+    def owns(self, file_path):
+        """判断文件是否由共享预处理持有（由媒体缓存负责清理）"""
+        return file_path in self._owned_files
+
+    def cleanup(self):
+        """释放所有媒体缓存引用，文件由缓存按容量淘汰"""
+        for file_path in self._owned_files:
+            media_cache.release(file_path)
+        self._owned_files.clear()
+        self._downloads.clear()
+        self._references.clear()
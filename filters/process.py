@@ -16,7 +16,77 @@ from filters.rss_filter import RSSFilter
 from filters.push_filter import PushFilter
 logger = logging.getLogger(__name__)
 
-async def process_forward_rule(client, event, chat_id, rule):
+# 所有过滤器按执行顺序排列，过滤器本身无状态，可在所有规则间共享（首次使用时创建）
+_filter_stages = None
+
+
+def get_filter_stages():
+    """获取按执行顺序排列的全部过滤器"""
+    global _filter_stages
+    if _filter_stages is None:
+        _filter_stages = (
+            # 初始化过滤器
+            InitFilter(),
+            # 延迟处理过滤器（如果启用了延迟处理）
+            DelayFilter(),
+            # 关键字过滤器（如果消息不匹配关键字，会中断处理链）
+            KeywordFilter(),
+            # 替换过滤器
+            ReplaceFilter(),
+            # 媒体过滤器（处理媒体内容）
+            MediaFilter(),
+            # AI处理过滤器（如果启用了AI处理后的关键字检查，可能会中断处理链）
+            AIFilter(),
+            # 信息过滤器（处理原始链接和发送者信息）
+            InfoFilter(),
+            # 评论区按钮过滤器
+            CommentButtonFilter(),
+            # RSS过滤器
+            RSSFilter(),
+            # 编辑过滤器（编辑原始消息）
+            EditFilter(),
+            # 发送过滤器（发送消息）
+            SenderFilter(),
+            # 回复过滤器（处理媒体组消息的评论区按钮）
+            ReplyFilter(),
+            # 推送过滤器
+            PushFilter(),
+            # 删除原始消息过滤器（最后执行）
+            DeleteOriginalFilter(),
+        )
+    return _filter_stages
+
+# 已编译的过滤器链，键为各过滤器对规则的适用情况
+_compiled_chains = {}
+
+
+def compile_filter_chain(rule):
+    """
+    根据规则配置获取只包含可能起作用的过滤器的过滤器链
+
+    过滤器链按规则配置的指纹缓存，配置相同的规则共享同一条链，
+    规则配置变更后指纹随之变化，自动使用新的过滤器链。
+
+    Args:
+        rule: 转发规则
+
+    Returns:
+        FilterChain: 编译后的过滤器链
+    """
+    stages = get_filter_stages()
+    fingerprint = tuple(stage.is_applicable(rule) for stage in stages)
+    filter_chain = _compiled_chains.get(fingerprint)
+    if filter_chain is None:
+        filter_chain = FilterChain()
+        for stage, applicable in zip(stages, fingerprint):
+            if applicable:
+                filter_chain.add_filter(stage)
+        _compiled_chains[fingerprint] = filter_chain
+        logger.info(f'编译过滤器链: {[stage.name for stage in filter_chain.filters]}')
+    return filter_chain
+
+
+async def process_forward_rule(client, event, chat_id, rule, prepared=None):
     """
     处理转发规则
     
@@ -25,58 +95,17 @@ async def process_forward_rule(client, event, chat_id, rule):
         event: 消息事件
         chat_id: 聊天ID
         rule: 转发规则
+        prepared: 同一消息多条规则共享的预处理结果（可选）
         
     Returns:
         bool: 处理是否成功
     """
     logger.info(f'使用过滤器链处理规则 ID: {rule.id}')
     
-    # 创建过滤器链
-    filter_chain = FilterChain()
-
-    # 添加初始化过滤器
-    filter_chain.add_filter(InitFilter())
-
-    # 延迟处理过滤器（如果启用了延迟处理）
-    filter_chain.add_filter(DelayFilter())
-    
-    # 添加关键字过滤器（如果消息不匹配关键字，会中断处理链）
-    filter_chain.add_filter(KeywordFilter())
-    
-    # 添加替换过滤器
-    filter_chain.add_filter(ReplaceFilter())
-
-    # 添加媒体过滤器（处理媒体内容）
-    filter_chain.add_filter(MediaFilter())
-    
-    # 添加AI处理过滤器（如果启用了AI处理后的关键字检查，可能会中断处理链）
-    filter_chain.add_filter(AIFilter())
-    
-    # 添加信息过滤器（处理原始链接和发送者信息）
-    filter_chain.add_filter(InfoFilter())
-    
-    # 添加评论区按钮过滤器
-    filter_chain.add_filter(CommentButtonFilter())
-
-    # 添加RSS过滤器
-    filter_chain.add_filter(RSSFilter())
-    
-    # 添加编辑过滤器（编辑原始消息）
-    filter_chain.add_filter(EditFilter())
-
-    # 添加发送过滤器（发送消息）
-    filter_chain.add_filter(SenderFilter())
-    
-    # 添加回复过滤器（处理媒体组消息的评论区按钮）
-    filter_chain.add_filter(ReplyFilter())
-
-    # 添加推送过滤器
-    filter_chain.add_filter(PushFilter())
-    
-    # 添加删除原始消息过滤器（最后执行）
-    filter_chain.add_filter(DeleteOriginalFilter())
+    # 获取该规则配置对应的过滤器链
+    filter_chain = compile_filter_chain(rule)
     
     # 执行过滤器链
-    result = await filter_chain.process(client, event, chat_id, rule)
+    result = await filter_chain.process(client, event, chat_id, rule, prepared)
     
     return result 
@@ -7,7 +7,7 @@ from datetime import datetime
 import traceback
 
 from filters.base_filter import BaseFilter
-from models.models import get_session, PushConfig
+from utils.tracing import span
 from enums.enums import PreviewMode
 
 logger = logging.getLogger(__name__)
@@ -17,6 +17,10 @@ class PushFilter(BaseFilter):
     推送过滤器，利用apprise库推送消息
     """
     
+    def is_applicable(self, rule):
+        """仅在启用推送时需要"""
+        return bool(rule.enable_push)
+    
     async def _process(self, context):
         """
         推送消息
@@ -38,7 +42,6 @@ class PushFilter(BaseFilter):
         
         # 获取规则ID和所有启用的推送配置
         rule_id = rule.id
-        session = get_session()
         
  
         logger.info(f"推送过滤器开始处理 - 规则ID: {rule_id}")
@@ -52,10 +55,7 @@ class PushFilter(BaseFilter):
         
         try:
             # 获取所有启用的推送配置
-            push_configs = session.query(PushConfig).filter(
-                PushConfig.rule_id == rule_id,
-                PushConfig.enable_push_channel == True
-            ).all()
+            push_configs = rule.enabled_push_configs
             
             if not push_configs:
                 logger.info(f'规则 {rule_id} 没有启用的推送配置，跳过推送')
@@ -65,7 +65,7 @@ class PushFilter(BaseFilter):
             if context.is_media_group or (context.media_group_messages and context.skipped_media):
                 processed_files = await self._push_media_group(context, push_configs)
             # 对单条媒体消息进行推送
-            elif context.media_files or context.skipped_media:
+            elif context.media_files or context.deferred_media or context.skipped_media:
                 processed_files = await self._push_single_media(context, push_configs)
             # 对纯文本消息进行推送
             else:
@@ -80,12 +80,13 @@ class PushFilter(BaseFilter):
             context.errors.append(f"推送错误: {str(e)}")
             return False
         finally:
-            session.close()
-            
             # 只清理已处理的媒体文件
             if processed_files:
                 logger.info(f'清理已处理的媒体文件，共 {len(processed_files)} 个')
                 for file_path in processed_files:
+                    # 共享预处理下载的文件由其统一清理
+                    if context.prepared.owns(file_path):
+                        continue
                     try:
                         if os.path.exists(str(file_path)):
                             os.remove(file_path)
@@ -134,12 +135,9 @@ class PushFilter(BaseFilter):
             if context.media_group_messages and not context.media_files:
                 logger.info(f'检测到媒体组消息但没有媒体文件，开始下载...')
                 need_cleanup = True
-                for message in context.media_group_messages:
-                    if message.media:
-                        file_path = await message.download_media(os.path.join(os.getcwd(), 'temp'))
-                        if file_path:
-                            files.append(file_path)
-                            logger.info(f'已下载媒体组文件: {file_path}')
+                media_messages = [message for message in context.media_group_messages if message.media]
+                files = [path for path in await context.prepared.download_all(media_messages) if path]
+                logger.info(f'已下载媒体组文件: {len(files)}个')
             # 如果SenderFilter已经下载了文件，使用它们
             elif context.media_files:
                 logger.info(f'使用SenderFilter已下载的文件: {len(context.media_files)}个')
@@ -148,12 +146,9 @@ class PushFilter(BaseFilter):
             elif rule.enable_only_push:
                 logger.info(f'需要自己下载文件，开始下载媒体组消息...')
                 need_cleanup = True
-                for message in context.media_group_messages:
-                    if message.media:
-                        file_path = await message.download_media(os.path.join(os.getcwd(), 'temp'))
-                        if file_path:
-                            files.append(file_path)
-                            logger.info(f'已下载媒体文件: {file_path}')
+                media_messages = [message for message in context.media_group_messages if message.media]
+                files = [path for path in await context.prepared.download_all(media_messages) if path]
+                logger.info(f'已下载媒体文件: {len(files)}个')
             
             # 如果有可用的媒体文件，构建推送内容
             if files:
@@ -230,6 +225,8 @@ class PushFilter(BaseFilter):
             # 如果是自己下载的文件，立即清理
             if need_cleanup:
                 for file_path in files:
+                    if context.prepared.owns(file_path):
+                        continue
                     try:
                         if os.path.exists(str(file_path)):
                             os.remove(file_path)
@@ -255,7 +252,7 @@ class PushFilter(BaseFilter):
         processed_files = []
         
         # 检查是否所有媒体都超限
-        if context.skipped_media and not context.media_files:
+        if context.skipped_media and not context.media_files and not context.deferred_media:
             # 构建提示信息
             file_size = context.skipped_media[0][1]
             file_name = context.skipped_media[0][2]
@@ -290,10 +287,10 @@ class PushFilter(BaseFilter):
                 logger.info(f'使用SenderFilter已下载的文件: {len(context.media_files)}个')
                 files = context.media_files
             # 否则，需要自己下载文件
-            elif rule.enable_only_push and event.message and event.message.media:
+            elif (rule.enable_only_push or context.deferred_media) and event.message and event.message.media:
                 logger.info(f'需要自己下载文件，开始下载单个媒体消息...')
                 need_cleanup = True
-                file_path = await event.message.download_media(os.path.join(os.getcwd(), 'temp'))
+                file_path = await context.prepared.download(event.message)
                 if file_path:
                     files.append(file_path)
                     logger.info(f'已下载媒体文件: {file_path}')
@@ -347,6 +344,8 @@ class PushFilter(BaseFilter):
             # 如果是自己下载的文件，需要清理
             if need_cleanup:
                 for file_path in files:
+                    if context.prepared.owns(file_path):
+                        continue
                     try:
                         if os.path.exists(str(file_path)):
                             os.remove(file_path)
@@ -404,30 +403,31 @@ class PushFilter(BaseFilter):
                     logger.error(f'添加推送服务失败: {service_url}')
                     continue
                 
-                # 发送推送
-                if all_attachments and len(all_attachments) > 0 and config.media_send_mode == "Multiple":
-                    # 尝试一次性发送所有附件
-                    logger.info(f'发送带{len(all_attachments)}个附件的推送，模式: {config.media_send_mode}')
-                    send_result = await asyncio.to_thread(
-                        apobj.notify,
-                        body=body or f"收到{len(all_attachments)}个媒体文件",
-                        attach=all_attachments
-                    )
-                elif attachment and os.path.exists(str(attachment)):
-                    # 单附件推送
-                    logger.info(f'发送带单个附件的推送: {os.path.basename(str(attachment))}')
-                    send_result = await asyncio.to_thread(
-                        apobj.notify,
-                        body=body or " ",
-                        attach=attachment
-                    )
-                else:
-                    # 纯文本推送
-                    logger.info('发送纯文本推送')
-                    send_result = await asyncio.to_thread(
-                        apobj.notify,
-                        body=body
-                    )
+                # 发送推送（只记录服务类型，推送地址中可能含有密钥）
+                with span('apprise:notify', service=service_url.split('://')[0]):
+                    if all_attachments and len(all_attachments) > 0 and config.media_send_mode == "Multiple":
+                        # 尝试一次性发送所有附件
+                        logger.info(f'发送带{len(all_attachments)}个附件的推送，模式: {config.media_send_mode}')
+                        send_result = await asyncio.to_thread(
+                            apobj.notify,
+                            body=body or f"收到{len(all_attachments)}个媒体文件",
+                            attach=all_attachments
+                        )
+                    elif attachment and os.path.exists(str(attachment)):
+                        # 单附件推送
+                        logger.info(f'发送带单个附件的推送: {os.path.basename(str(attachment))}')
+                        send_result = await asyncio.to_thread(
+                            apobj.notify,
+                            body=body or " ",
+                            attach=attachment
+                        )
+                    else:
+                        # 纯文本推送
+                        logger.info('发送纯文本推送')
+                        send_result = await asyncio.to_thread(
+                            apobj.notify,
+                            body=body
+                        )
                 
                 if send_result:
                     logger.info(f'推送发送成功: {service_url}')
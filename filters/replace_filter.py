@@ -1,6 +1,6 @@
 import logging
-import re
 from filters.base_filter import BaseFilter
+from managers.replace_index import replace_index
 
 logger = logging.getLogger(__name__)
 
@@ -9,6 +9,10 @@ class ReplaceFilter(BaseFilter):
     替换过滤器，根据规则替换消息文本
     """
     
+    def is_applicable(self, rule):
+        """仅在启用替换时需要"""
+        return bool(rule.is_replace)
+    
     async def _process(self, context):
         """
         处理消息文本替换
@@ -29,28 +33,8 @@ class ReplaceFilter(BaseFilter):
             return True
         
         try:
-            # 应用所有替换规则
-            for replace_rule in rule.replace_rules:
-                if replace_rule.pattern == '.*':
-                    # 全文替换
-                    logger.info(f'执行全文替换:\n原文: "{message_text}"\n替换为: "{replace_rule.content or ""}"')
-                    message_text = replace_rule.content or ''
-                    break  # 如果是全文替换，就不继续处理其他规则
-                else:
-                    try:
-                        # 正则替换
-                        old_text = message_text
-                        matches = re.finditer(replace_rule.pattern, message_text)
-                        message_text = re.sub(
-                            replace_rule.pattern,
-                            replace_rule.content or '',
-                            message_text
-                        )
-                        if old_text != message_text:
-                            matched_texts = [m.group(0) for m in matches]
-                            logger.info(f'执行部分替换:\n原文: "{old_text}"\n匹配内容: {matched_texts}\n替换规则: "{replace_rule.pattern}" -> "{replace_rule.content}"\n替换后: "{message_text}"')
-                    except re.error as e:
-                        logger.error(f'替换规则格式错误: {replace_rule.pattern}, 错误: {str(e)}')
+            # 应用编译好的替换程序
+            message_text = await replace_index.get_program(rule).run(message_text)
             
             # 更新上下文中的消息文本
             context.message_text = message_text
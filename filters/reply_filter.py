@@ -12,6 +12,10 @@ class ReplyFilter(BaseFilter):
     由于媒体组消息无法直接添加按钮，此过滤器会使用bot回复已转发的消息，并添加评论区按钮
     """
     
+    def is_applicable(self, rule):
+        """仅在启用评论区按钮时需要"""
+        return bool(rule.enable_comment_button)
+    
     async def _process(self, context):
         """
         处理媒体组消息的评论区按钮
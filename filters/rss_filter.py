@@ -6,12 +6,11 @@ import mimetypes
 import json
 from pathlib import Path
 from datetime import datetime
-import shutil
 from filters.base_filter import BaseFilter
+from managers.media_cache import media_cache, link_or_copy
+from utils.tracing import span
 import uuid
 from utils.constants import TEMP_DIR, RSS_MEDIA_DIR, get_rule_media_dir,RSS_HOST,RSS_PORT,RSS_ENABLED
-from models.models import get_session
-from utils.common import get_db_ops
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +39,10 @@ class RSSFilter(BaseFilter):
         """获取规则特定的媒体目录"""
         return get_rule_media_dir(rule_id)
     
+    def is_applicable(self, rule):
+        """仅在RSS服务启用时需要，具体规则的RSS配置在处理时检查"""
+        return RSS_ENABLED.lower() == 'true'
+    
     async def _process(self, context):
         """处理RSS过滤器逻辑"""
         
@@ -50,22 +53,18 @@ class RSSFilter(BaseFilter):
         if not context.should_forward:
             return False
         
-        db_ops = await get_db_ops()
-        session = get_session()
-        rss_config = await db_ops.get_rss_config(session, context.rule.id)
+        rss_config = context.rule.rss_config
         logger.info(f"规则ID: {context.rule.id}")
         logger.info(f"RSS配置: {rss_config}")
 
         # 检查RSS配置是否存在
         if rss_config is None:
             logger.error(f"找不到规则ID为 {context.rule.id} 的RSS配置，跳过RSS处理")
-            session.close()
             return True
         
         # 检查是否启用RSS
         if not rss_config.enable_rss:
             logger.info(f"规则ID为 {context.rule.id} 的RSS未启用，跳过RSS处理")
-            session.close()
             return True
 
         # 执行RSS规则前，先确保媒体文件已经下载
@@ -329,7 +328,7 @@ class RSSFilter(BaseFilter):
                 local_path = os.path.join(rule_media_path, file_name)
                 try:
                     if not os.path.exists(local_path):
-                        await message.download_media(local_path)
+                        await media_cache.link(message, local_path)
                         logger.info(f"下载媒体文件到: {local_path}")
                     
                     # 获取文件大小和MIME类型
@@ -364,7 +363,7 @@ class RSSFilter(BaseFilter):
                 
                 try:
                     if not os.path.exists(local_path):
-                        await message.download_media(local_path)
+                        await media_cache.link(message, local_path)
                         logger.info(f"下载图片到: {local_path}")
                     
                     # 获取文件大小
@@ -408,7 +407,7 @@ class RSSFilter(BaseFilter):
                 
                 try:
                     if not os.path.exists(local_path):
-                        await message.download_media(local_path)
+                        await media_cache.link(message, local_path)
                         logger.info(f"下载视频到: {local_path}")
                     
                     # 获取文件大小和MIME类型
@@ -453,7 +452,7 @@ class RSSFilter(BaseFilter):
                 
                 try:
                     if not os.path.exists(local_path):
-                        await message.download_media(local_path)
+                        await media_cache.link(message, local_path)
                         logger.info(f"下载音频到: {local_path}")
                     
                     # 获取文件大小和MIME类型
@@ -489,7 +488,7 @@ class RSSFilter(BaseFilter):
                 
                 try:
                     if not os.path.exists(local_path):
-                        await message.download_media(local_path)
+                        await media_cache.link(message, local_path)
                         logger.info(f"下载语音到: {local_path}")
                     
                     # 获取文件大小
@@ -540,15 +539,16 @@ class RSSFilter(BaseFilter):
                 debug_data["media"] = f"{len(debug_data['media'])} 个媒体文件: {', '.join(media_files)}"
             logger.info(f"发送到RSS服务: {url}, 数据: {debug_data}")
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=entry_data) as response:
-                    response_text = await response.text()
-                    if response.status != 200:
-                        logger.error(f"发送到RSS服务失败: {response.status} - {response_text}")
-                        return False
-                    
-                    logger.info(f"成功发送到RSS服务, 规则ID: {rule_id}, 响应: {response_text}")
-                    return True
+            with span('rss:post_entry', rule_id=rule_id):
+                async with aiohttp.ClientSession() as session:
+                    async with session.post(url, json=entry_data) as response:
+                        response_text = await response.text()
+                        if response.status != 200:
+                            logger.error(f"发送到RSS服务失败: {response.status} - {response_text}")
+                            return False
+                        
+                        logger.info(f"成功发送到RSS服务, 规则ID: {rule_id}, 响应: {response_text}")
+                        return True
                     
         except Exception as e:
             logger.error(f"发送到RSS服务时出错: {str(e)}")
@@ -583,11 +583,11 @@ class RSSFilter(BaseFilter):
                         media_type = mimetypes.guess_type(local_file)[0] or "application/octet-stream"
                         filename = os.path.basename(local_file)
                         
-                        # 复制文件到规则特定的RSS媒体目录
+                        # 硬链接（或复制）文件到规则特定的RSS媒体目录
                         target_path = os.path.join(rule_media_path, filename)
                         if not os.path.exists(target_path):
-                            shutil.copy2(local_file, target_path)
-                            logger.info(f"复制媒体文件到: {target_path}")
+                            link_or_copy(local_file, target_path)
+                            logger.info(f"链接媒体文件到: {target_path}")
                         
                         # 获取文件大小
                         file_size = os.path.getsize(target_path)
@@ -616,6 +616,13 @@ class RSSFilter(BaseFilter):
                 # 没有已下载的媒体文件，尝试直接从媒体组消息下载
                 if hasattr(context, 'media_group_messages') and context.media_group_messages:
                     logger.warning("媒体组没有已下载的文件，尝试从media_group_messages获取")
+
+                    # 先并发下载组内所有文件到媒体缓存，下面逐条链接到RSS媒体目录时直接命中缓存
+                    skipped_ids = {skipped_msg.id for skipped_msg, _, _ in getattr(context, 'skipped_media', None) or []}
+                    await context.prepared.download_all([
+                        msg for msg in context.media_group_messages
+                        if msg.id not in skipped_ids and (msg.photo or msg.document)
+                    ])
                     
                     # 直接处理媒体组消息
                     for msg in context.media_group_messages:
@@ -645,7 +652,7 @@ class RSSFilter(BaseFilter):
                                         logger.info(f"媒体文件已存在，跳过下载: {local_path}")
                                     else:
                                         try:
-                                            await msg.download_media(local_path)
+                                            await media_cache.link(msg, local_path)
                                             logger.info(f"直接下载图片到: {local_path}")
                                         except Exception as e:
                                             if "file reference has expired" in str(e):
@@ -656,7 +663,7 @@ class RSSFilter(BaseFilter):
                                                         msg.chat_id, ids=msg.id
                                                     )
                                                     if refreshed_msg:
-                                                        await refreshed_msg.download_media(local_path)
+                                                        await media_cache.link(refreshed_msg, local_path)
                                                         logger.info(f"成功重新下载图片到: {local_path}")
                                                     else:
                                                         logger.error("无法重新获取消息")
@@ -705,7 +712,7 @@ class RSSFilter(BaseFilter):
                                         logger.info(f"媒体文件已存在，跳过下载: {local_path}")
                                     else:
                                         try:
-                                            await msg.download_media(local_path)
+                                            await media_cache.link(msg, local_path)
                                             logger.info(f"直接下载文档到: {local_path}")
                                         except Exception as e:
                                             if "file reference has expired" in str(e):
@@ -716,7 +723,7 @@ class RSSFilter(BaseFilter):
                                                         msg.chat_id, ids=msg.id
                                                     )
                                                     if refreshed_msg:
-                                                        await refreshed_msg.download_media(local_path)
+                                                        await media_cache.link(refreshed_msg, local_path)
                                                         logger.info(f"成功重新下载文档到: {local_path}")
                                                     else:
                                                         logger.error("无法重新获取消息")
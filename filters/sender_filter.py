@@ -1,11 +1,32 @@
 import logging
 import os
+import time
 from filters.base_filter import BaseFilter
 from enums.enums import PreviewMode
-from telethon.errors import FloodWaitError
+from telethon.errors import (
+    FloodWaitError, FileReferenceExpiredError, FileReferenceInvalidError, ChatForwardsRestrictedError,
+    MediaEmptyError, MediaInvalidError, PhotoInvalidError, FileIdInvalidError
+)
+from managers.dedup_journal import dedup_journal
+from utils.metrics import registry
+from utils.tracing import record_span
+from utils.constants import SEND_BY_REFERENCE
 
 logger = logging.getLogger(__name__)
 
+# 发送指标
+SEND_DURATION = registry.histogram('tf_send_duration_seconds', '发送消息的耗时（含媒体下载）', ('kind', 'status'))
+FLOODWAIT_SECONDS = registry.counter('tf_floodwait_seconds_total', '发送时遇到的 FloodWait 累计等待秒数')
+MEDIA_SEND_PATH = registry.counter(
+    'tf_media_send_path_total', '媒体发送方式（reference 引用原文件 / upload 下载后上传）及原因', ('path', 'reason')
+)
+
+# 原文件引用不可用时的错误，遇到后回退为下载上传
+REFERENCE_ERRORS = (
+    FileReferenceExpiredError, FileReferenceInvalidError, ChatForwardsRestrictedError,
+    MediaEmptyError, MediaInvalidError, PhotoInvalidError, FileIdInvalidError
+)
+
 class SenderFilter(BaseFilter):
     """
     消息发送过滤器，用于发送处理后的消息
@@ -69,32 +90,95 @@ class SenderFilter(BaseFilter):
         parse_mode = rule.message_mode.value  # 使用枚举的值（字符串）
         logger.info(f'使用消息格式: {parse_mode}')
         
+        kind = 'text'
+        started = time.perf_counter()
         try:
             # 处理媒体组消息
             if context.is_media_group or (context.media_group_messages and context.skipped_media):
                 logger.info(f'准备发送媒体组消息')
+                kind = 'media_group'
                 await self._send_media_group(context, target_chat_id, parse_mode)
             # 处理单条媒体消息
-            elif context.media_files or context.skipped_media:
+            elif context.media_files or context.deferred_media or context.skipped_media:
                 logger.info(f'准备发送单条媒体消息')
+                kind = 'media'
                 await self._send_single_media(context, target_chat_id, parse_mode)
             # 处理纯文本消息
             else:
                 logger.info(f'准备发送纯文本消息')
                 await self._send_text_message(context, target_chat_id, parse_mode)
                 
+            SEND_DURATION.observe(time.perf_counter() - started, kind, 'ok')
+            record_span(f'telegram:send_{kind}', time.perf_counter() - started, target=target_chat_id, path=context.send_path)
             logger.info(f'消息已发送到: {target_chat.name} ({target_chat_id})')
+            # 记录投递，避免重放时重复发送
+            await dedup_journal.record(context.chat_id, event.message.id, rule.id)
             return True
         except FloodWaitError as e:
             wait_time = e.seconds
+            SEND_DURATION.observe(time.perf_counter() - started, kind, 'floodwait')
+            record_span(f'telegram:send_{kind}', time.perf_counter() - started, 'floodwait', wait=wait_time)
+            FLOODWAIT_SECONDS.inc(amount=wait_time)
             logger.error(f'发送消息频率限制，需要等待 {wait_time} 秒')
             context.errors.append(f"发送消息频率限制，需要等待 {wait_time} 秒")
             return False
         except Exception as e:
+            SEND_DURATION.observe(time.perf_counter() - started, kind, 'error')
+            record_span(f'telegram:send_{kind}', time.perf_counter() - started, 'error')
             logger.error(f'发送消息时出错: {str(e)}')
             context.errors.append(f"发送消息错误: {str(e)}")
             return False
     
+    async def _send_by_reference(self, context, target_chat_id, messages, **kwargs):
+        """
+        直接引用原消息的媒体发送，不下载文件
+
+        Args:
+            context: 消息上下文
+            target_chat_id: 目标聊天ID
+            messages: 包含媒体的消息列表
+            **kwargs: 传给 send_file 的其他参数（说明文字、按钮等）
+
+        Returns:
+            发送的消息，引用不可用时返回 None，由调用方回退为下载上传
+        """
+        if not SEND_BY_REFERENCE:
+            MEDIA_SEND_PATH.inc('upload', 'disabled')
+            context.send_path = 'upload'
+            return None
+
+        media, reason = await context.prepared.get_media_references(context.client, messages)
+        if media is None:
+            logger.info(f'无法直接引用原文件发送（{reason}），改为下载上传')
+            MEDIA_SEND_PATH.inc('upload', reason)
+            context.send_path = 'upload'
+            return None
+
+        try:
+            sent = await context.client.send_file(
+                target_chat_id,
+                media if len(media) > 1 else media[0],
+                **kwargs
+            )
+        except REFERENCE_ERRORS as e:
+            logger.warning(f'直接引用原文件发送失败，改为下载上传: {str(e)}')
+            MEDIA_SEND_PATH.inc('upload', type(e).__name__)
+            context.send_path = 'upload'
+            return None
+
+        logger.info(f'已直接引用原文件发送 {len(media)} 个媒体')
+        MEDIA_SEND_PATH.inc('reference', 'ok')
+        context.send_path = 'reference'
+        return sent
+
+    def _link_preview(self, context):
+        """根据预览模式设置 link_preview"""
+        return {
+            PreviewMode.ON: True,
+            PreviewMode.OFF: False,
+            PreviewMode.FOLLOW: context.event.message.media is not None  # 跟随原消息
+        }[context.rule.is_preview]
+
     async def _send_media_group(self, context, target_chat_id, parse_mode):
         """发送媒体组消息"""
         rule = context.rule
@@ -128,14 +212,41 @@ class SenderFilter(BaseFilter):
         #     logger.info(f'媒体组所有文件超限，已发送文本和提示')
         #     return
             
+        media_messages = [message for message in context.media_group_messages if message.media]
+        if not media_messages:
+            return
+
+        # 添加发送者信息和消息文本
+        caption_text = context.sender_info + context.message_text
+        
+        # 如果有超限文件，添加提示信息
+        for message, size, name in context.skipped_media:
+            caption_text += f"\n\n⚠️ 媒体文件 {name if name else '未命名文件'} ({size}MB) 超过大小限制"
+        
+        if context.skipped_media:
+            context.original_link = f"\n原始消息: https://t.me/c/{str(event.chat_id)[4:]}/{event.message.id}"
+        # 添加时间信息和原始链接
+        caption_text += context.time_info + context.original_link
+
+        send_kwargs = dict(
+            caption=caption_text,
+            parse_mode=parse_mode,
+            buttons=context.buttons,
+            link_preview=self._link_preview(context)
+        )
+
+        # 优先直接引用原文件，作为一个组发送
+        sent_messages = await self._send_by_reference(context, target_chat_id, media_messages, **send_kwargs)
+        if sent_messages is not None:
+            context.forwarded_messages = sent_messages if isinstance(sent_messages, list) else [sent_messages]
+            logger.info(f'媒体组消息已发送，保存了 {len(context.forwarded_messages)} 条已转发消息')
+            return
+
         # 如果有可以发送的媒体，作为一个组发送
         files = []
         try:
-            for message in context.media_group_messages:
-                if message.media:
-                    file_path = await message.download_media(os.path.join(os.getcwd(), 'temp'))
-                    if file_path:
-                        files.append(file_path)
+            # 并发下载组内所有文件，同一消息的多条规则共享同一份下载
+            files = [path for path in await context.prepared.download_all(media_messages) if path]
             
             # 修改：保存下载的文件路径到context.media_files
             if files:
@@ -146,30 +257,11 @@ class SenderFilter(BaseFilter):
                 context.media_files.extend(files)
                 logger.info(f'已将 {len(files)} 个下载的媒体文件路径保存到context.media_files')
                 
-                # 添加发送者信息和消息文本
-                caption_text = context.sender_info + context.message_text
-                
-                # 如果有超限文件，添加提示信息
-                for message, size, name in context.skipped_media:
-                    caption_text += f"\n\n⚠️ 媒体文件 {name if name else '未命名文件'} ({size}MB) 超过大小限制"
-                
-                if context.skipped_media:
-                    context.original_link = f"\n原始消息: https://t.me/c/{str(event.chat_id)[4:]}/{event.message.id}"
-                # 添加时间信息和原始链接
-                caption_text += context.time_info + context.original_link
-                
                 # 作为一个组发送所有文件
                 sent_messages = await client.send_file(
                     target_chat_id,
                     files,
-                    caption=caption_text,
-                    parse_mode=parse_mode,
-                    buttons=context.buttons,
-                    link_preview={
-                        PreviewMode.ON: True,
-                        PreviewMode.OFF: False,
-                        PreviewMode.FOLLOW: context.event.message.media is not None
-                    }[rule.is_preview]
+                    **send_kwargs
                 )
                 # 保存发送的消息到上下文
                 if isinstance(sent_messages, list):
@@ -182,9 +274,11 @@ class SenderFilter(BaseFilter):
             logger.error(f'发送媒体组消息时出错: {str(e)}')
             raise
         finally:
-            # 删除临时文件，但如果启用了推送则保留
+            # 删除临时文件，但如果启用了推送则保留（共享预处理下载的文件由其统一清理）
             if not rule.enable_push:
                 for file_path in files:
+                    if context.prepared.owns(file_path):
+                        continue
                     try:
                         os.remove(file_path)
                         logger.info(f'删除临时文件: {file_path}')
@@ -202,7 +296,7 @@ class SenderFilter(BaseFilter):
         logger.info(f'发送单条媒体消息')
         
         # 检查是否所有媒体都超限
-        if context.skipped_media and not context.media_files:
+        if context.skipped_media and not context.media_files and not context.deferred_media:
             # 构建提示信息
             file_size = context.skipped_media[0][1]
             file_name = context.skipped_media[0][2]
@@ -227,47 +321,56 @@ class SenderFilter(BaseFilter):
         # 确保context.media_files存在
         if not hasattr(context, 'media_files') or context.media_files is None:
             context.media_files = []
+
+        caption = (
+            context.sender_info + 
+            context.message_text + 
+            context.time_info + 
+            context.original_link
+        )
+        send_kwargs = dict(
+            caption=caption,
+            parse_mode=parse_mode,
+            buttons=context.buttons,
+            link_preview=self._link_preview(context)
+        )
+
+        # 媒体过滤器暂未下载的媒体，优先直接引用原文件发送
+        if context.deferred_media:
+            if await self._send_by_reference(context, target_chat_id, context.deferred_media, **send_kwargs) is not None:
+                logger.info('媒体消息已发送')
+                return
+            # 回退为下载上传，下载的文件同时供后续推送使用
+            for message in context.deferred_media:
+                file_path = await context.prepared.download(message)
+                if file_path:
+                    context.media_files.append(file_path)
         
         # 发送媒体文件
         for file_path in context.media_files:
             try:
-                caption = (
-                    context.sender_info + 
-                    context.message_text + 
-                    context.time_info + 
-                    context.original_link
-                )
-                
                 await client.send_file(
                     target_chat_id,
                     file_path,
-                    caption=caption,
-                    parse_mode=parse_mode,
-                    buttons=context.buttons,
-                    link_preview={
-                        PreviewMode.ON: True,
-                        PreviewMode.OFF: False,
-                        PreviewMode.FOLLOW: context.event.message.media is not None
-                    }[rule.is_preview]
+                    **send_kwargs
                 )
                 logger.info(f'媒体消息已发送')
             except Exception as e:
                 logger.error(f'发送媒体消息时出错: {str(e)}')
                 raise
             finally:
-                # 删除临时文件，但如果启用了推送则保留
-                if not rule.enable_push:
+                # 删除临时文件，但如果启用了推送则保留（共享预处理下载的文件由其统一清理）
+                if rule.enable_push:
+                    logger.info(f'推送功能已启用，保留临时文件: {file_path}')
+                elif not context.prepared.owns(file_path):
                     try:
                         os.remove(file_path)
                         logger.info(f'删除临时文件: {file_path}')
                     except Exception as e:
                         logger.error(f'删除临时文件失败: {str(e)}')
-                else:
-                    logger.info(f'推送功能已启用，保留临时文件: {file_path}')
     
     async def _send_text_message(self, context, target_chat_id, parse_mode):
         """发送纯文本消息"""
-        rule = context.rule
         client = context.client
         
         if not context.message_text:
@@ -275,11 +378,7 @@ class SenderFilter(BaseFilter):
             return
             
         # 根据预览模式设置 link_preview
-        link_preview = {
-            PreviewMode.ON: True,
-            PreviewMode.OFF: False,
-            PreviewMode.FOLLOW: context.event.message.media is not None  # 跟随原消息
-        }[rule.is_preview]
+        link_preview = self._link_preview(context)
         
         # 组合消息文本
         message_text = context.sender_info + context.message_text + context.time_info + context.original_link
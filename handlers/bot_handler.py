@@ -119,6 +119,8 @@ async def handle_command(client, event):
         'cr': lambda: handle_copy_rule_command(event, 'copy_rule'),
         'changelog': lambda: handle_changelog_command(event),
         'cl': lambda: handle_changelog_command(event),
+        'slow_traces': lambda: handle_slow_traces_command(event, parts),
+        'st': lambda: handle_slow_traces_command(event, parts),
         'list_rule': lambda: handle_list_rule_command(event, command, parts),
         'lr': lambda: handle_list_rule_command(event, command, parts),
         'delete_rule': lambda: handle_delete_rule_command(event, command, parts),
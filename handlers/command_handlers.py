@@ -1,18 +1,15 @@
 from sqlalchemy.exc import IntegrityError
 from telethon import Button
-from models.models import MediaTypes, MediaExtensions
 from enums.enums import AddMode, ForwardMode
-from models.models import get_session, Keyword, ReplaceRule, User, RuleSync
+from models.models import get_session, Keyword, ReplaceRule, User
+from models.db_executor import db_executor
 from utils.common import *
 from utils.media import *
 from handlers.list_handlers import *
-from utils.constants import TEMP_DIR
 import traceback
-from sqlalchemy import inspect
 from version import VERSION, UPDATE_INFO
 import shlex
 import logging
-import os
 import aiohttp
 from utils.constants import RSS_HOST, RSS_PORT
 import models.models as models
@@ -20,9 +17,29 @@ from utils.auto_delete import respond_and_delete,reply_and_delete,async_delete_u
 from utils.common import get_bot_client
 from handlers.button.settings_manager import create_settings_text, create_buttons
 from handlers.button.webscrape_manager import create_webscrape_text, create_webscrape_buttons
+from utils.tracing import slow_traces
+from managers.download_engine import download_engine
+from managers.scratch_space import scratch_space
+from utils.regex_guard import screen_patterns
+from utils.list_transfer import (
+    aiter_chunks, parse_keyword_line, parse_replace_line,
+    export_keywords, export_replace_rules, ProgressMessage
+)
+import json
 
 logger = logging.getLogger(__name__)
 
+# 回复中最多列出的被拒绝正则数量
+MAX_REJECTED_SHOWN = 10
+
+
+def format_rejected(rejected):
+    """被拒绝的正则及原因，超过 MAX_REJECTED_SHOWN 条时只列出前几条"""
+    lines = [f'- {pattern}: {reason}' for pattern, reason in rejected[:MAX_REJECTED_SHOWN]]
+    if len(rejected) > MAX_REJECTED_SHOWN:
+        lines.append(f'... 等 {len(rejected)} 条')
+    return '\n'.join(lines)
+
 async def handle_bind_command(event, client, parts):
     """处理 bind 命令"""
     # 使用shlex解析命令
@@ -357,6 +374,15 @@ async def handle_add_command(event, command, parts):
         await reply_and_delete(event,'请提供至少一个关键字')
         return
 
+    # 拒绝无效或存在灾难性回溯风险的正则
+    rejected = []
+    if command == 'add_regex':
+        keywords, rejected = screen_patterns(keywords)
+        if not keywords:
+            await async_delete_user_message(event.client, event.message.chat_id, event.message.id, 0)
+            await reply_and_delete(event, '以下正则已被拒绝:\n' + format_rejected(rejected))
+            return
+
     session = get_session()
     try:
         rule_info = await get_current_rule(session, event)
@@ -386,6 +412,8 @@ async def handle_add_command(event, command, parts):
         result_text = f'已添加 {success_count} 个{keyword_type}'
         if duplicate_count > 0:
             result_text += f'\n跳过重复: {duplicate_count} 个'
+        if rejected:
+            result_text += f'\n已拒绝 {len(rejected)} 个正则:\n' + format_rejected(rejected)
         result_text += f'\n关键字列表:\n{keywords_text}\n'
         result_text += f'当前规则: 来自 {source_chat.name}\n'
         mode_text = '白名单' if rule.add_mode == AddMode.WHITELIST else '黑名单'
@@ -438,6 +466,13 @@ async def handle_replace_command(event, parts):
         await reply_and_delete(event,'请提供有效的匹配规则')
         return
 
+    # 拒绝无效或存在灾难性回溯风险的正则
+    _, rejected = screen_patterns([pattern])
+    if rejected:
+        await async_delete_user_message(event.client, event.message.chat_id, event.message.id, 0)
+        await reply_and_delete(event,f'替换规则已被拒绝: {rejected[0][1]}')
+        return
+
     session = get_session()
     try:
         rule_info = await get_current_rule(session, event)
@@ -456,10 +491,6 @@ async def handle_replace_command(event, parts):
             [content]   # contents 参数
         )
 
-        # 确保启用替换模式
-        if success_count > 0 and not rule.is_replace:
-            rule.is_replace = True
-
         session.commit()
 
         # 检查是否是全文替换
@@ -762,6 +793,50 @@ async def handle_changelog_command(event):
     await reply_and_delete(event,UPDATE_INFO, parse_mode='html')
 
 
+async def handle_slow_traces_command(event, parts):
+    """处理 slow_traces 命令，导出最近的慢追踪为 JSON 文件"""
+    await async_delete_user_message(event.client, event.message.chat_id, event.message.id, 0)
+
+    # 参数可以是数量，也可以是追踪ID
+    limit = 20
+    traces = None
+    if len(parts) > 1:
+        if parts[1].isdigit():
+            limit = int(parts[1])
+        else:
+            found = slow_traces.get(parts[1])
+            if not found:
+                await reply_and_delete(event, f'未找到追踪: {parts[1]}')
+                return
+            traces = [found.to_dict()]
+    if traces is None:
+        traces = slow_traces.dump(limit)
+
+    stats = slow_traces.get_stats()
+    if not traces:
+        await reply_and_delete(event, f"暂无慢追踪（阈值 {stats['threshold']} 秒，已完成 {stats['finished']} 条）")
+        return
+
+    lines = [f"最近 {len(traces)} 条慢追踪（阈值 {stats['threshold']} 秒，已完成 {stats['finished']} 条）:"]
+    for item in traces[:10]:
+        slowest = max(item['spans'], key=lambda s: s['duration_ms'], default=None)
+        slowest_text = f", 最慢: {slowest['name']} {slowest['duration_ms']:.0f}ms" if slowest else ''
+        lines.append(f"{item['trace_id']} {item['duration_ms']:.0f}ms {item['status']}{slowest_text}")
+
+    lease = scratch_space.lease('slow_traces')
+    file_path = lease.path('slow_traces.json')
+    try:
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(traces, f, ensure_ascii=False, indent=2)
+        await event.client.send_file(event.chat_id, file_path)
+        await respond_and_delete(event, '\n'.join(lines))
+    except Exception as e:
+        logger.error(f'导出慢追踪时出错: {str(e)}')
+        await reply_and_delete(event, '导出慢追踪时出错，请检查日志')
+    finally:
+        lease.release()
+
+
 async def handle_start_command(event):
     """处理 start 命令"""
 
@@ -788,7 +863,8 @@ async def handle_help_command(event, command):
         "**绑定和设置**\n"
         "/bind(/b) <源聊天链接或名称> [目标聊天链接或名称] - 绑定源聊天\n"
         "/settings(/s) [规则ID] - 管理转发规则\n"
-        "/changelog(/cl) - 查看更新日志\n\n"
+        "/changelog(/cl) - 查看更新日志\n"
+        "/slow_traces(/st) [数量或追踪ID] - 导出最近的慢消息处理追踪\n\n"
 
         "**转发规则管理**\n"
         "/copy_rule(/cr)  <源规则ID> [目标规则ID] - 复制指定规则的所有设置到当前规则或目标规则ID\n"
@@ -854,41 +930,28 @@ async def handle_export_keyword_command(event, command):
 
         rule, source_chat = rule_info
 
-        # 获取所有关键字
-        normal_keywords = []
-        regex_keywords = []
-
-        # 直接从规则对象获取关键字
-        for keyword in rule.keywords:
-            if keyword.is_regex:
-                regex_keywords.append(f"{keyword.keyword} {1 if keyword.is_blacklist else 0}")
-            else:
-                normal_keywords.append(f"{keyword.keyword} {1 if keyword.is_blacklist else 0}")
-
         # 创建临时文件
-        normal_file = os.path.join(TEMP_DIR, 'keywords.txt')
-        regex_file = os.path.join(TEMP_DIR, 'regex_keywords.txt')
+        lease = scratch_space.lease('export_keyword')
+        normal_file = lease.path('keywords.txt')
+        regex_file = lease.path('regex_keywords.txt')
 
-        # 写入普通关键字，确保每行一个
-        with open(normal_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(normal_keywords))
-
-        # 写入正则关键字，确保每行一个
-        with open(regex_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(regex_keywords))
+        try:
+            # 分批读取关键字并逐行写入文件，每行一个
+            normal_count, regex_count = await db_executor.run(
+                export_keywords, session, rule.id, normal_file, regex_file
+            )
 
-        # 如果两个文件都是空的
-        if not normal_keywords and not regex_keywords:
-            await async_delete_user_message(event.client, event.message.chat_id, event.message.id, 0)
-            await reply_and_delete(event, "当前规则没有任何关键字")
-            return
+            # 如果两个文件都是空的
+            if not normal_count and not regex_count:
+                await async_delete_user_message(event.client, event.message.chat_id, event.message.id, 0)
+                await reply_and_delete(event, "当前规则没有任何关键字")
+                return
 
-        try:
             # 先发送文件
             files = []
-            if normal_keywords:
+            if normal_count:
                 files.append(normal_file)
-            if regex_keywords:
+            if regex_count:
                 files.append(regex_file)
 
             await event.client.send_file(
@@ -897,14 +960,11 @@ async def handle_export_keyword_command(event, command):
             )
 
             # 然后单独发送说明文字
-            await respond_and_delete(event,(f"规则: {source_chat.name}"))
+            await respond_and_delete(event,(f"规则: {source_chat.name}\n关键字: {normal_count} 个, 正则表达式: {regex_count} 个"))
 
         finally:
             # 删除临时文件
-            if os.path.exists(normal_file):
-                os.remove(normal_file)
-            if os.path.exists(regex_file):
-                os.remove(regex_file)
+            lease.release()
 
     except Exception as e:
         logger.error(f'导出关键字时出错: {str(e)}')
@@ -924,6 +984,7 @@ async def handle_import_command(event, command):
 
         # 获取当前规则
         session = get_session()
+        progress = ProgressMessage(event)
         try:
             rule_info = await get_current_rule(session, event)
             if not rule_info:
@@ -931,108 +992,64 @@ async def handle_import_command(event, command):
 
             rule, source_chat = rule_info
 
-            # 下载文件
-            file_path = await event.message.download_media(TEMP_DIR)
-
+            lease = scratch_space.lease('import')
             try:
-                # 读取文件内容
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    lines = [line.strip() for line in f if line.strip()]
-
-                # 根据命令类型处理
-                if command == 'import_replace':
-                    success_count = 0
-                    logger.info(f'开始导入替换规则,共 {len(lines)} 行')
-                    for i, line in enumerate(lines, 1):
-                        try:
-                            # 按第一个制表符分割
-                            parts = line.split('\t', 1)
-                            pattern = parts[0].strip()
-                            content = parts[1].strip() if len(parts) > 1 else ''
-
-                            logger.info(f'处理第 {i} 行: pattern="{pattern}", content="{content}"')
-
-                            # 创建替换规则
-                            replace_rule = ReplaceRule(
-                                rule_id=rule.id,
-                                pattern=pattern,
-                                content=content
-                            )
-                            session.add(replace_rule)
-                            success_count += 1
-                            logger.info(f'成功添加替换规则: pattern="{pattern}", content="{content}"')
-
-                            # 确保启用替换模式
-                            if not rule.is_replace:
-                                rule.is_replace = True
-                                logger.info('已启用替换模式')
-
-                        except Exception as e:
-                            logger.error(f'处理第 {i} 行替换规则时出错: {str(e)}\n{traceback.format_exc()}')
-                            continue
-
-                    session.commit()
-                    logger.info(f'导入完成,成功导入 {success_count} 条替换规则')
-                    await async_delete_user_message(event.client, event.message.chat_id, event.message.id, 0)
-                    await reply_and_delete(event,f'成功导入 {success_count} 条替换规则\n规则: 来自 {source_chat.name}')
-
-
-                else:
-                    # 处理关键字导入
-                    success_count = 0
-                    duplicate_count = 0
-                    is_regex = (command == 'import_regex_keyword')
-                    for i, line in enumerate(lines, 1):
-                        try:
-                            # 按空格分割，提取关键字和标志
-                            parts = line.split()
-                            if len(parts) < 2:
-                                raise ValueError("行格式无效，至少需要关键字和标志")
-                            flag_str = parts[-1]  # 最后一个部分为标志
-                            if flag_str not in ('0', '1'):
-                                raise ValueError("标志值必须为 0 或 1")
-                            is_blacklist = (flag_str == '1')  # 转换为布尔值
-                            keyword = ' '.join(parts[:-1])  # 前面的部分组合为关键字
-                            if not keyword:
-                                raise ValueError("关键字为空")
-                            # 检查是否已存在相同的关键字
-                            existing = session.query(Keyword).filter_by(
-                                rule_id=rule.id,
-                                keyword=keyword,
-                                is_regex=is_regex
-                            ).first()
-
-                            if existing:
-                                duplicate_count += 1
-                                continue
-
-                            # 创建新的 Keyword 对象
-                            new_keyword = Keyword(
-                                rule_id=rule.id,
-                                keyword=keyword,
-                                is_regex=is_regex,
-                                is_blacklist=is_blacklist
-                            )
-                            session.add(new_keyword)
-                            success_count += 1
-
-                        except Exception as e:
-                            logger.error(f'处理第 {i} 行时出错: {line}\n{str(e)}')
-                            continue
-
-                    session.commit()
-                    keyword_type = "正则表达式" if is_regex else "关键字"
-                    result_text = f'成功导入 {success_count} 个{keyword_type}'
-                    if duplicate_count > 0:
-                        result_text += f'\n跳过重复: {duplicate_count} 个'
-                    result_text += f'\n规则: 来自 {source_chat.name}'
-                    await async_delete_user_message(event.client, event.message.chat_id, event.message.id, 0)
-                    await reply_and_delete(event,result_text)
+                # 下载文件
+                file_path = await download_engine.download(event.message, lease.directory)
+
+                db_ops = await get_db_ops()
+                is_replace = (command == 'import_replace')
+                is_regex = (command == 'import_regex_keyword')
+                parse_line = parse_replace_line if is_replace else parse_keyword_line
+                item_name = "替换规则" if is_replace else ("正则表达式" if is_regex else "关键字")
+                unit = "条" if is_replace else "个"
+
+                # 逐块读取文件并批量写入，每块单独提交，大文件不会整体载入内存
+                line_count = 0
+                success_count = 0
+                duplicate_count = 0
+                invalid_count = 0
+                rejected = []
+                async for items, chunk_lines, chunk_invalid in aiter_chunks(file_path, parse_line):
+                    if is_replace:
+                        # 有新增替换规则时自动启用替换模式
+                        counts, chunk_rejected = await db_ops.bulk_add_replace_rules(session, [rule.id], items)
+                    else:
+                        # 全部导入完成后再统一同步到UFB
+                        counts, chunk_rejected = await db_ops.bulk_add_keywords(
+                            session, [rule.id], items, is_regex, sync_server=False
+                        )
+                    added, duplicates = counts.get(rule.id, (0, 0))
+                    rejected.extend(chunk_rejected)
+                    await db_executor.run(session.commit)
+
+                    line_count += chunk_lines
+                    success_count += added
+                    duplicate_count += duplicates
+                    invalid_count += chunk_invalid
+                    await progress.update(f'正在导入{item_name}...\n已处理 {line_count} 行, 成功导入 {success_count} {unit}')
+
+                if not is_replace and success_count > 0:
+                    await db_ops.sync_to_server(session, rule.id)
+
+                logger.info(f'导入完成,共 {line_count} 行,成功导入 {success_count} {unit}{item_name},跳过重复 {duplicate_count} {unit},格式错误 {invalid_count} 行,拒绝正则 {len(rejected)} {unit}')
+                result_text = f'成功导入 {success_count} {unit}{item_name}'
+                if duplicate_count > 0:
+                    result_text += f'\n跳过重复: {duplicate_count} {unit}'
+                if invalid_count > 0:
+                    result_text += f'\n格式错误: {invalid_count} 行'
+                if rejected:
+                    result_text += f'\n已拒绝 {len(rejected)} {unit}正则:\n' + format_rejected(rejected)
+                result_text += f'\n规则: 来自 {source_chat.name}'
+                await async_delete_user_message(event.client, event.message.chat_id, event.message.id, 0)
+                await progress.finish(result_text)
             finally:
                 # 删除临时文件
-                if os.path.exists(file_path):
-                    os.remove(file_path)
+                lease.release()
 
+        except Exception:
+            await progress.discard()
+            raise
         finally:
             session.close()
 
@@ -1537,157 +1554,19 @@ async def handle_copy_rule_command(event, command):
             await reply_and_delete(event,'不能复制规则到自身')
             return
 
-        # 记录复制的各个部分成功数量
-        keywords_normal_success = 0
-        keywords_normal_skip = 0
-        keywords_regex_success = 0
-        keywords_regex_skip = 0
-        replace_rules_success = 0
-        replace_rules_skip = 0
-        media_extensions_success = 0
-        media_extensions_skip = 0
-
-
-        # 复制普通关键字
-        for keyword in source_rule.keywords:
-            if not keyword.is_regex:
-                # 检查是否已存在
-                exists = any(k.keyword == keyword.keyword and not k.is_regex and k.is_blacklist == keyword.is_blacklist
-                             for k in target_rule.keywords)
-                if not exists:
-                    new_keyword = Keyword(
-                        rule_id=target_rule.id,
-                        keyword=keyword.keyword,
-                        is_regex=False,
-                        is_blacklist=keyword.is_blacklist
-                    )
-                    session.add(new_keyword)
-                    keywords_normal_success += 1
-                else:
-                    keywords_normal_skip += 1
-
-        # 复制正则关键字
-        for keyword in source_rule.keywords:
-            if keyword.is_regex:
-                # 检查是否已存在
-                exists = any(k.keyword == keyword.keyword and k.is_regex and k.is_blacklist == keyword.is_blacklist
-                             for k in target_rule.keywords)
-                if not exists:
-                    new_keyword = Keyword(
-                        rule_id=target_rule.id,
-                        keyword=keyword.keyword,
-                        is_regex=True,
-                        is_blacklist=keyword.is_blacklist
-                    )
-                    session.add(new_keyword)
-                    keywords_regex_success += 1
-                else:
-                    keywords_regex_skip += 1
-
-        # 复制替换规则
-        for replace_rule in source_rule.replace_rules:
-            # 检查是否已存在
-            exists = any(r.pattern == replace_rule.pattern and r.content == replace_rule.content
-                         for r in target_rule.replace_rules)
-            if not exists:
-                new_rule = ReplaceRule(
-                    rule_id=target_rule.id,
-                    pattern=replace_rule.pattern,
-                    content=replace_rule.content
-                )
-                session.add(new_rule)
-                replace_rules_success += 1
-            else:
-                replace_rules_skip += 1
-
-        # 复制媒体扩展名设置
-        if hasattr(source_rule, 'media_extensions') and source_rule.media_extensions:
-            for extension in source_rule.media_extensions:
-                # 检查是否已存在
-                exists = any(e.extension == extension.extension for e in target_rule.media_extensions)
-                if not exists:
-                    new_extension = MediaExtensions(
-                        rule_id=target_rule.id,
-                        extension=extension.extension
-                    )
-                    session.add(new_extension)
-                    media_extensions_success += 1
-                else:
-                    media_extensions_skip += 1
-
-        # 复制媒体类型设置
-        if hasattr(source_rule, 'media_types') and source_rule.media_types:
-            target_media_types = session.query(MediaTypes).filter_by(rule_id=target_rule.id).first()
-
-            if not target_media_types:
-                # 如果目标规则没有媒体类型设置，创建新的
-                target_media_types = MediaTypes(rule_id=target_rule.id)
-
-                # 使用inspect自动复制所有字段（除了id和rule_id）
-                media_inspector = inspect(MediaTypes)
-                for column in media_inspector.columns:
-                    column_name = column.key
-                    if column_name not in ['id', 'rule_id']:
-                        setattr(target_media_types, column_name, getattr(source_rule.media_types, column_name))
-
-                session.add(target_media_types)
-            else:
-                # 如果已有设置，更新现有设置
-                # 使用inspect自动复制所有字段（除了id和rule_id）
-                media_inspector = inspect(MediaTypes)
-                for column in media_inspector.columns:
-                    column_name = column.key
-                    if column_name not in ['id', 'rule_id']:
-                        setattr(target_media_types, column_name, getattr(source_rule.media_types, column_name))
-
-        # 复制规则同步表数据
-        rule_syncs_success = 0
-        rule_syncs_skip = 0
-        
-        # 检查源规则是否有同步关系
-        if hasattr(source_rule, 'rule_syncs') and source_rule.rule_syncs:
-            for sync in source_rule.rule_syncs:
-                # 检查是否已存在
-                exists = any(s.sync_rule_id == sync.sync_rule_id for s in target_rule.rule_syncs)
-                if not exists:
-                    # 确保不会创建自引用的同步关系
-                    if sync.sync_rule_id != target_rule.id:
-                        new_sync = RuleSync(
-                            rule_id=target_rule.id,
-                            sync_rule_id=sync.sync_rule_id
-                        )
-                        session.add(new_sync)
-                        rule_syncs_success += 1
-                        
-                        # 启用目标规则的同步功能
-                        if rule_syncs_success > 0:
-                            target_rule.enable_sync = True
-                else:
-                    rule_syncs_skip += 1
-
-        # 复制规则设置
-        # 获取ForwardRule模型的所有字段
-        inspector = inspect(ForwardRule)
-        for column in inspector.columns:
-            column_name = column.key
-            if column_name not in ['id', 'source_chat_id', 'target_chat_id', 'source_chat', 'target_chat',
-                                      'keywords', 'replace_rules', 'media_types']:
-                # 获取源规则的值并设置到目标规则
-                value = getattr(source_rule, column_name)
-                setattr(target_rule, column_name, value)
-
-        session.commit()
-
+        # 在数据库线程中复制，规则较大时也不会阻塞消息转发
+        db_ops = await get_db_ops()
+        counts = await db_ops.copy_rule(session, source_rule, target_rule)
 
         # 发送结果消息
         await async_delete_user_message(event.client, event.message.chat_id, event.message.id, 0)
         await reply_and_delete(event,
             f"✅ 已从规则 `{source_rule_id}` 复制到规则 `{target_rule.id}`\n\n"
-            f"普通关键字: 成功复制 {keywords_normal_success} 个, 跳过重复 {keywords_normal_skip} 个\n"
-            f"正则关键字: 成功复制 {keywords_regex_success} 个, 跳过重复 {keywords_regex_skip} 个\n"
-            f"替换规则: 成功复制 {replace_rules_success} 个, 跳过重复 {replace_rules_skip} 个\n"
-            f"媒体扩展名: 成功复制 {media_extensions_success} 个, 跳过重复 {media_extensions_skip} 个\n"
-            f"同步规则: 成功复制 {rule_syncs_success} 个, 跳过重复 {rule_syncs_skip} 个\n"
+            f"普通关键字: 成功复制 {counts['keywords_normal'][0]} 个, 跳过重复 {counts['keywords_normal'][1]} 个\n"
+            f"正则关键字: 成功复制 {counts['keywords_regex'][0]} 个, 跳过重复 {counts['keywords_regex'][1]} 个\n"
+            f"替换规则: 成功复制 {counts['replace_rules'][0]} 个, 跳过重复 {counts['replace_rules'][1]} 个\n"
+            f"媒体扩展名: 成功复制 {counts['media_extensions'][0]} 个, 跳过重复 {counts['media_extensions'][1]} 个\n"
+            f"同步规则: 成功复制 {counts['rule_syncs'][0]} 个, 跳过重复 {counts['rule_syncs'][1]} 个\n"
             f"媒体类型设置和其他规则设置已复制\n",
             parse_mode='markdown'
         )
@@ -1710,27 +1589,20 @@ async def handle_export_replace_command(event, client):
 
         rule, source_chat = rule_info
 
-        # 获取所有替换规则
-        replace_rules = []
-        for rule in rule.replace_rules:
-            replace_rules.append((rule.pattern, rule.content))
-
-        # 如果没有替换规则
-        if not replace_rules:
-            await async_delete_user_message(event.client, event.message.chat_id, event.message.id, 0)
-            await reply_and_delete(event, "当前规则没有任何替换规则")
-            return
-
         # 创建并写入文件
-        replace_file = os.path.join(TEMP_DIR, 'replace_rules.txt')
-
-        # 写入替换规则，每行一个规则，用制表符分隔
-        with open(replace_file, 'w', encoding='utf-8') as f:
-            for pattern, content in replace_rules:
-                line = f"{pattern}\t{content if content else ''}"
-                f.write(line + '\n')
+        lease = scratch_space.lease('export_replace')
+        replace_file = lease.path('replace_rules.txt')
 
         try:
+            # 分批读取替换规则并逐行写入，每行一个规则，用制表符分隔
+            count = await db_executor.run(export_replace_rules, session, rule.id, replace_file)
+
+            # 如果没有替换规则
+            if not count:
+                await async_delete_user_message(event.client, event.message.chat_id, event.message.id, 0)
+                await reply_and_delete(event, "当前规则没有任何替换规则")
+                return
+
             # 先发送文件
             await event.client.send_file(
                 event.chat_id,
@@ -1738,12 +1610,11 @@ async def handle_export_replace_command(event, client):
             )
 
             # 然后单独发送说明文字
-            await respond_and_delete(event,(f"规则: {source_chat.name}"))
+            await respond_and_delete(event,(f"规则: {source_chat.name}\n替换规则: {count} 条"))
 
         finally:
             # 删除临时文件
-            if os.path.exists(replace_file):
-                os.remove(replace_file)
+            lease.release()
 
     except Exception as e:
         logger.error(f'导出替换规则时出错: {str(e)}')
@@ -1914,29 +1785,27 @@ async def handle_add_all_command(event, command, parts):
         current_rule, source_chat = rule_info
 
         db_ops = await get_db_ops()
-        # 为每个规则添加关键字
-        success_count = 0
-        duplicate_count = 0
-        for rule in rules:
-            # 使用 add_keywords 添加关键字
-            s_count, d_count = await db_ops.add_keywords(
-                session,
-                rule.id,
-                keywords,
-                is_regex=(command == 'add_regex_all'),
-                is_blacklist=(current_rule.add_mode == AddMode.BLACKLIST)
-            )
-            success_count += s_count
-            duplicate_count += d_count
+        # 一次批量添加到所有规则
+        is_blacklist = (current_rule.add_mode == AddMode.BLACKLIST)
+        counts, rejected = await db_ops.bulk_add_keywords(
+            session,
+            [rule.id for rule in rules],
+            [(keyword, is_blacklist) for keyword in keywords],
+            is_regex=(command == 'add_regex_all')
+        )
+        success_count = sum(s_count for s_count, _ in counts.values())
+        duplicate_count = sum(d_count for _, d_count in counts.values())
 
-        session.commit()
+        await db_executor.run(session.commit)
 
         # 构建回复消息
         keyword_type = "正则表达式" if command == "add_regex_all" else "关键字"
         keywords_text = '\n'.join(f'- {k}' for k in keywords)
         result_text = f'已添加 {success_count} 个{keyword_type}\n'
         if duplicate_count > 0:
-            result_text += f'跳过重复: {duplicate_count} 个'
+            result_text += f'跳过重复: {duplicate_count} 个\n'
+        if rejected:
+            result_text += f'已拒绝 {len(rejected)} 个正则:\n{format_rejected(rejected)}\n'
         result_text += f'关键字列表:\n{keywords_text}'
 
         logger.info(f"发送回复消息: {result_text}")
@@ -1977,27 +1846,16 @@ async def handle_replace_all_command(event, parts):
             return
 
         db_ops = await get_db_ops()
-        # 为每个规则添加替换规则
-        total_success = 0
-        total_duplicate = 0
-
-        for rule in rules:
-            # 使用 add_replace_rules 添加替换规则
-            success_count, duplicate_count = await db_ops.add_replace_rules(
-                session,
-                rule.id,
-                [(pattern, content)]  # 传入一个元组列表，每个元组包含 pattern 和 content
-            )
-
-            # 累计成功和重复的数量
-            total_success += success_count
-            total_duplicate += duplicate_count
-
-            # 确保启用替换模式
-            if success_count > 0 and not rule.is_replace:
-                rule.is_replace = True
+        # 一次批量添加到所有规则，有新增替换规则的规则自动启用替换模式
+        counts, rejected = await db_ops.bulk_add_replace_rules(
+            session,
+            [rule.id for rule in rules],
+            [(pattern, content)]
+        )
+        total_success = sum(success_count for success_count, _ in counts.values())
+        total_duplicate = sum(duplicate_count for _, duplicate_count in counts.values())
 
-        session.commit()
+        await db_executor.run(session.commit)
 
         # 构建回复消息
         result_text = f'已添加替换规则:\n'
@@ -2007,6 +1865,8 @@ async def handle_replace_all_command(event, parts):
             result_text += f'{"替换为: " + content if content else "删除匹配内容"}\n'
         if total_duplicate > 0:
             result_text += f'跳过重复规则: {total_duplicate} 个\n'
+        if rejected:
+            result_text += f'替换规则已被拒绝: {rejected[0][1]}\n'
 
         logger.info(f"发送回复消息: {result_text}")
         await async_delete_user_message(event.client, event.message.chat_id, event.message.id, 0)
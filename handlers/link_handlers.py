@@ -1,8 +1,8 @@
 import re
-import os
 import logging
+from managers.download_engine import download_engine
+from managers.scratch_space import scratch_space
 from utils.common import get_main_module, get_user_id
-from utils.constants import TEMP_DIR
 from utils.auto_delete import reply_and_delete
 
 logger = logging.getLogger(__name__)
@@ -57,6 +57,7 @@ async def handle_message_link(client, event):
 async def handle_media_group(client, user_client, chat_id, message, event):
     """处理媒体组消息"""
     files = []  # 将 files 移到外层作用域
+    lease = scratch_space.lease('link_group')
     try:
         # 收集媒体组的所有消息
         media_group_messages = []
@@ -82,7 +83,7 @@ async def handle_media_group(client, user_client, chat_id, message, event):
             for msg in media_group_messages:
                 if msg.media:
                     try:
-                        file_path = await msg.download_media(TEMP_DIR)
+                        file_path = await download_engine.download(msg, lease.directory)
                         if file_path:
                             files.append(file_path)
                             logger.info(f'已下载媒体文件: {file_path}')
@@ -124,24 +125,18 @@ async def handle_media_group(client, user_client, chat_id, message, event):
         raise
     finally:
         # 确保清理所有临时文件
-        for file_path in files:
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logger.info(f'已删除临时文件: {file_path}')
-            except Exception as e:
-                logger.error(f'删除临时文件失败 {file_path}: {str(e)}')
+        lease.release()
 
 async def handle_single_message(client, message, event):
     """处理单条消息"""
     parse_mode = 'Markdown'
     buttons = message.buttons if hasattr(message, 'buttons') else None
-    file_path = None
+    lease = scratch_space.lease('link_single')
 
     try:
         if message.media:
             # 处理媒体消息
-            file_path = await message.download_media(TEMP_DIR)
+            file_path = await download_engine.download(message, lease.directory)
             if file_path:
                 logger.info(f'已下载媒体文件: {file_path}')
                 caption = message.text if message.text else ''
@@ -208,9 +203,4 @@ async def handle_single_message(client, message, event):
         raise
     finally:
         # 确保清理临时文件
-        if file_path and os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-                logger.info(f'已删除临时文件: {file_path}')
-            except Exception as e:
-                logger.error(f'删除临时文件失败 {file_path}: {str(e)}')
+        lease.release()
@@ -3,17 +3,26 @@ import re
 import logging
 import asyncio
 from utils.common import check_keywords, get_sender_info
+from managers.dedup_journal import dedup_journal
 
 
 logger = logging.getLogger(__name__)
 
-async def process_forward_rule(client, event, chat_id, rule):
-    """处理转发规则（用户模式）"""
+async def process_forward_rule(client, event, chat_id, rule, prepared=None):
+    """处理转发规则（用户模式）
+
+    prepared 为同一消息多条规则共享的预处理结果（可选），用于复用发送者信息和媒体组消息
+    """
 
     
     if not rule.enable_rule:
         logger.info(f'规则 ID: {rule.id} 已禁用，跳过处理')
         return
+
+    # 重启或重连后重放的消息，已经投递过则跳过
+    if await dedup_journal.is_delivered(chat_id, event.message.id, rule.id):
+        logger.info(f'消息 {event.message.id} 已通过规则 {rule.id} 转发过，跳过')
+        return
     
     message_text = event.message.text or ''
     check_message_text = message_text
@@ -24,7 +33,10 @@ async def process_forward_rule(client, event, chat_id, rule):
 
 
     if rule.is_filter_user_info:
-        sender_info = await get_sender_info(event, rule.id)  # 调用新的函数获取 sender_info
+        if prepared:
+            sender_info = await prepared.get_sender_info(rule.id)
+        else:
+            sender_info = await get_sender_info(event, rule.id)  # 调用新的函数获取 sender_info
         if sender_info:
             check_message_text = f"{sender_info}:\n{message_text}"
             logger.info(f'附带用户信息后的消息: {message_text}')
@@ -43,23 +55,27 @@ async def process_forward_rule(client, event, chat_id, rule):
             
             
             if event.message.grouped_id:
-                # 等待一段时间以确保收到所有媒体组消息
-                await asyncio.sleep(1)
-                
-                # 收集媒体组的所有消息
-                messages = []
-                async for message in client.iter_messages(
-                    event.chat_id,
-                    limit=20,  # 限制搜索范围
-                    min_id=event.message.id - 10,
-                    max_id=event.message.id + 10
-                ):
-                    if message.grouped_id == event.message.grouped_id:
-                        messages.append(message.id)
-                        logger.info(f'找到媒体组消息: ID={message.id}')
-                
-                # 按照ID排序，确保转发顺序正确
-                messages.sort()
+                if prepared:
+                    # 复用共享预处理中已获取的媒体组消息（已按ID排序）
+                    messages = [message.id for message in await prepared.get_group_messages()]
+                else:
+                    # 等待一段时间以确保收到所有媒体组消息
+                    await asyncio.sleep(1)
+                    
+                    # 收集媒体组的所有消息
+                    messages = []
+                    async for message in client.iter_messages(
+                        event.chat_id,
+                        limit=20,  # 限制搜索范围
+                        min_id=event.message.id - 10,
+                        max_id=event.message.id + 10
+                    ):
+                        if message.grouped_id == event.message.grouped_id:
+                            messages.append(message.id)
+                            logger.info(f'找到媒体组消息: ID={message.id}')
+                    
+                    # 按照ID排序，确保转发顺序正确
+                    messages.sort()
                 
                 # 一次性转发所有消息
                 await client.forward_messages(
@@ -77,7 +93,9 @@ async def process_forward_rule(client, event, chat_id, rule):
                     event.chat_id
                 )
                 logger.info(f'[用户] 消息已转发到: {target_chat.name} ({target_chat_id})')
-                
+            
+            # 记录投递，避免重放时重复转发
+            await dedup_journal.record(chat_id, event.message.id, rule.id)
                 
         except Exception as e:
             logger.error(f'转发消息时出错: {str(e)}')
@@ -4,6 +4,17 @@ from telethon.tl.functions.bots import SetBotCommandsRequest
 from models.models import init_db
 from dotenv import load_dotenv
 from message_listener import setup_listeners
+import message_listener
+from managers.dedup_journal import dedup_journal
+from managers.config_bus import config_bus
+from models.db_executor import db_executor
+from filters.filter_chain import FILTER_DURATION, RULE_CHAIN_DURATION
+from utils.metrics import registry, log_summary_loop, snapshot_loop
+from utils.constants import METRICS_LOG_INTERVAL, METRICS_SNAPSHOT_PATH, METRICS_SNAPSHOT_INTERVAL
+from utils.constants import CONFIG_BUS_POLL_INTERVAL, CONFIG_BUS_RETENTION
+from utils.constants import TEMP_SWEEP_INTERVAL
+from managers.scratch_space import scratch_space
+from utils.regex_guard import regex_guard
 import os
 import asyncio
 import logging
@@ -14,6 +25,7 @@ from scheduler.summary_scheduler import SummaryScheduler
 from scheduler.chat_updater import ChatUpdater
 from scheduler.web_scrape_scheduler import WebScrapeScheduler, set_web_scrape_scheduler
 from handlers.bot_handler import send_welcome_message
+from utils.common import get_user_id
 from rss.main import app as rss_app
 from utils.log_config import setup_logging
 
@@ -45,6 +57,10 @@ db_ops = None
 scheduler = None
 chat_updater = None
 web_scrape_scheduler = None
+metrics_summary_task = None
+metrics_snapshot_task = None
+config_bus_task = None
+scratch_sweep_task = None
 
 
 async def init_db_ops():
@@ -60,12 +76,6 @@ os.makedirs('./sessions', exist_ok=True)
 os.makedirs('./temp', exist_ok=True)
 
 
-# 清空./temp文件夹
-def clear_temp_dir():
-    for file in os.listdir('./temp'):
-        os.remove(os.path.join('./temp', file))
-
-
 # 创建客户端
 user_client = TelegramClient(f'./sessions/{user_session}', api_id, api_hash)
 bot_client = TelegramClient(f'./sessions/{bot_session}', api_id, api_hash)
@@ -76,6 +86,16 @@ engine = init_db()
 
 def run_rss_server(host: str, port: int):
     """在新进程中运行 RSS 服务器"""
+    # 丢弃从主进程继承的指标，主进程的指标通过快照文件合并
+    registry.reset()
+    # 不能复用主进程的正则沙箱进程
+    regex_guard.reset()
+    # 重新记录配置变更的轮询位置和进程标识
+    config_bus.reset()
+    # 主进程的数据库线程不会复制到子进程
+    db_executor.reset()
+    # 不能复用主进程连接池中的 SQLite 连接，只丢弃不关闭（关闭会影响主进程）
+    engine.dispose(close=False)
     uvicorn.run(
         rss_app,
         host=host,
@@ -85,9 +105,12 @@ def run_rss_server(host: str, port: int):
 
 async def start_clients():
     # 初始化 DBOperations
-    global db_ops, scheduler, chat_updater, web_scrape_scheduler
+    global db_ops, scheduler, chat_updater, web_scrape_scheduler, metrics_summary_task, metrics_snapshot_task, config_bus_task, scratch_sweep_task
     db_ops = await DBOperations.create()
 
+    # 清空上次运行（包括异常退出）遗留的临时文件
+    scratch_space.clear()
+
     try:
         # 启动用户客户端
         await user_client.start(phone=phone_number)
@@ -102,6 +125,9 @@ async def start_clients():
         # 设置消息监听器
         await setup_listeners(user_client, bot_client)
 
+        # 正则多次超时被禁用时通过机器人通知
+        regex_guard.set_notifier(notify_admin)
+
         # 注册命令
         await register_bot_commands(bot_client)
 
@@ -138,6 +164,22 @@ async def start_clients():
         else:
             logger.info("RSS 服务未启用")
 
+        # 定期输出过滤器耗时汇总
+        if METRICS_LOG_INTERVAL > 0:
+            metrics_summary_task = asyncio.create_task(log_summary_loop(METRICS_LOG_INTERVAL, [
+                ('过滤器耗时', FILTER_DURATION, 0),
+                ('规则过滤器链耗时', RULE_CHAIN_DURATION, 0),
+            ]))
+
+        # 定期写入指标快照，供 RSS 服务的 /metrics 端点合并导出
+        metrics_snapshot_task = asyncio.create_task(snapshot_loop(METRICS_SNAPSHOT_PATH, METRICS_SNAPSHOT_INTERVAL))
+
+        # 轮询其他进程（RSS 面板）的配置变更，使本进程的缓存失效
+        config_bus_task = asyncio.create_task(config_bus.poll_loop(CONFIG_BUS_POLL_INTERVAL, CONFIG_BUS_RETENTION))
+
+        # 定期清理不属于任何操作的孤立临时文件
+        scratch_sweep_task = asyncio.create_task(scratch_space.sweep_loop(TEMP_SWEEP_INTERVAL))
+
         # 发送欢迎消息
         await send_welcome_message(bot_client)
 
@@ -158,12 +200,35 @@ async def start_clients():
         # 停止聊天信息更新器
         if chat_updater:
             chat_updater.stop()
+        # 停止消息分发器
+        if message_listener.dispatcher:
+            message_listener.dispatcher.stop()
+        # 停止指标汇总
+        if metrics_summary_task:
+            metrics_summary_task.cancel()
+        if metrics_snapshot_task:
+            metrics_snapshot_task.cancel()
+        if config_bus_task:
+            config_bus_task.cancel()
+        if scratch_sweep_task:
+            scratch_sweep_task.cancel()
+        # 关闭投递去重日志
+        dedup_journal.close()
+        # 停止正则沙箱进程
+        regex_guard.stop()
+        # 等待进行中的数据库操作完成
+        db_executor.shutdown()
         # 如果 RSS 服务在运行，停止它
         if 'rss_process' in locals() and rss_process.is_alive():
             rss_process.terminate()
             rss_process.join()
 
 
+async def notify_admin(text):
+    """通过机器人给管理员发送通知"""
+    await bot_client.send_message(await get_user_id(), text)
+
+
 async def register_bot_commands(bot):
     """注册机器人命令"""
     # # 先清空现有命令
@@ -332,6 +397,10 @@ async def register_bot_commands(bot):
             command='webscrape',
             description='管理网页抓取任务'
         ),
+        BotCommand(
+            command='slow_traces',
+            description='导出最近的慢消息处理追踪'
+        ),
 
 
         # BotCommand(
@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import os
+import threading
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, Optional
+
+from sqlalchemy import event, select, func
+from sqlalchemy.orm import Session
+
+from models.models import (
+    engine, Chat, ForwardRule, Keyword, ReplaceRule, MediaTypes, MediaExtensions,
+    PushConfig, RSSConfig, RSSPattern, RuleSync, ConfigVersion
+)
+from models.db_executor import db_executor
+
+logger = logging.getLogger(__name__)
+
+# 一条配置变更：实体（表名）与受影响的规则ID，规则ID为 None 表示无法确定（视为全部规则）
+ConfigChange = namedtuple('ConfigChange', ['entity', 'rule_id'])
+
+# 变更后需要通知的配置实体
+CONFIG_ENTITIES = (
+    Chat, ForwardRule, Keyword, ReplaceRule, MediaTypes, MediaExtensions,
+    PushConfig, RSSConfig, RSSPattern, RuleSync
+)
+
+_config_versions = ConfigVersion.__table__
+
+
+def changed_rule_ids(changes: Iterable[ConfigChange]) -> Optional[set]:
+    """
+    汇总变更涉及的规则ID
+
+    Returns:
+        set: 受影响的规则ID；存在无法确定规则的变更时返回 None（表示全部）
+    """
+    rule_ids = set()
+    for change in changes:
+        if change.rule_id is None:
+            return None
+        rule_ids.add(change.rule_id)
+    return rule_ids
+
+
+def _change_of(obj) -> ConfigChange:
+    entity = obj.__tablename__
+    if isinstance(obj, ForwardRule):
+        return ConfigChange(entity, obj.id)
+    # 聊天和 RSS 模式不直接关联规则，按全部处理
+    return ConfigChange(entity, getattr(obj, 'rule_id', None))
+
+
+class ConfigBus:
+    """
+    配置变更通知总线
+
+    进程内：任何会话提交了规则相关的修改（command_handlers、按钮回调、DBOperations、
+    UFB 同步等）后，按实体和规则ID同步通知订阅者，各缓存据此只丢弃受影响的条目。
+    跨进程：变更在同一事务中写入 config_versions 表，其他进程（如 RSS 面板）按主键增量轮询，
+    跳过自己发布的记录后通知本进程的订阅者。记录ID回退到轮询位置之前时（如表被重建），
+    所有缓存整体失效后重新开始轮询。
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self._last_id = None
+        self._pid = None
+        self._origin = None
+        self._lock = threading.Lock()
+        self._stats = {'published': 0, 'received': 0, 'resyncs': 0, 'callback_errors': 0}
+        logger.info("ConfigBus 初始化")
+
+    @property
+    def origin(self) -> str:
+        """当前进程的标识（fork 出的子进程会重新生成）"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._origin = f'{self._pid}-{uuid.uuid4().hex[:8]}'
+        return self._origin
+
+    def subscribe(self, callback: Callable[[List[ConfigChange]], None], entities=None) -> None:
+        """
+        订阅配置变更
+
+        Args:
+            callback: 回调函数，参数为本次相关的变更列表
+            entities: 关注的实体（表名）列表，为空时接收全部变更
+        """
+        self._subscribers.append((callback, frozenset(entities) if entities else None))
+
+    def dispatch(self, changes: List[ConfigChange]) -> None:
+        """通知本进程的订阅者，单个订阅者出错不影响其他订阅者"""
+        for callback, entities in self._subscribers:
+            relevant = [c for c in changes if entities is None or c.entity in entities]
+            if not relevant:
+                continue
+            try:
+                callback(relevant)
+            except Exception as e:
+                self._stats['callback_errors'] += 1
+                logger.error(f"配置变更订阅者 {getattr(callback, '__qualname__', callback)} 出错: {str(e)}")
+
+    def record(self, connection, changes: List[ConfigChange]) -> None:
+        """在给定连接（通常是当前事务）中写入变更记录"""
+        now = datetime.utcnow()
+        connection.execute(_config_versions.insert(), [
+            {'entity': change.entity, 'rule_id': change.rule_id, 'origin': self.origin, 'created_at': now}
+            for change in changes
+        ])
+        self._stats['published'] += len(changes)
+
+    def publish(self, entity: str, rule_ids=None) -> None:
+        """
+        发布不经过 ORM 会话的配置变更（如原生 SQL 写入）
+
+        Args:
+            entity: 变更的实体（表名）
+            rule_ids: 受影响的规则ID，为空表示全部
+        """
+        if rule_ids is None:
+            changes = [ConfigChange(entity, None)]
+        else:
+            changes = [ConfigChange(entity, rule_id) for rule_id in rule_ids]
+        try:
+            with engine.begin() as connection:
+                self.record(connection, changes)
+        except Exception as e:
+            logger.error(f"写入配置变更记录失败: {str(e)}")
+        self.dispatch(changes)
+
+    def poll(self) -> int:
+        """
+        读取其他进程发布的变更并通知订阅者
+
+        Returns:
+            int: 本次收到的变更数量
+        """
+        with engine.connect() as connection:
+            if self._last_id is None:
+                # 首次轮询只记录位置，启动前的变更不影响刚创建的缓存
+                self._last_id = connection.execute(select(func.max(_config_versions.c.id))).scalar() or 0
+                return 0
+            rows = connection.execute(
+                select(
+                    _config_versions.c.id, _config_versions.c.entity,
+                    _config_versions.c.rule_id, _config_versions.c.origin
+                ).where(_config_versions.c.id > self._last_id).order_by(_config_versions.c.id)
+            ).all()
+            if not rows:
+                max_id = connection.execute(select(func.max(_config_versions.c.id))).scalar() or 0
+
+        if not rows:
+            if max_id < self._last_id:
+                self._resync(max_id)
+            return 0
+        self._last_id = rows[-1].id
+        origin = self.origin
+        changes = list(dict.fromkeys(
+            ConfigChange(row.entity, row.rule_id) for row in rows if row.origin != origin
+        ))
+        if changes:
+            self._stats['received'] += len(changes)
+            logger.info(f"收到其他进程的配置变更: {len(changes)} 条")
+            self.dispatch(changes)
+        return len(changes)
+
+    def _resync(self, max_id: int) -> None:
+        """
+        变更记录的ID小于轮询位置（表被重建或ID被重新分配）时，
+        无法确定错过了哪些变更：从当前位置重新开始，并让所有缓存整体失效
+        """
+        logger.warning(f"配置变更记录ID回退 ({self._last_id} -> {max_id})，所有缓存失效")
+        self._last_id = max_id
+        self._stats['resyncs'] += 1
+        self.dispatch([ConfigChange(entity.__tablename__, None) for entity in CONFIG_ENTITIES])
+
+    def prune(self, retention: int) -> int:
+        """删除超过保留时长的变更记录"""
+        cutoff = datetime.utcnow() - timedelta(seconds=retention)
+        with engine.begin() as connection:
+            result = connection.execute(
+                _config_versions.delete().where(_config_versions.c.created_at < cutoff)
+            )
+        return result.rowcount or 0
+
+    async def poll_loop(self, interval: float, retention: Optional[int] = None) -> None:
+        """
+        定期轮询其他进程的变更（在数据库线程中执行）
+
+        Args:
+            interval: 轮询间隔（秒）
+            retention: 变更记录保留时长（秒），为 None 时不清理；只应由主进程清理
+        """
+        prune_every = max(1, int(retention / interval / 10)) if retention else 0
+        rounds = 0
+        while True:
+            try:
+                await db_executor.run(self.poll)
+                rounds += 1
+                if prune_every and rounds % prune_every == 0:
+                    await db_executor.run(self.prune, retention)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"轮询配置变更时出错: {str(e)}")
+            await asyncio.sleep(interval)
+
+    def reset(self) -> None:
+        """在新进程中重新开始轮询（fork 后调用）"""
+        self._last_id = None
+
+    def get_stats(self) -> dict:
+        """获取总线统计"""
+        return dict(self._stats, subscribers=len(self._subscribers), last_id=self._last_id)
+
+
+# 创建全局实例
+config_bus = ConfigBus()
+
+
+def _pending_changes(session) -> set:
+    return session.info.setdefault('config_changes', set())
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_config_changes(session, flush_context):
+    """记录本次事务中修改的配置实体"""
+    changes = [
+        _change_of(obj)
+        for instances in (session.new, session.dirty, session.deleted)
+        for obj in instances
+        if isinstance(obj, CONFIG_ENTITIES)
+    ]
+    if changes:
+        _pending_changes(session).update(changes)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk_config_changes(orm_execute_state):
+    """
+    批量 update/delete/insert 无法确定规则，按全部规则处理
+
+    语句可以通过执行选项 config_rule_ids 指明受影响的规则，只通知这些规则。
+    """
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and issubclass(mapper.class_, CONFIG_ENTITIES):
+        entity = mapper.class_.__tablename__
+        rule_ids = orm_execute_state.execution_options.get('config_rule_ids')
+        if rule_ids is None:
+            _pending_changes(orm_execute_state.session).add(ConfigChange(entity, None))
+        else:
+            _pending_changes(orm_execute_state.session).update(ConfigChange(entity, rule_id) for rule_id in rule_ids)
+
+
+@event.listens_for(Session, 'before_commit')
+def _record_config_changes(session):
+    """提交前把变更记录写入同一事务，修改与通知同时生效或同时回滚"""
+    session.flush()
+    changes = session.info.get('config_changes')
+    if not changes:
+        return
+    try:
+        config_bus.record(session.connection(), sorted(changes, key=lambda c: (c.entity, c.rule_id or 0)))
+    except Exception as e:
+        logger.error(f"写入配置变更记录失败: {str(e)}")
+
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_on_commit(session):
+    changes = session.info.pop('config_changes', None)
+    if changes:
+        config_bus.dispatch(list(changes))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('config_changes', None)
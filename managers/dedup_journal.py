@@ -0,0 +1,157 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from models.db_executor import db_executor
+from utils.constants import DEDUP_ENABLED, DEDUP_DB_PATH, DEDUP_RETENTION_HOURS, DEDUP_CACHE_SIZE
+from utils.ttl_cache import TTLCache
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# 每写入多少条记录清理一次过期记录
+PRUNE_EVERY = 500
+
+
+class DedupJournal:
+    """
+    消息投递去重日志
+
+    记录已成功发送的 (源聊天ID, 消息ID, 规则ID)，用于在重启或重连后
+    Telethon 重放更新时跳过已经转发过的消息。
+
+    持久化使用独立的 SQLite 文件（只追加，按时间清理），
+    前面是一个与保留期等长的内存缓存：启动时载入保留期内的全部记录，
+    只要缓存没有因容量上限淘汰过条目，未命中即可直接判定为未投递，无需查询数据库。
+    载入、查询和写入都在数据库线程中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, path=DEDUP_DB_PATH, retention_hours=DEDUP_RETENTION_HOURS,
+                 cache_size=DEDUP_CACHE_SIZE, enabled=DEDUP_ENABLED):
+        self.path = path
+        self.retention = retention_hours * 3600
+        self.enabled = enabled
+        self._front = TTLCache(ttl=self.retention, maxsize=cache_size, name='dedup_journal')
+        self._conn = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connect(self):
+        """首次使用时打开数据库并载入保留期内的记录"""
+        if self._conn is not None:
+            return self._conn
+        with self._lock:
+            if self._conn is not None:
+                return self._conn
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS delivered (
+                    source_chat_id TEXT NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    rule_id INTEGER NOT NULL,
+                    delivered_at REAL NOT NULL,
+                    PRIMARY KEY (source_chat_id, message_id, rule_id)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_delivered_at ON delivered (delivered_at)')
+            cutoff = time.time() - self.retention
+            conn.execute('DELETE FROM delivered WHERE delivered_at < ?', (cutoff,))
+            rows = conn.execute(
+                'SELECT source_chat_id, message_id, rule_id, delivered_at FROM delivered ORDER BY delivered_at'
+            ).fetchall()
+            now = time.time()
+            for source_chat_id, message_id, rule_id, delivered_at in rows:
+                # 只保留剩余的存活时间，与数据库中的记录同时过期
+                self._front.set((source_chat_id, message_id, rule_id),
+                                ttl=max(0, self.retention - (now - delivered_at)))
+            self._conn = conn
+            logger.info(f'去重日志已加载: {len(rows)} 条记录 (保留 {self.retention // 3600} 小时)')
+            return conn
+
+    @staticmethod
+    def _key(chat_id, message_id, rule_id):
+        return str(chat_id), int(message_id), int(rule_id)
+
+    async def is_delivered(self, chat_id, message_id, rule_id):
+        """
+        检查消息是否已经通过该规则投递过
+
+        Args:
+            chat_id: 源聊天ID
+            message_id: 源消息ID
+            rule_id: 规则ID
+
+        Returns:
+            bool: 已投递返回 True
+        """
+        if not self.enabled or message_id is None:
+            return False
+        try:
+            if self._conn is None:
+                await db_executor.run(self._connect)
+            key = self._key(chat_id, message_id, rule_id)
+            if key in self._front:
+                return True
+            # 内存缓存完整覆盖保留期时，未命中即未投递
+            if not self._front.evictions:
+                return False
+            with span('db:dedup_lookup'):
+                return await db_executor.run(self._lookup, key)
+        except Exception as e:
+            logger.error(f'查询去重日志时出错: {str(e)}')
+            return False
+
+    async def record(self, chat_id, message_id, rule_id):
+        """记录一次成功投递"""
+        if not self.enabled or message_id is None:
+            return
+        try:
+            if self._conn is None:
+                await db_executor.run(self._connect)
+            key = self._key(chat_id, message_id, rule_id)
+            self._front.add(key)
+            with span('db:dedup_record'):
+                await db_executor.run(self._write, key, time.time())
+        except Exception as e:
+            logger.error(f'写入去重日志时出错: {str(e)}')
+
+    def _lookup(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT 1 FROM delivered WHERE source_chat_id = ? AND message_id = ? AND rule_id = ? AND delivered_at >= ?',
+                key + (time.time() - self.retention,)
+            ).fetchone()
+        return row is not None
+
+    def _write(self, key, now):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO delivered (source_chat_id, message_id, rule_id, delivered_at) VALUES (?, ?, ?, ?)',
+                key + (now,)
+            )
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self._conn.execute('DELETE FROM delivered WHERE delivered_at < ?', (now - self.retention,))
+
+    def get_stats(self):
+        """获取去重日志统计"""
+        return {
+            'enabled': self.enabled,
+            'writes': self._writes,
+            **self._front.get_stats(),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# 创建全局实例
+dedup_journal = DedupJournal()
@@ -0,0 +1,270 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# 溢出策略
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_SPILL = 'spill'
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL)
+
+# 队列中的任务：负载 + 入队时间（time.time，便于落盘后恢复）
+_Job = namedtuple('_Job', ['item', 'enqueued_at'])
+
+
+class MessageDispatcher:
+    """
+    按源聊天分队列的消息分发器
+
+    每个源聊天有一个有界队列，保证同一聊天内的消息按顺序处理；
+    一组 worker 并行消费不同聊天的队列，同一时刻一个聊天只会被一个 worker 处理。
+    队列满时根据溢出策略阻塞、丢弃最旧的消息或落盘。
+    """
+
+    def __init__(self, handler, workers=4, queue_size=100, overflow_policy=OVERFLOW_BLOCK,
+                 spill_dir=None, serializer=None, loader=None):
+        """
+        初始化分发器
+
+        Args:
+            handler: 处理函数 async handler(key, item)
+            workers: worker 数量
+            queue_size: 每个聊天队列的最大长度
+            overflow_policy: 队列满时的策略 block/drop_oldest/spill
+            spill_dir: 落盘目录（spill 策略使用）
+            serializer: 将任务负载转换为可 JSON 序列化的 dict，返回 None 表示无法落盘
+            loader: async loader(record)，从落盘记录恢复任务负载，返回 None 表示跳过
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            logger.warning(f"未知的溢出策略: {overflow_policy}，使用 {OVERFLOW_BLOCK}")
+            overflow_policy = OVERFLOW_BLOCK
+        if overflow_policy == OVERFLOW_SPILL and not (spill_dir and serializer and loader):
+            logger.warning("spill 策略缺少落盘目录或序列化函数，使用 block")
+            overflow_policy = OVERFLOW_BLOCK
+
+        self.handler = handler
+        self.worker_count = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.overflow_policy = overflow_policy
+        self.spill_dir = spill_dir
+        self.serializer = serializer
+        self.loader = loader
+
+        self._queues = {}
+        self._ready = asyncio.Queue()
+        self._active = set()
+        self._spill_counts = {}
+        self._spill_offsets = {}
+        self._workers = []
+
+        # 统计信息
+        self._stats = {
+            'enqueued': 0,
+            'processed': 0,
+            'errors': 0,
+            'dropped': 0,
+            'spilled': 0,
+            'restored': 0,
+            'blocked': 0,
+        }
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+        self._avg_lag = 0.0
+
+    async def start(self):
+        """启动 worker"""
+        if self._workers:
+            return
+        if self.overflow_policy == OVERFLOW_SPILL:
+            self._reset_spill_dir()
+        for index in range(self.worker_count):
+            self._workers.append(asyncio.create_task(self._worker(index)))
+        logger.info(f"消息分发器已启动: {self.worker_count} 个worker, 队列长度 {self.queue_size}, 溢出策略 {self.overflow_policy}")
+
+    def stop(self):
+        """停止 worker"""
+        for task in self._workers:
+            task.cancel()
+        self._workers = []
+        logger.info("消息分发器已停止")
+
+    async def submit(self, key, item):
+        """
+        提交任务到指定聊天的队列
+
+        Args:
+            key: 队列键（源聊天ID）
+            item: 任务负载
+        """
+        job = _Job(item, time.time())
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            self._queues[key] = queue
+
+        if self._spill_counts.get(key) or queue.full():
+            await self._handle_overflow(key, queue, job)
+        else:
+            queue.put_nowait(job)
+
+        self._stats['enqueued'] += 1
+        self._schedule(key)
+
+    async def _handle_overflow(self, key, queue, job):
+        """队列已满（或已有落盘任务）时按策略处理"""
+        if self.overflow_policy == OVERFLOW_SPILL:
+            record = self.serializer(job.item)
+            if record is not None:
+                self._spill(key, job, record)
+                return
+            logger.warning(f"队列 {key} 的任务无法落盘，改为阻塞等待")
+
+        if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+            try:
+                queue.get_nowait()
+                self._stats['dropped'] += 1
+                logger.warning(f"队列 {key} 已满，丢弃最旧的任务")
+            except asyncio.QueueEmpty:
+                pass
+            queue.put_nowait(job)
+            return
+
+        # block：等待队列有空位，对 Telethon 事件处理形成背压
+        self._stats['blocked'] += 1
+        self._schedule(key)
+        await queue.put(job)
+
+    def _schedule(self, key):
+        """将聊天标记为待处理，保证同一聊天只被一个 worker 持有"""
+        if key not in self._active:
+            self._active.add(key)
+            self._ready.put_nowait(key)
+
+    def _has_pending(self, key):
+        queue = self._queues.get(key)
+        return bool((queue and not queue.empty()) or self._spill_counts.get(key))
+
+    async def _worker(self, index):
+        """worker 主循环"""
+        while True:
+            key = await self._ready.get()
+            try:
+                job = await self._next_job(key)
+                if job is not None:
+                    await self._run(key, job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"分发器 worker {index} 处理队列 {key} 时出错: {str(e)}")
+            finally:
+                if self._has_pending(key):
+                    self._ready.put_nowait(key)
+                else:
+                    self._active.discard(key)
+                    queue = self._queues.get(key)
+                    if queue is not None and queue.empty():
+                        del self._queues[key]
+
+    async def _next_job(self, key):
+        """取出下一个任务：先内存队列，再落盘记录"""
+        queue = self._queues.get(key)
+        if queue is not None and not queue.empty():
+            return queue.get_nowait()
+        if self._spill_counts.get(key):
+            return await self._restore(key)
+        return None
+
+    async def _run(self, key, job):
+        lag = max(0.0, time.time() - job.enqueued_at)
+        self._last_lag = lag
+        self._max_lag = max(self._max_lag, lag)
+        self._avg_lag = lag if not self._stats['processed'] else self._avg_lag * 0.9 + lag * 0.1
+        if lag > 5:
+            logger.warning(f"队列 {key} 的任务等待了 {lag:.2f} 秒才开始处理")
+        try:
+            await self.handler(key, job.item)
+        except Exception as e:
+            self._stats['errors'] += 1
+            logger.error(f"处理队列 {key} 的任务时出错: {str(e)}")
+            logger.exception(e)
+        finally:
+            self._stats['processed'] += 1
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.jsonl")
+
+    def _reset_spill_dir(self):
+        """启动时清理上一次运行遗留的落盘文件"""
+        os.makedirs(self.spill_dir, exist_ok=True)
+        for file_name in os.listdir(self.spill_dir):
+            if file_name.endswith('.jsonl'):
+                try:
+                    os.remove(os.path.join(self.spill_dir, file_name))
+                    logger.warning(f"已清理遗留的落盘队列文件: {file_name}")
+                except OSError as e:
+                    logger.error(f"清理落盘队列文件失败: {str(e)}")
+
+    def _spill(self, key, job, record):
+        """将任务追加到聊天的落盘文件"""
+        with open(self._spill_path(key), 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'enqueued_at': job.enqueued_at, 'record': record}, ensure_ascii=False) + '\n')
+        self._spill_counts[key] = self._spill_counts.get(key, 0) + 1
+        self._stats['spilled'] += 1
+        logger.info(f"队列 {key} 已满，任务已落盘 (待恢复: {self._spill_counts[key]})")
+
+    async def _restore(self, key):
+        """从落盘文件按顺序读取下一条任务"""
+        path = self._spill_path(key)
+        offset = self._spill_offsets.get(key, 0)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                f.seek(offset)
+                line = f.readline()
+                self._spill_offsets[key] = f.tell()
+        except OSError as e:
+            logger.error(f"读取落盘队列 {key} 失败: {str(e)}")
+            line = ''
+
+        remaining = self._spill_counts.get(key, 1) - 1
+        if remaining <= 0 or not line:
+            self._spill_counts.pop(key, None)
+            self._spill_offsets.pop(key, None)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        else:
+            self._spill_counts[key] = remaining
+
+        if not line:
+            return None
+
+        data = json.loads(line)
+        item = await self.loader(data['record'])
+        if item is None:
+            return None
+        self._stats['restored'] += 1
+        return _Job(item, data['enqueued_at'])
+
+    def get_stats(self):
+        """获取队列深度和延迟统计"""
+        depths = {key: queue.qsize() + self._spill_counts.get(key, 0) for key, queue in self._queues.items()}
+        for key, count in self._spill_counts.items():
+            depths.setdefault(key, count)
+        return {
+            **self._stats,
+            'workers': len(self._workers),
+            'overflow_policy': self.overflow_policy,
+            'queue_count': len(depths),
+            'total_depth': sum(depths.values()),
+            'max_depth': max(depths.values(), default=0),
+            'depths': depths,
+            'last_lag': round(self._last_lag, 3),
+            'avg_lag': round(self._avg_lag, 3),
+            'max_lag': round(self._max_lag, 3),
+        }
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import time
+
+from telethon.errors import FloodWaitError, ServerError, RpcCallFailError, TimedOutError
+
+from managers.scratch_space import scratch_space
+from utils.constants import DOWNLOAD_CONCURRENCY, DOWNLOAD_PART_SIZE_KB, DOWNLOAD_BANDWIDTH_LIMIT_KB, DOWNLOAD_RETRIES
+from utils.metrics import registry
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# 媒体下载指标
+DOWNLOAD_DURATION = registry.histogram('tf_download_duration_seconds', '媒体下载耗时', ('status',))
+DOWNLOAD_BYTES = registry.counter('tf_download_bytes_total', '媒体下载字节数')
+DOWNLOAD_QUEUE_WAIT = registry.histogram('tf_download_queue_wait_seconds', '媒体下载排队等待时间')
+DOWNLOAD_RETRIES_TOTAL = registry.counter('tf_download_retries_total', '媒体下载重试次数')
+
+# 可以重试的网络错误
+TRANSIENT_ERRORS = (
+    asyncio.TimeoutError, ConnectionError, ServerError, RpcCallFailError, TimedOutError, FloodWaitError
+)
+
+# Telegram 单次请求的上限和对齐要求
+MAX_PART_SIZE = 512 * 1024
+PART_ALIGN = 4 * 1024
+
+
+class DownloadEngine:
+    """
+    媒体下载引擎
+
+    所有下载共享一个并发上限和带宽预算，媒体组中的文件可以同时下载，
+    整组耗时接近其中最大的文件。
+    - 大于一块的文档通过 iter_download 分块写入 .part 文件，网络错误后从已写入的位置继续
+    - 照片等小文件仍使用 download_media 一次下载
+    - 开始下载前向临时目录预留文件大小的配额，空间不足时等待其他文件释放
+    - 记录排队等待时间、下载速度和重试次数
+    """
+
+    def __init__(self, concurrency=DOWNLOAD_CONCURRENCY, part_size_kb=DOWNLOAD_PART_SIZE_KB,
+                 bandwidth_limit_kb=DOWNLOAD_BANDWIDTH_LIMIT_KB, retries=DOWNLOAD_RETRIES):
+        self.concurrency = max(1, concurrency)
+        part_size = min(MAX_PART_SIZE, max(PART_ALIGN, part_size_kb * 1024))
+        self.part_size = part_size // PART_ALIGN * PART_ALIGN
+        self.rate = max(0, bandwidth_limit_kb) * 1024
+        self.retries = max(0, retries)
+        self._semaphore = None
+        self._next_slot = 0.0
+        self.active = 0
+        self.queued = 0
+        self.downloads = 0
+        self.failures = 0
+        self.bytes = 0
+        self._busy_since = None
+        self._busy_seconds = 0.0
+
+    def _get_semaphore(self):
+        # 在事件循环中首次使用时创建
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def download(self, message, directory):
+        """
+        下载消息媒体到指定目录
+
+        Returns:
+            str: 下载后的文件路径，消息没有可下载的媒体时返回 None
+        """
+        os.makedirs(directory, exist_ok=True)
+        queued_at = time.perf_counter()
+        self.queued += 1
+        try:
+            await self._get_semaphore().acquire()
+        finally:
+            self.queued -= 1
+        try:
+            reserved = await scratch_space.reserve(message.file.size if message.file else 0)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        DOWNLOAD_QUEUE_WAIT.observe(time.perf_counter() - queued_at)
+
+        self._begin()
+        started = time.perf_counter()
+        try:
+            with span('telegram:download', message_id=message.id):
+                path = await self._download_with_retry(message, directory)
+        except Exception:
+            self.failures += 1
+            DOWNLOAD_DURATION.observe(time.perf_counter() - started, 'error')
+            raise
+        finally:
+            self._end()
+            scratch_space.release_reservation(reserved)
+            self._semaphore.release()
+
+        elapsed = time.perf_counter() - started
+        DOWNLOAD_DURATION.observe(elapsed, 'ok')
+        if path:
+            size = os.path.getsize(path)
+            self.downloads += 1
+            self.bytes += size
+            DOWNLOAD_BYTES.inc(amount=size)
+            logger.info(f'媒体文件已下载到: {path} ({size // 1024} KB, {size / 1024 / max(elapsed, 0.001):.0f} KB/s)')
+        return path
+
+    async def _download_with_retry(self, message, directory):
+        attempt = 0
+        while True:
+            try:
+                document = getattr(message, 'document', None)
+                if document is not None and (getattr(document, 'size', 0) or 0) > self.part_size:
+                    return await self._download_chunked(message, document, directory)
+                return await self._download_whole(message, directory)
+            except TRANSIENT_ERRORS as e:
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                delay = e.seconds if isinstance(e, FloodWaitError) else min(30, 2 ** attempt)
+                DOWNLOAD_RETRIES_TOTAL.inc()
+                logger.warning(f'下载消息 {message.id} 的媒体出错，{delay} 秒后第 {attempt} 次重试: {str(e)}')
+                await asyncio.sleep(delay)
+
+    async def _download_whole(self, message, directory):
+        path = await message.download_media(directory)
+        if path:
+            await self._throttle(os.path.getsize(path))
+        return path
+
+    async def _download_chunked(self, message, document, directory):
+        """分块下载文档，已有 .part 文件时从其末尾（按块对齐）继续"""
+        path = os.path.join(directory, self._file_name(message))
+        part_path = path + '.part'
+        offset = 0
+        if os.path.exists(part_path):
+            offset = os.path.getsize(part_path) // self.part_size * self.part_size
+            if offset:
+                logger.info(f'继续下载 {path}，已完成 {offset // 1024} KB')
+
+        with open(part_path, 'r+b' if os.path.exists(part_path) else 'wb') as file:
+            file.seek(offset)
+            file.truncate()
+            async for chunk in message.client.iter_download(
+                document,
+                offset=offset,
+                request_size=self.part_size,
+                file_size=document.size
+            ):
+                await self._throttle(len(chunk))
+                file.write(chunk)
+
+        os.replace(part_path, path)
+        return path
+
+    @staticmethod
+    def _file_name(message):
+        """文档的文件名：优先使用原始文件名，否则按类型和消息ID生成"""
+        name = message.file.name if message.file else None
+        if name:
+            return os.path.basename(name)
+        if getattr(message, 'video', None):
+            kind = 'video'
+        elif getattr(message, 'voice', None):
+            kind = 'voice'
+        elif getattr(message, 'audio', None):
+            kind = 'audio'
+        else:
+            kind = 'document'
+        ext = message.file.ext if message.file else ''
+        return f'{kind}_{message.id}{ext or ""}'
+
+    async def _throttle(self, size):
+        """按带宽预算为本次读取的数据预留时间，超出预算时等待"""
+        if not self.rate:
+            return
+        now = time.monotonic()
+        start = max(self._next_slot, now)
+        self._next_slot = start + size / self.rate
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def _begin(self):
+        if self.active == 0:
+            self._busy_since = time.perf_counter()
+        self.active += 1
+
+    def _end(self):
+        self.active -= 1
+        if self.active == 0 and self._busy_since is not None:
+            self._busy_seconds += time.perf_counter() - self._busy_since
+            self._busy_since = None
+
+    def get_stats(self):
+        """获取下载统计信息，bytes_per_second 为有下载进行期间的平均速度"""
+        busy = self._busy_seconds
+        if self._busy_since is not None:
+            busy += time.perf_counter() - self._busy_since
+        return {
+            'active': self.active,
+            'queued': self.queued,
+            'downloads': self.downloads,
+            'failures': self.failures,
+            'bytes': self.bytes,
+            'bytes_per_second': round(self.bytes / busy) if busy else 0,
+        }
+
+
+# 创建全局实例
+download_engine = DownloadEngine()
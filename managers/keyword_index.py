@@ -0,0 +1,76 @@
+import logging
+from typing import Dict, Optional, Tuple
+
+from models.models import Keyword, ForwardRule
+from managers.config_bus import config_bus, changed_rule_ids
+from utils.regex_guard import regex_guard
+from utils.keyword_matcher import RuleKeywordMatcher
+
+logger = logging.getLogger(__name__)
+
+
+class KeywordIndex:
+    """
+    关键字匹配器缓存：rule_id -> (规则快照版本, 编译好的关键字匹配器)
+
+    首次使用时按规则的关键字编译，关键字变更（提交事务）后只丢弃受影响规则的匹配器，
+    批量 update/delete/insert 无法确定规则时全部丢弃。
+    """
+
+    def __init__(self):
+        # 规则ID -> (编译时的规则快照版本, 匹配器)
+        self._matchers: Dict[int, Tuple[Optional[int], RuleKeywordMatcher]] = {}
+        logger.info("KeywordIndex 初始化")
+
+    def get_matcher(self, rule) -> RuleKeywordMatcher:
+        """
+        获取规则的关键字匹配器
+
+        Args:
+            rule: 规则快照或会话内的转发规则（用于读取关键字）
+
+        Returns:
+            RuleKeywordMatcher: 编译好的匹配器
+        """
+        version = getattr(rule, 'version', None)
+        cached = self._matchers.get(rule.id)
+        if cached is not None and cached[0] == version and cached[1].generation == regex_guard.generation:
+            return cached[1]
+
+        matcher = RuleKeywordMatcher(rule.keywords)
+        # 失效后仍持有旧快照的调用方（如 AI 处理后再次检查关键字）只得到按旧快照编译的结果，
+        # 不覆盖较新版本的缓存；失效后被旧快照重新填入的条目也会在下一个新快照到来时替换
+        if cached is None or version is None or cached[0] is None or version >= cached[0]:
+            self._matchers[rule.id] = (version, matcher)
+        logger.info(
+            f"规则 {rule.id} 的关键字匹配器已编译: "
+            f"黑名单 {len(matcher.blacklist)} 个, 白名单 {len(matcher.whitelist)} 个"
+        )
+        return matcher
+
+    def invalidate(self, rule_ids=None) -> None:
+        """
+        丢弃匹配器，下一次使用时重新编译
+
+        Args:
+            rule_ids: 受影响的规则ID，为空时丢弃全部
+        """
+        if rule_ids is None:
+            self._matchers.clear()
+            logger.debug("关键字匹配器已全部失效")
+            return
+        for rule_id in rule_ids:
+            self._matchers.pop(rule_id, None)
+        logger.debug(f"关键字匹配器已失效: {sorted(rule_ids)}")
+
+
+# 创建全局实例
+keyword_index = KeywordIndex()
+
+
+def _on_config_change(changes):
+    """只丢弃受影响规则的缓存，无法确定规则时全部丢弃"""
+    keyword_index.invalidate(changed_rule_ids(changes))
+
+
+config_bus.subscribe(_on_config_change, entities=(Keyword.__tablename__, ForwardRule.__tablename__))
@@ -0,0 +1,277 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+from collections import OrderedDict
+
+from managers.download_engine import download_engine
+from managers.scratch_space import scratch_space
+from utils.constants import MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_SIZE_MB
+
+logger = logging.getLogger(__name__)
+
+
+def link_or_copy(source, target):
+    """把文件放到目标路径：优先创建硬链接（不占额外空间），跨文件系统时复制"""
+    if os.path.exists(target):
+        return
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _file_digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class _Entry:
+    __slots__ = ('key', 'path', 'size', 'refs')
+
+    def __init__(self, key, path, size):
+        self.key = key
+        self.path = path
+        self.size = size
+        self.refs = 0
+
+
+class MediaCache:
+    """
+    按内容寻址的媒体文件缓存
+
+    以 Telegram 照片/文档的 ID 和 access_hash 为键（没有 ID 时退化为文件内容的 SHA256），
+    同一媒体无论被多少条规则、多少个处理阶段使用都只下载一次：
+    - 同一个键同时只有一个下载任务，其余调用方等待该任务完成
+    - 调用方通过 acquire/release 持有文件引用，被引用的文件不会被淘汰
+    - 磁盘占用超过 MEDIA_CACHE_MAX_SIZE_MB 时按最近最少使用淘汰未被引用的文件
+    - RSS 媒体目录通过 link 获得硬链接（或复制），不再重新下载
+    - 登记到临时目录管理，占用计入临时目录配额，空间不足时可回收未被引用的文件
+
+    每个缓存文件放在以键的哈希命名的子目录中，保留原始文件名，
+    发送时文件名和扩展名与直接下载一致。
+    """
+
+    def __init__(self, directory=MEDIA_CACHE_DIR, max_size_mb=MEDIA_CACHE_MAX_SIZE_MB):
+        self.directory = directory
+        self.max_size = max_size_mb * 1024 * 1024
+        # 键 -> 缓存条目，按最近使用排序
+        self._entries = OrderedDict()
+        self._paths = {}
+        self._inflight = {}
+        self._staging = set()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def media_key(message):
+        """获取消息媒体的缓存键，无法识别时返回 None"""
+        photo = getattr(message, 'photo', None)
+        media = photo or getattr(message, 'document', None)
+        if media is None or getattr(media, 'id', None) is None:
+            return None
+        kind = 'photo' if photo else 'document'
+        return f"{kind}:{media.id}:{getattr(media, 'access_hash', 0)}"
+
+    async def acquire(self, message):
+        """
+        获取消息媒体的本地文件并增加引用计数，使用完毕后必须调用 release
+
+        Returns:
+            str: 缓存文件路径，下载失败时返回 None
+        """
+        key = self.media_key(message)
+        if key is None:
+            return await self._acquire_by_content(message)
+
+        while True:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                return self._ref(entry)
+
+            task = self._inflight.get(key)
+            if task is None:
+                self.misses += 1
+                task = asyncio.ensure_future(self._download(key, message))
+                self._inflight[key] = task
+                task.add_done_callback(lambda _, key=key: self._inflight.pop(key, None))
+            else:
+                self.hits += 1
+
+            entry = await asyncio.shield(task)
+            if entry is None:
+                return None
+            # 等待期间条目可能已被淘汰，此时重新下载
+            if self._entries.get(key) is entry:
+                return self._ref(entry)
+
+    def release(self, path):
+        """释放 acquire 获得的文件引用"""
+        key = self._paths.get(path)
+        entry = self._entries.get(key) if key else None
+        if entry is None:
+            return
+        entry.refs = max(0, entry.refs - 1)
+        if entry.refs == 0:
+            self._evict()
+
+    def owns(self, path):
+        """判断文件是否位于缓存中（由缓存负责清理）"""
+        return path in self._paths
+
+    async def link(self, message, target):
+        """
+        把消息媒体放到指定路径，例如规则的 RSS 媒体目录
+
+        Returns:
+            str: 目标路径，下载失败时返回 None
+        """
+        path = await self.acquire(message)
+        if not path:
+            return None
+        try:
+            await asyncio.to_thread(link_or_copy, path, target)
+        finally:
+            self.release(path)
+        return target
+
+    @property
+    def staging_dir(self):
+        return os.path.join(self.directory, '.staging')
+
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def scratch_usage(self):
+        """缓存文件占用的字节数"""
+        return self._size
+
+    def scratch_protected(self):
+        """缓存条目和正在下载的目录，孤立文件清理时跳过"""
+        protected = {os.path.dirname(entry.path) for entry in self._entries.values()}
+        protected.update(self._entry_dir(key) for key in self._inflight)
+        protected.update(self._staging)
+        return protected
+
+    def reclaim(self, size):
+        """
+        为临时目录配额释放空间：从最久未使用的条目开始删除未被引用的文件
+
+        Returns:
+            int: 实际释放的字节数
+        """
+        freed = 0
+        for entry in list(self._entries.values()):
+            if freed >= size:
+                break
+            if entry.refs > 0:
+                continue
+            self._remove(entry)
+            self.evictions += 1
+            freed += entry.size
+        if freed:
+            logger.info(f'临时目录空间不足，媒体缓存释放 {freed // 1024} KB')
+        return freed
+
+    def _ref(self, entry):
+        entry.refs += 1
+        self._entries.move_to_end(entry.key)
+        return entry.path
+
+    async def _fetch(self, message, directory):
+        """通过下载引擎把媒体下载到指定目录"""
+        # 失败时保留目录中的 .part 文件，下次获取同一媒体时继续下载
+        path = await download_engine.download(message, directory)
+        if not path:
+            shutil.rmtree(directory, ignore_errors=True)
+        return path
+
+    async def _download(self, key, message):
+        path = await self._fetch(message, self._entry_dir(key))
+        if not path:
+            return None
+        return self._insert(key, path)
+
+    async def _acquire_by_content(self, message):
+        """没有媒体ID时先下载，再按文件内容去重"""
+        staging_dir = os.path.join(self.staging_dir, uuid.uuid4().hex)
+        self._staging.add(staging_dir)
+        try:
+            try:
+                path = await self._fetch(message, staging_dir)
+            except Exception:
+                # 临时目录无法复用，不保留未完成的文件
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                raise
+            if not path:
+                return None
+            digest = await asyncio.to_thread(_file_digest, path)
+        finally:
+            self._staging.discard(staging_dir)
+        key = f'sha256:{digest}'
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            return self._ref(entry)
+
+        self.misses += 1
+        entry_dir = os.path.join(self.directory, digest[:40])
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(staging_dir, entry_dir)
+        return self._ref(self._insert(key, os.path.join(entry_dir, os.path.basename(path))))
+
+    def _insert(self, key, path):
+        entry = _Entry(key, path, os.path.getsize(path))
+        self._entries[key] = entry
+        self._paths[path] = key
+        self._size += entry.size
+        return entry
+
+    def _evict(self):
+        """磁盘占用超过上限时，从最久未使用的条目开始淘汰未被引用的文件"""
+        if self._size <= self.max_size:
+            return
+        for entry in list(self._entries.values()):
+            if self._size <= self.max_size:
+                break
+            if entry.refs > 0:
+                continue
+            self._remove(entry)
+            self.evictions += 1
+            logger.info(f'媒体缓存淘汰: {entry.path}')
+
+    def _remove(self, entry):
+        self._entries.pop(entry.key, None)
+        self._paths.pop(entry.path, None)
+        self._size -= entry.size
+        # 已硬链接到 RSS 媒体目录的文件不受影响
+        shutil.rmtree(os.path.dirname(entry.path), ignore_errors=True)
+        scratch_space.notify()
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        return {
+            'name': 'media_cache',
+            'size': len(self._entries),
+            'bytes': self._size,
+            'referenced': sum(1 for entry in self._entries.values() if entry.refs > 0),
+            'inflight': len(self._inflight),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+# 创建全局实例
+media_cache = MediaCache()
+scratch_space.register_store(media_cache)
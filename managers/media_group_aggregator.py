@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Telegram 单个媒体组最多包含的消息数
+MAX_GROUP_SIZE = 10
+
+
+class _PendingGroup:
+    """正在收集中的媒体组"""
+
+    __slots__ = ('chat_id', 'grouped_id', 'events', 'started_at', 'last_at', 'timer')
+
+    def __init__(self, chat_id, grouped_id):
+        self.chat_id = chat_id
+        self.grouped_id = grouped_id
+        self.events = {}
+        self.started_at = time.monotonic()
+        self.last_at = self.started_at
+        self.timer = None
+
+
+class MediaGroupAggregator:
+    """
+    媒体组聚合器
+
+    按 (聊天ID, grouped_id) 缓存同一媒体组陆续到达的 NewMessage 事件，
+    在一段静默期内没有新消息（或达到 Telegram 的组大小上限）时关闭该组，
+    把按消息ID排序的完整媒体组一次性交给回调处理，不再需要固定等待和历史消息查询。
+
+    静默期根据观察到的组内消息到达间隔自适应调整，并限制在 [min_wait, max_wait] 之间。
+    """
+
+    def __init__(self, on_complete, min_wait=0.5, max_wait=2.0, gap_factor=3.0, on_close=None):
+        """
+        初始化聚合器
+
+        Args:
+            on_complete: 回调 async on_complete(chat_id, event, messages)，
+                event 为组内ID最小的消息事件，messages 为按ID排序的组内消息
+            min_wait: 最短静默期（秒）
+            max_wait: 最长静默期（秒），同时也是一个组从首条消息起的最长等待时间
+            gap_factor: 静默期 = 平均到达间隔 * gap_factor
+            on_close: 可选的同步回调 on_close(chat_id, grouped_id)，在关闭媒体组时立即调用，
+                用于在回调任务运行之前就标记该组已处理，避免迟到的消息重新开始一个组
+        """
+        self.on_complete = on_complete
+        self.on_close = on_close
+        self.min_wait = min_wait
+        self.max_wait = max(max_wait, min_wait)
+        self.gap_factor = gap_factor
+
+        self._pending = {}
+        self._tasks = set()
+        self._avg_gap = None
+        self._stats = {
+            'groups': 0,
+            'messages': 0,
+            'full_groups': 0,
+        }
+
+    @property
+    def quiet_period(self):
+        """当前的静默期（秒）"""
+        if self._avg_gap is None:
+            return self.min_wait
+        return min(self.max_wait, max(self.min_wait, self._avg_gap * self.gap_factor))
+
+    def add(self, chat_id, event):
+        """
+        添加一条媒体组消息
+
+        Args:
+            chat_id: 源聊天ID
+            event: NewMessage 事件（必须带有 grouped_id）
+        """
+        message = event.message
+        key = (chat_id, message.grouped_id)
+        group = self._pending.get(key)
+        now = time.monotonic()
+
+        if group is None:
+            group = _PendingGroup(chat_id, message.grouped_id)
+            self._pending[key] = group
+        else:
+            self._observe_gap(now - group.last_at)
+            group.last_at = now
+
+        group.events[message.id] = event
+        self._stats['messages'] += 1
+
+        if len(group.events) >= MAX_GROUP_SIZE:
+            self._stats['full_groups'] += 1
+            self._close(key)
+            return
+
+        # 每收到一条消息重置静默计时，但不超过从首条消息起的最长等待时间
+        delay = min(self.quiet_period, max(0.0, group.started_at + self.max_wait - now))
+        if group.timer:
+            group.timer.cancel()
+        group.timer = asyncio.get_running_loop().call_later(delay, self._close, key)
+
+    def _observe_gap(self, gap):
+        """更新组内消息到达间隔的指数移动平均"""
+        if self._avg_gap is None:
+            self._avg_gap = gap
+        else:
+            self._avg_gap = self._avg_gap * 0.8 + gap * 0.2
+
+    def _close(self, key):
+        """关闭媒体组并交给回调处理"""
+        group = self._pending.pop(key, None)
+        if group is None:
+            return
+        if group.timer:
+            group.timer.cancel()
+
+        events = [group.events[message_id] for message_id in sorted(group.events)]
+        messages = [event.message for event in events]
+        self._stats['groups'] += 1
+        logger.info(
+            f'媒体组 {group.grouped_id} 收集完成: {len(messages)} 条消息, '
+            f'耗时 {time.monotonic() - group.started_at:.2f} 秒'
+        )
+
+        if self.on_close:
+            self.on_close(group.chat_id, group.grouped_id)
+
+        task = asyncio.create_task(self._complete(group.chat_id, events[0], messages))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _complete(self, chat_id, event, messages):
+        try:
+            await self.on_complete(chat_id, event, messages)
+        except Exception as e:
+            logger.error(f'处理媒体组时出错: {str(e)}')
+            logger.exception(e)
+
+    def flush(self):
+        """立即关闭所有正在收集的媒体组"""
+        for key in list(self._pending):
+            self._close(key)
+
+    def get_stats(self):
+        """获取聚合统计信息"""
+        return {
+            **self._stats,
+            'pending': len(self._pending),
+            'quiet_period': round(self.quiet_period, 3),
+            'avg_gap': round(self._avg_gap, 3) if self._avg_gap is not None else None,
+        }
@@ -0,0 +1,73 @@
+import logging
+from typing import Dict, Optional, Tuple
+
+from models.models import ReplaceRule, ForwardRule
+from managers.config_bus import config_bus, changed_rule_ids
+from utils.regex_guard import regex_guard
+from utils.replace_program import ReplaceProgram
+
+logger = logging.getLogger(__name__)
+
+
+class ReplaceIndex:
+    """
+    替换程序缓存：rule_id -> (规则快照版本, 编译好的替换程序)
+
+    首次使用时按规则的替换规则编译，替换规则变更（add_replace_rules、delete_replace_rules
+    等任何提交的修改）后只丢弃受影响规则的程序，批量操作无法确定规则时全部丢弃。
+    """
+
+    def __init__(self):
+        # 规则ID -> (编译时的规则快照版本, 替换程序)
+        self._programs: Dict[int, Tuple[Optional[int], ReplaceProgram]] = {}
+        logger.info("ReplaceIndex 初始化")
+
+    def get_program(self, rule) -> ReplaceProgram:
+        """
+        获取规则的替换程序
+
+        Args:
+            rule: 规则快照或会话内的转发规则（用于读取替换规则）
+
+        Returns:
+            ReplaceProgram: 编译好的替换程序
+        """
+        version = getattr(rule, 'version', None)
+        cached = self._programs.get(rule.id)
+        if cached is not None and cached[0] == version and cached[1].generation == regex_guard.generation:
+            return cached[1]
+
+        program = ReplaceProgram(rule.id, rule.replace_rules)
+        # 失效后仍持有旧快照的调用方只得到按旧快照编译的结果，不覆盖较新版本的缓存；
+        # 失效后被旧快照重新填入的条目也会在下一个新快照到来时替换
+        if cached is None or version is None or cached[0] is None or version >= cached[0]:
+            self._programs[rule.id] = (version, program)
+        logger.info(f"规则 {rule.id} 的替换程序已编译: {len(program)} 步, 剔除 {program.skipped} 条")
+        return program
+
+    def invalidate(self, rule_ids=None) -> None:
+        """
+        丢弃替换程序，下一次使用时重新编译
+
+        Args:
+            rule_ids: 受影响的规则ID，为空时丢弃全部
+        """
+        if rule_ids is None:
+            self._programs.clear()
+            logger.debug("替换程序已全部失效")
+            return
+        for rule_id in rule_ids:
+            self._programs.pop(rule_id, None)
+        logger.debug(f"替换程序已失效: {sorted(rule_ids)}")
+
+
+# 创建全局实例
+replace_index = ReplaceIndex()
+
+
+def _on_config_change(changes):
+    """只丢弃受影响规则的缓存，无法确定规则时全部丢弃"""
+    replace_index.invalidate(changed_rule_ids(changes))
+
+
+config_bus.subscribe(_on_config_change, entities=(ReplaceRule.__tablename__, ForwardRule.__tablename__))
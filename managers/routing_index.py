@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import threading
+from collections import namedtuple
+from typing import Dict, Tuple
+
+from sqlalchemy.orm import joinedload
+
+from models.models import get_session, Chat, ForwardRule
+from models.db_executor import db_executor
+from managers.config_bus import config_bus
+
+logger = logging.getLogger(__name__)
+
+# 单条已启用规则的只读快照，仅包含路由决策所需的字段
+RouteSnapshot = namedtuple('RouteSnapshot', [
+    'rule_id',
+    'use_bot',
+    'source_chat_name',
+    'target_chat_id',
+    'target_chat_name',
+])
+
+
+class RoutingIndex:
+    """
+    路由索引：telegram_chat_id -> 以该聊天为源的已启用规则快照
+
+    启动时构建一次，规则或聊天发生变更（本进程提交或其他进程通过 config_bus 通知）后标记失效，
+    下一次查询时在数据库线程中整体重建（同时只有一次重建）。未绑定任何规则的聊天只需一次字典查找即可丢弃。
+    """
+
+    def __init__(self):
+        self._routes: Dict[str, Tuple[RouteSnapshot, ...]] = {}
+        self._dirty = True
+        self._version = 0
+        # 每次失效递增，重建期间发生的失效不会被重建结果覆盖
+        self._generation = 0
+        self._rebuilding = None
+        self._lock = threading.Lock()
+        logger.info("RoutingIndex 初始化")
+
+    @property
+    def version(self) -> int:
+        """当前索引版本，每次重建后递增"""
+        return self._version
+
+    def build(self) -> None:
+        """从数据库重建路由索引（同步执行，在数据库线程中调用）"""
+        generation = self._generation
+        session = get_session()
+        try:
+            rules = session.query(ForwardRule).options(
+                joinedload(ForwardRule.source_chat),
+                joinedload(ForwardRule.target_chat)
+            ).filter(
+                ForwardRule.enable_rule == True
+            ).order_by(ForwardRule.id).all()
+
+            routes = {}
+            for rule in rules:
+                source_chat = rule.source_chat
+                target_chat = rule.target_chat
+                if not source_chat or not target_chat:
+                    continue
+                routes.setdefault(source_chat.telegram_chat_id, []).append(RouteSnapshot(
+                    rule_id=rule.id,
+                    use_bot=bool(rule.use_bot),
+                    source_chat_name=source_chat.name,
+                    target_chat_id=target_chat.telegram_chat_id,
+                    target_chat_name=target_chat.name,
+                ))
+        finally:
+            session.close()
+
+        with self._lock:
+            self._routes = {chat_id: tuple(snapshots) for chat_id, snapshots in routes.items()}
+            # 查询期间又发生了变更时，本次结果可能已过期，保持失效状态
+            self._dirty = self._generation != generation
+            self._version += 1
+        logger.info(f"路由索引已重建: {len(self._routes)} 个源聊天, {len(rules)} 条已启用规则 (版本: {self._version})")
+
+    def invalidate(self) -> None:
+        """标记索引失效，下一次查询时重建"""
+        with self._lock:
+            self._generation += 1
+            self._dirty = True
+        logger.debug("路由索引已标记为失效")
+
+    async def get_routes(self, chat_id) -> Tuple[RouteSnapshot, ...]:
+        """
+        获取指定源聊天的已启用规则快照，索引失效时先在数据库线程中重建
+
+        Args:
+            chat_id: 源聊天的 telegram_chat_id
+
+        Returns:
+            tuple: 规则快照元组，没有规则时返回空元组
+        """
+        if self._dirty:
+            if self._rebuilding is None:
+                self._rebuilding = asyncio.ensure_future(self._rebuild())
+            await asyncio.shield(self._rebuilding)
+        return self._routes.get(str(chat_id), ())
+
+    async def _rebuild(self) -> None:
+        try:
+            await db_executor.run(self.build)
+        except Exception as e:
+            logger.error(f"重建路由索引时出错: {str(e)}")
+        finally:
+            self._rebuilding = None
+
+
+# 创建全局实例
+routing_index = RoutingIndex()
+
+
+def _on_config_change(changes):
+    """规则或聊天变更后路由索引整体失效"""
+    routing_index.invalidate()
+
+
+config_bus.subscribe(_on_config_change, entities=(Chat.__tablename__, ForwardRule.__tablename__))
@@ -0,0 +1,250 @@
+import logging
+import threading
+from collections import namedtuple
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy.orm import joinedload, selectinload
+
+from models.models import (
+    get_session, Chat, ForwardRule, Keyword, ReplaceRule, MediaTypes,
+    MediaExtensions, PushConfig, RSSConfig
+)
+from models.db_executor import db_executor
+from managers.config_bus import config_bus, changed_rule_ids
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+def _row_type(name, model):
+    """按模型的列生成只读的行快照类型，模型新增列后快照自动包含"""
+    return namedtuple(name, [column.key for column in model.__table__.columns])
+
+
+def _capture(row_type, obj):
+    if obj is None:
+        return None
+    return row_type(*(getattr(obj, field) for field in row_type._fields))
+
+
+# 关联实体的只读快照，字段与对应模型的列一致
+ChatSnapshot = _row_type('ChatSnapshot', Chat)
+KeywordSnapshot = _row_type('KeywordSnapshot', Keyword)
+ReplaceRuleSnapshot = _row_type('ReplaceRuleSnapshot', ReplaceRule)
+MediaTypesSnapshot = _row_type('MediaTypesSnapshot', MediaTypes)
+PushConfigSnapshot = _row_type('PushConfigSnapshot', PushConfig)
+RSSConfigSnapshot = _row_type('RSSConfigSnapshot', RSSConfig)
+
+# ForwardRule 的全部列
+_RULE_FIELDS = tuple(column.key for column in ForwardRule.__table__.columns)
+
+# 预先加载的关联数据
+_RELATED_FIELDS = (
+    'source_chat',        # ChatSnapshot
+    'target_chat',        # ChatSnapshot
+    'keywords',           # tuple[KeywordSnapshot]
+    'replace_rules',      # tuple[ReplaceRuleSnapshot]，按ID排序
+    'media_types',        # MediaTypesSnapshot 或 None
+    'media_extensions',   # tuple[str]，小写扩展名
+    'push_configs',       # tuple[PushConfigSnapshot]
+    'rss_config',         # RSSConfigSnapshot 或 None
+    'version',            # 生成快照时的索引版本
+)
+
+# 影响规则快照的实体
+_SNAPSHOT_ENTITIES = (Chat, ForwardRule, Keyword, ReplaceRule, MediaTypes, MediaExtensions, PushConfig, RSSConfig)
+
+
+class RuleSnapshot:
+    """
+    转发规则的只读快照
+
+    包含规则的全部列以及过滤器链需要的关联数据，与 SQLAlchemy 会话完全分离，
+    访问任何属性都不会触发数据库查询。快照不可修改，需要调整的值请使用局部变量。
+    """
+
+    __slots__ = _RULE_FIELDS + _RELATED_FIELDS
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'RuleSnapshot 是只读的，不能修改属性 {name}')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'RuleSnapshot 是只读的，不能删除属性 {name}')
+
+    @classmethod
+    def capture(cls, rule, push_configs=(), version=0):
+        """
+        从已加载关联数据的 ForwardRule 生成快照
+
+        Args:
+            rule: 转发规则（关联数据需已加载，否则会触发按需查询）
+            push_configs: 规则的推送配置
+            version: 索引版本
+
+        Returns:
+            RuleSnapshot: 规则快照
+        """
+        values = {field: getattr(rule, field) for field in _RULE_FIELDS}
+        values.update(
+            source_chat=_capture(ChatSnapshot, rule.source_chat),
+            target_chat=_capture(ChatSnapshot, rule.target_chat),
+            keywords=tuple(
+                _capture(KeywordSnapshot, keyword)
+                for keyword in sorted(rule.keywords, key=lambda k: k.id)
+            ),
+            replace_rules=tuple(
+                _capture(ReplaceRuleSnapshot, replace_rule)
+                for replace_rule in sorted(rule.replace_rules, key=lambda r: r.id)
+            ),
+            media_types=_capture(MediaTypesSnapshot, rule.media_types),
+            media_extensions=tuple(
+                extension.extension.lower()
+                for extension in sorted(rule.media_extensions, key=lambda e: e.id)
+            ),
+            push_configs=tuple(_capture(PushConfigSnapshot, config) for config in push_configs),
+            rss_config=_capture(RSSConfigSnapshot, rule.rss_config),
+            version=version,
+        )
+        return cls(**values)
+
+    @property
+    def enabled_push_configs(self):
+        """已启用的推送配置"""
+        return tuple(config for config in self.push_configs if config.enable_push_channel)
+
+    def __repr__(self):
+        return f'<RuleSnapshot id={self.id} version={self.version}>'
+
+
+class RuleSnapshotIndex:
+    """
+    规则快照缓存：rule_id -> RuleSnapshot
+
+    未缓存的规则一次性批量加载（规则、聊天、关键字、替换规则、媒体设置、推送和RSS配置），
+    之后处理消息时不再访问数据库。规则或其关联数据变更（由 config_bus 通知）后只丢弃受影响规则的快照，
+    聊天变更或批量 update/delete/insert 无法确定规则时全部丢弃。
+    """
+
+    def __init__(self):
+        self._snapshots: Dict[int, RuleSnapshot] = {}
+        self._version = 0
+        self._lock = threading.Lock()
+        logger.info("RuleSnapshotIndex 初始化")
+
+    @property
+    def version(self) -> int:
+        """当前缓存版本，每次失效后递增"""
+        return self._version
+
+    def get(self, rule_id) -> Optional[RuleSnapshot]:
+        """获取单条规则的快照，规则不存在时返回 None"""
+        return self.get_many([rule_id]).get(rule_id)
+
+    def get_many(self, rule_ids: Iterable[int]) -> Dict[int, RuleSnapshot]:
+        """
+        批量获取规则快照
+
+        Args:
+            rule_ids: 规则ID列表
+
+        Returns:
+            dict: rule_id -> RuleSnapshot，不存在的规则不包含在结果中
+        """
+        snapshots = {}
+        missing = []
+        for rule_id in rule_ids:
+            snapshot = self._snapshots.get(rule_id)
+            if snapshot is None:
+                missing.append(rule_id)
+            else:
+                snapshots[rule_id] = snapshot
+        if missing:
+            snapshots.update(self._load(missing))
+        return snapshots
+
+    async def get_many_async(self, rule_ids: Iterable[int]) -> Dict[int, RuleSnapshot]:
+        """批量获取规则快照，有未缓存的规则时在数据库线程中加载，不阻塞事件循环"""
+        rule_ids = list(rule_ids)
+        if all(rule_id in self._snapshots for rule_id in rule_ids):
+            return self.get_many(rule_ids)
+        return await db_executor.run(self.get_many, rule_ids)
+
+    def _load(self, rule_ids):
+        version = self._version
+        session = get_session()
+        try:
+            with span('db:load_rule_snapshots', count=len(rule_ids)):
+                rules = session.query(ForwardRule).options(
+                    joinedload(ForwardRule.source_chat),
+                    joinedload(ForwardRule.target_chat),
+                    joinedload(ForwardRule.media_types),
+                    joinedload(ForwardRule.rss_config),
+                    selectinload(ForwardRule.keywords),
+                    selectinload(ForwardRule.replace_rules),
+                    selectinload(ForwardRule.media_extensions),
+                ).filter(
+                    ForwardRule.id.in_(rule_ids)
+                ).all()
+
+                # ForwardRule.push_config 是一对一关系，而一条规则可以有多个推送配置，单独批量查询
+                push_configs = {}
+                for config in session.query(PushConfig).filter(
+                    PushConfig.rule_id.in_(rule_ids)
+                ).order_by(PushConfig.id):
+                    push_configs.setdefault(config.rule_id, []).append(config)
+
+                snapshots = {
+                    rule.id: RuleSnapshot.capture(rule, push_configs.get(rule.id, ()), version)
+                    for rule in rules
+                }
+        finally:
+            session.close()
+
+        with self._lock:
+            # 加载期间发生了变更时，本次结果可能已过期，只返回不缓存
+            if self._version == version:
+                self._snapshots.update(snapshots)
+        logger.debug(f"规则快照已加载: {sorted(snapshots)} (版本: {version})")
+        return snapshots
+
+    def invalidate(self, rule_ids=None) -> None:
+        """
+        丢弃快照，下一次使用时重新加载
+
+        Args:
+            rule_ids: 受影响的规则ID，为空时丢弃全部
+        """
+        with self._lock:
+            self._version += 1
+            if rule_ids is None:
+                self._snapshots.clear()
+            else:
+                for rule_id in rule_ids:
+                    self._snapshots.pop(rule_id, None)
+        if rule_ids is None:
+            logger.debug("规则快照已全部失效")
+        else:
+            logger.debug(f"规则快照已失效: {sorted(rule_ids)}")
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取缓存统计"""
+        return {'size': len(self._snapshots), 'version': self._version}
+
+
+# 创建全局实例
+rule_snapshots = RuleSnapshotIndex()
+
+
+def _on_config_change(changes):
+    """聊天变更可能影响任意规则，其余变更只丢弃受影响规则的快照"""
+    if any(change.entity == Chat.__tablename__ for change in changes):
+        rule_snapshots.invalidate()
+    else:
+        rule_snapshots.invalidate(changed_rule_ids(changes))
+
+
+config_bus.subscribe(_on_config_change, entities=[entity.__tablename__ for entity in _SNAPSHOT_ENTITIES])
@@ -0,0 +1,310 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+
+from utils.constants import TEMP_DIR, TEMP_QUOTA_MB, TEMP_QUOTA_WAIT, TEMP_ORPHAN_AGE
+
+logger = logging.getLogger(__name__)
+
+
+def _path_size(path):
+    """文件或目录（递归）占用的字节数"""
+    if not os.path.isdir(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return total
+
+
+def _last_modified(path):
+    """文件或目录中最近一次修改的时间"""
+    try:
+        latest = os.path.getmtime(path)
+    except OSError:
+        return 0
+    if os.path.isdir(path):
+        for directory, _, files in os.walk(path):
+            for name in files:
+                try:
+                    latest = max(latest, os.path.getmtime(os.path.join(directory, name)))
+                except OSError:
+                    pass
+    return latest
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        os.remove(path)
+
+
+class Lease:
+    """
+    一次操作（如转发一条链接消息、一次导入导出）专用的临时目录
+
+    操作结束时调用 release（或使用 async with）整体删除，失败时也不会遗留文件。
+    """
+
+    def __init__(self, space, owner):
+        self.space = space
+        self.owner = owner
+        name = re.sub(r'[^\w-]', '_', owner)
+        self.directory = os.path.join(space.scratch_dir, f'{name}-{uuid.uuid4().hex[:12]}')
+        os.makedirs(self.directory, exist_ok=True)
+        self.released = False
+        # 最近一次统计的目录大小，由 ScratchSpace.measure 在线程中更新
+        self.measured = 0
+
+    def path(self, name):
+        """租约目录中的文件路径"""
+        return os.path.join(self.directory, name)
+
+    def size(self):
+        """统计目录当前大小（遍历文件，不要在事件循环中直接调用）"""
+        return _path_size(self.directory)
+
+    def release(self):
+        """删除租约目录及其中的所有文件"""
+        if self.released:
+            return
+        self.released = True
+        self.space._release_lease(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class ScratchSpace:
+    """
+    临时目录管理
+
+    - 租约：每次操作使用独立的临时目录，结束或失败时整体删除
+    - 配额：临时目录（含媒体缓存等登记的存储）的总大小受 TEMP_QUOTA_MB 限制，
+      新的下载先预留空间，超出时先让存储回收未使用的文件，仍不足时等待其他操作释放
+    - 清理：定期删除不属于任何租约或存储、且长时间未修改的孤立文件；启动时清空整个目录
+
+    登记的存储需要提供:
+        directory: 存储所在目录
+        scratch_usage(): 当前占用的字节数
+        scratch_protected(): 正在使用、不能清理的路径集合
+        reclaim(size): 尝试释放 size 字节，返回实际释放的字节数
+    """
+
+    def __init__(self, root=TEMP_DIR, quota_mb=TEMP_QUOTA_MB, quota_wait=TEMP_QUOTA_WAIT,
+                 orphan_age=TEMP_ORPHAN_AGE):
+        self.root = root
+        self.scratch_dir = os.path.join(root, 'scratch')
+        self.quota = max(0, quota_mb) * 1024 * 1024
+        self.quota_wait = quota_wait
+        self.orphan_age = orphan_age
+        self._leases = {}
+        self._stores = []
+        self._reserved = 0
+        self._freed = None
+        self.waiting = 0
+        self.backpressure_waits = 0
+        self.backpressure_timeouts = 0
+        self.swept_files = 0
+        self.swept_bytes = 0
+
+    def register_store(self, store):
+        """登记使用临时目录的存储（如媒体缓存），计入配额并在清理时保护其正在使用的文件"""
+        self._stores.append(store)
+
+    def lease(self, owner):
+        """为一次操作创建临时目录"""
+        lease = Lease(self, owner)
+        self._leases[lease.directory] = lease
+        return lease
+
+    def _release_lease(self, lease):
+        self._leases.pop(lease.directory, None)
+        shutil.rmtree(lease.directory, ignore_errors=True)
+        self.notify()
+
+    def used(self):
+        """
+        临时目录当前占用的字节数（登记的存储和所有租约）
+
+        租约目录使用最近一次 measure 的结果，不在事件循环中遍历文件。
+        """
+        total = sum(store.scratch_usage() for store in self._stores)
+        return total + sum(lease.measured for lease in self._leases.values())
+
+    @staticmethod
+    def _measure(leases):
+        for lease in leases:
+            lease.measured = lease.size()
+
+    async def measure(self):
+        """在线程中重新统计所有租约目录的大小"""
+        leases = list(self._leases.values())
+        if leases:
+            await asyncio.to_thread(self._measure, leases)
+
+    def notify(self):
+        """有空间被释放，唤醒等待配额的下载"""
+        if self._freed is not None:
+            self._freed.set()
+
+    async def reserve(self, size):
+        """
+        为即将写入的数据预留配额
+
+        超出配额时先让登记的存储回收空间，仍不足时等待空间释放，
+        最多等待 TEMP_QUOTA_WAIT 秒，超时后仍然放行，避免所有下载停住。
+
+        Returns:
+            int: 预留的字节数，写入完成后交给 release_reservation
+        """
+        size = max(0, size or 0)
+        if self.quota and size < self.quota:
+            deadline = time.monotonic() + self.quota_wait
+            waited = False
+            while True:
+                await self.measure()
+                over = self.used() + self._reserved + size - self.quota
+                for store in self._stores:
+                    if over <= 0:
+                        break
+                    over -= store.reclaim(over)
+                if over <= 0:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.backpressure_timeouts += 1
+                    logger.warning(f'临时目录超出配额 {over // 1024} KB，等待 {self.quota_wait} 秒后仍继续写入')
+                    break
+                if not waited:
+                    waited = True
+                    self.backpressure_waits += 1
+                    logger.info(f'临时目录超出配额 {over // 1024} KB，等待空间释放')
+                if self._freed is None:
+                    self._freed = asyncio.Event()
+                self._freed.clear()
+                self.waiting += 1
+                try:
+                    # 文件也可能被其他途径删除，至少每秒重新检查一次
+                    await asyncio.wait_for(self._freed.wait(), min(remaining, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self.waiting -= 1
+        self._reserved += size
+        return size
+
+    def release_reservation(self, size):
+        """释放 reserve 预留的配额"""
+        self._reserved = max(0, self._reserved - size)
+        self.notify()
+
+    def _protected_paths(self):
+        protected = set(self._leases)
+        for store in self._stores:
+            protected.update(store.scratch_protected())
+        return protected
+
+    def _containers(self):
+        """只清理其中的内容、本身不删除的目录"""
+        containers = {self.root, self.scratch_dir}
+        for store in self._stores:
+            containers.add(store.directory)
+            containers.add(os.path.join(store.directory, '.staging'))
+        return containers
+
+    def _sweep(self, protected, containers, now):
+        removed = 0
+        removed_bytes = 0
+        pending = [self.root]
+        while pending:
+            directory = pending.pop()
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(directory, name)
+                if path in protected:
+                    continue
+                if path in containers:
+                    pending.append(path)
+                    continue
+                if now - _last_modified(path) < self.orphan_age:
+                    continue
+                size = _path_size(path)
+                try:
+                    _remove(path)
+                except OSError as e:
+                    logger.error(f'删除孤立临时文件失败 {path}: {str(e)}')
+                    continue
+                removed += 1
+                removed_bytes += size
+                logger.info(f'删除孤立临时文件: {path} ({size // 1024} KB)')
+        return removed, removed_bytes
+
+    async def sweep(self):
+        """删除孤立的临时文件，返回删除的数量"""
+        # 在事件循环中确定受保护的路径，文件操作放到线程中执行
+        protected = self._protected_paths()
+        await self.measure()
+        removed, removed_bytes = await asyncio.to_thread(
+            self._sweep, protected, self._containers(), time.time()
+        )
+        self.swept_files += removed
+        self.swept_bytes += removed_bytes
+        if removed:
+            self.notify()
+        return removed
+
+    async def sweep_loop(self, interval):
+        """定期清理孤立的临时文件"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f'清理临时目录时出错: {str(e)}')
+
+    def clear(self):
+        """启动时清空临时目录，上次运行（包括异常退出）遗留的文件全部删除"""
+        os.makedirs(self.root, exist_ok=True)
+        for name in os.listdir(self.root):
+            try:
+                _remove(os.path.join(self.root, name))
+            except OSError as e:
+                logger.error(f'清空临时目录失败 {name}: {str(e)}')
+        os.makedirs(self.scratch_dir, exist_ok=True)
+
+    def get_stats(self):
+        """获取临时目录统计信息"""
+        return {
+            'used_bytes': self.used(),
+            'quota_bytes': self.quota,
+            'reserved_bytes': self._reserved,
+            'leases': len(self._leases),
+            'waiting': self.waiting,
+            'backpressure_waits': self.backpressure_waits,
+            'backpressure_timeouts': self.backpressure_timeouts,
+            'swept_files': self.swept_files,
+            'swept_bytes': self.swept_bytes,
+        }
+
+
+# 创建全局实例
+scratch_space = ScratchSpace()
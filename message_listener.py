@@ -1,5 +1,4 @@
-from telethon import events
-from models.models import get_session, Chat, ForwardRule
+from telethon import events, utils
 import logging
 from handlers import user_handler, bot_handler
 from handlers.prompt_handlers import handle_prompt_setting
@@ -8,19 +7,93 @@ import os
 from dotenv import load_dotenv
 from telethon.tl.types import ChannelParticipantsAdmins
 from managers.state_manager import state_manager
+from managers.routing_index import routing_index
+from managers.rule_snapshot import rule_snapshots
+from managers.media_cache import media_cache
+from managers.download_engine import download_engine
+from managers.scratch_space import scratch_space
+from models.db_executor import db_executor
 from telethon.tl import types
 from filters.process import process_forward_rule
+from filters.prepared_message import PreparedMessage
+from managers.dispatcher import MessageDispatcher
+from managers.media_group_aggregator import MediaGroupAggregator
+from utils.ttl_cache import TTLCache, get_all_cache_stats
+from utils.metrics import registry
+from utils.tracing import trace, span
+from utils.constants import DISPATCHER_WORKERS, DISPATCHER_QUEUE_SIZE, DISPATCHER_OVERFLOW_POLICY, DISPATCHER_SPILL_DIR, RULE_FANOUT_CONCURRENT
+from utils.constants import MEDIA_GROUP_MIN_WAIT, MEDIA_GROUP_MAX_WAIT
 # 加载环境变量
 load_dotenv()
 
 # 获取logger
 logger = logging.getLogger(__name__)
 
-# 添加一个缓存来存储已处理的媒体组
-PROCESSED_GROUPS = set()
+# 已处理的媒体组，5分钟后过期
+PROCESSED_GROUPS = TTLCache(ttl=300, maxsize=10000, name='processed_groups')
 
 BOT_ID = None
 
+# 按源聊天分队列的消息分发器
+dispatcher = None
+
+# 媒体组聚合器
+media_group_aggregator = None
+
+# 消息处理指标
+MESSAGES_RECEIVED = registry.counter('tf_messages_received_total', '用户客户端收到的消息数')
+MESSAGES_ROUTED = registry.counter('tf_messages_routed_total', '命中转发规则的消息数')
+RULES_EVALUATED = registry.counter('tf_rules_evaluated_total', '执行的转发规则次数', ('mode',))
+DISPATCHER_GAUGE = registry.gauge('tf_dispatcher', '消息分发器状态（队列深度、等待延迟等）', ('stat',))
+DISPATCHER_TOTAL = registry.counter('tf_dispatcher_total', '消息分发器累计计数（入队、处理、出错、丢弃等）', ('stat',))
+CACHE_GAUGE = registry.gauge('tf_cache', '缓存状态（条目数、占用字节数等）', ('cache', 'stat'))
+CACHE_TOTAL = registry.counter('tf_cache_total', '缓存累计计数（命中、未命中、淘汰、过期）', ('cache', 'stat'))
+DB_EXECUTOR_GAUGE = registry.gauge('tf_db_executor', '数据库线程状态（线程数、排队数）', ('stat',))
+DB_EXECUTOR_TOTAL = registry.counter('tf_db_executor_total', '数据库线程累计计数（提交数、累计执行时间）', ('stat',))
+DOWNLOAD_GAUGE = registry.gauge('tf_download_engine', '媒体下载引擎状态（进行中、排队、平均速度）', ('stat',))
+DOWNLOAD_TOTAL = registry.counter('tf_download_engine_total', '媒体下载引擎累计计数（下载数、失败数、字节数）', ('stat',))
+TEMP_SPACE_GAUGE = registry.gauge('tf_temp_space', '临时目录状态（占用、配额、预留、租约、等待中）', ('stat',))
+TEMP_SPACE_TOTAL = registry.counter('tf_temp_space_total', '临时目录累计计数（等待空间、等待超时、清理文件）', ('stat',))
+
+
+def collect_listener_metrics():
+    """导出前刷新分发器和缓存的指标：瞬时值导出为 gauge，累计值导出为 counter"""
+    if dispatcher:
+        stats = dispatcher.get_stats()
+        for stat in ('total_depth', 'max_depth', 'queue_count', 'last_lag', 'avg_lag', 'max_lag'):
+            DISPATCHER_GAUGE.set(stats[stat], stat)
+        for stat in ('enqueued', 'processed', 'errors', 'dropped', 'spilled', 'restored', 'blocked'):
+            DISPATCHER_TOTAL.set_total(stats[stat], stat)
+    if media_group_aggregator:
+        stats = media_group_aggregator.get_stats()
+        DISPATCHER_GAUGE.set(stats['pending'], 'pending_media_groups')
+        DISPATCHER_GAUGE.set(stats['quiet_period'], 'media_group_quiet_period')
+    for stats in get_all_cache_stats():
+        CACHE_GAUGE.set(stats['size'], stats['name'], 'size')
+        for stat in ('hits', 'misses', 'evictions', 'expirations'):
+            CACHE_TOTAL.set_total(stats[stat], stats['name'], stat)
+    CACHE_GAUGE.set(rule_snapshots.get_stats()['size'], 'rule_snapshots', 'size')
+    stats = media_cache.get_stats()
+    for stat in ('size', 'bytes', 'referenced', 'inflight'):
+        CACHE_GAUGE.set(stats[stat], 'media_cache', stat)
+    for stat in ('hits', 'misses', 'evictions'):
+        CACHE_TOTAL.set_total(stats[stat], 'media_cache', stat)
+    stats = db_executor.get_stats()
+    for stat in ('workers', 'pending'):
+        DB_EXECUTOR_GAUGE.set(stats[stat], stat)
+    for stat in ('submitted', 'busy_seconds'):
+        DB_EXECUTOR_TOTAL.set_total(stats[stat], stat)
+    stats = download_engine.get_stats()
+    for stat in ('active', 'queued', 'bytes_per_second'):
+        DOWNLOAD_GAUGE.set(stats[stat], stat)
+    for stat in ('downloads', 'failures', 'bytes'):
+        DOWNLOAD_TOTAL.set_total(stats[stat], stat)
+    stats = scratch_space.get_stats()
+    for stat in ('used_bytes', 'quota_bytes', 'reserved_bytes', 'leases', 'waiting'):
+        TEMP_SPACE_GAUGE.set(stats[stat], stat)
+    for stat in ('backpressure_waits', 'backpressure_timeouts', 'swept_files', 'swept_bytes'):
+        TEMP_SPACE_TOTAL.set_total(stats[stat], stat)
+
 async def setup_listeners(user_client, bot_client):
     """
     设置消息监听器
@@ -29,7 +102,7 @@ async def setup_listeners(user_client, bot_client):
         user_client: 用户客户端（用于监听消息和转发）
         bot_client: 机器人客户端（用于处理命令和转发）
     """
-    global BOT_ID
+    global BOT_ID, dispatcher, media_group_aggregator
     
     # 直接获取机器人ID
     try:
@@ -38,6 +111,56 @@ async def setup_listeners(user_client, bot_client):
         logger.info(f"获取到机器人ID: {BOT_ID} (类型: {type(BOT_ID)})")
     except Exception as e:
         logger.error(f"获取机器人ID时出错: {str(e)}")
+
+    # 预先构建路由索引，避免第一条消息触发重建
+    try:
+        await db_executor.run(routing_index.build)
+    except Exception as e:
+        logger.error(f"构建路由索引时出错: {str(e)}")
+
+    # 创建并启动消息分发器，任务负载为 (事件, 媒体组消息)
+    async def dispatch_handler(chat_id, item):
+        event, group_messages = item
+        await forward_to_rules(event, chat_id, user_client, bot_client, group_messages)
+
+    def serialize_item(item):
+        event, group_messages = item
+        message_ids = [message.id for message in group_messages] if group_messages else [event.message.id]
+        return {'chat_id': event.chat_id, 'message_ids': message_ids}
+
+    async def load_spilled_item(record):
+        messages = await user_client.get_messages(record['chat_id'], ids=record['message_ids'])
+        messages = [message for message in messages if message]
+        if not messages:
+            logger.warning(f"无法恢复落盘的消息: {record}")
+            return None
+        spilled_event = events.NewMessage.Event(messages[0])
+        spilled_event._set_client(user_client)
+        return spilled_event, (messages if messages[0].grouped_id else None)
+
+    dispatcher = MessageDispatcher(
+        dispatch_handler,
+        workers=DISPATCHER_WORKERS,
+        queue_size=DISPATCHER_QUEUE_SIZE,
+        overflow_policy=DISPATCHER_OVERFLOW_POLICY,
+        spill_dir=DISPATCHER_SPILL_DIR,
+        serializer=serialize_item,
+        loader=load_spilled_item
+    )
+    await dispatcher.start()
+
+    registry.add_collector(collect_listener_metrics)
+
+    # 创建媒体组聚合器，媒体组收集完整后再进入分发
+    async def media_group_handler(chat_id, event, messages):
+        await handle_media_group(chat_id, event, messages, user_client, bot_client)
+
+    media_group_aggregator = MediaGroupAggregator(
+        media_group_handler,
+        min_wait=MEDIA_GROUP_MIN_WAIT,
+        max_wait=MEDIA_GROUP_MAX_WAIT,
+        on_close=mark_group_processed
+    )
     
     # 过滤器，排除机器人自己的消息
     async def not_from_bot(event):
@@ -72,12 +195,14 @@ async def handle_user_message(event, user_client, bot_client):
     """处理用户客户端收到的消息"""
     # logger.info("handle_user_message:开始处理用户消息")
     
-    chat = await event.get_chat()
-    chat_id = abs(chat.id)
+    MESSAGES_RECEIVED.inc()
+
+    # 直接从事件的 peer 中解析聊天ID，避免额外的 get_chat 调用
+    chat_id = abs(utils.resolve_id(event.chat_id)[0])
     # logger.info(f"handle_user_message:获取到聊天ID: {chat_id}")
 
     # 检查是否频道消息
-    if isinstance(event.chat, types.Channel) and state_manager.check_state():
+    if event.is_channel and state_manager.check_state():
         # logger.info("handle_user_message:检测到频道消息且存在状态")
         sender_id = os.getenv('USER_ID')
         # 频道ID需要加上100前缀
@@ -102,66 +227,114 @@ async def handle_user_message(event, user_client, bot_client):
             return
         # logger.info("提示词设置处理未完成，继续执行")
 
+    # 通过路由索引检查该聊天是否有已启用的转发规则，没有则直接丢弃
+    routes = await routing_index.get_routes(chat_id)
+    if not routes:
+        return
+    MESSAGES_ROUTED.inc()
+
     # 检查是否是媒体组消息
     if event.message.grouped_id:
-        # 如果这个媒体组已经处理过，就跳过
+        # 如果这个媒体组已经处理过（收集结束后迟到的消息），就跳过
         group_key = f"{chat_id}:{event.message.grouped_id}"
         if group_key in PROCESSED_GROUPS:
             return
+        # 交给聚合器收集完整的媒体组
+        if media_group_aggregator:
+            media_group_aggregator.add(chat_id, event)
+            return
         # 标记这个媒体组为已处理
         PROCESSED_GROUPS.add(group_key)
-        asyncio.create_task(clear_group_cache(group_key))
-    
-    # 首先检查数据库中是否有该聊天的转发规则
-    session = get_session()
-    try:
-        # 查询源聊天
-        source_chat = session.query(Chat).filter(
-            Chat.telegram_chat_id == str(chat_id)
-        ).first()
-        
-        if not source_chat:
-            return
-            
-        # 添加日志：查询转发规则
-        logger.info(f'找到源聊天: {source_chat.name} (ID: {source_chat.id})')
-        
-        # 查找以当前聊天为源的规则
-        rules = session.query(ForwardRule).filter(
-            ForwardRule.source_chat_id == source_chat.id
-        ).all()
-        
-        if not rules:
-            logger.info(f'聊天 {source_chat.name} 没有转发规则')
-            return
-        
+        logger.info(f'[用户] 收到媒体组消息 来自聊天: {routes[0].source_chat_name} ({chat_id}) 组ID: {event.message.grouped_id}')
+    else:
         # 有转发规则时，才记录消息信息
-        if event.message.grouped_id:
-            logger.info(f'[用户] 收到媒体组消息 来自聊天: {source_chat.name} ({chat_id}) 组ID: {event.message.grouped_id}')
-        else:
-            logger.info(f'[用户] 收到新消息 来自聊天: {source_chat.name} ({chat_id}) 内容: {event.message.text}')
-            
-        # 添加日志：处理规则
-        logger.info(f'找到 {len(rules)} 条转发规则')
+        logger.info(f'[用户] 收到新消息 来自聊天: {routes[0].source_chat_name} ({chat_id}) 内容: {event.message.text}')
+
+    # 添加日志：处理规则
+    logger.info(f'找到 {len(routes)} 条转发规则')
+
+    await submit_message(chat_id, event, user_client, bot_client)
+
+def mark_group_processed(chat_id, grouped_id):
+    """媒体组收集结束时立即标记为已处理，忽略之后迟到的消息"""
+    PROCESSED_GROUPS.add(f"{chat_id}:{grouped_id}")
+
+async def handle_media_group(chat_id, event, messages, user_client, bot_client):
+    """处理聚合器收集完整的媒体组"""
+    # 收集期间规则可能已变更
+    routes = await routing_index.get_routes(chat_id)
+    if not routes:
+        return
+
+    logger.info(f'[用户] 收到媒体组消息 来自聊天: {routes[0].source_chat_name} ({chat_id}) 组ID: {event.message.grouped_id}, 共 {len(messages)} 条')
+    logger.info(f'找到 {len(routes)} 条转发规则')
+
+    await submit_message(chat_id, event, user_client, bot_client, messages)
+
+async def submit_message(chat_id, event, user_client, bot_client, group_messages=None):
+    """交给分发器按源聊天排队处理，避免慢规则阻塞 Telethon 的事件处理"""
+    if dispatcher:
+        await dispatcher.submit(chat_id, (event, group_messages))
+    else:
+        await forward_to_rules(event, chat_id, user_client, bot_client, group_messages)
+
+async def forward_to_rules(event, chat_id, user_client, bot_client, group_messages=None):
+    """对消息执行源聊天的所有转发规则，整个处理过程记录为一条追踪"""
+    with trace('forward', chat_id=chat_id, message_id=event.message.id,
+               group_size=len(group_messages) if group_messages else None):
+        await execute_rules(event, chat_id, user_client, bot_client, group_messages)
+
+async def execute_rules(event, chat_id, user_client, bot_client, group_messages=None):
+    """对消息执行源聊天的所有转发规则，各规则共享同一份预处理结果"""
+    # 消息排队期间规则可能已变更，重新读取路由
+    routes = await routing_index.get_routes(chat_id)
+    if not routes:
+        return
+
+    # 媒体组、发送者信息、媒体下载在所有规则间只做一次
+    prepared = PreparedMessage(event, group_messages)
+    try:
+        # 规则快照已包含过滤器链需要的全部配置，命中缓存时不访问数据库
+        rules = await rule_snapshots.get_many_async([route.rule_id for route in routes])
         
-        # 处理每条转发规则
-        for rule in rules:
-            target_chat = rule.target_chat
-            if not rule.enable_rule:
-                logger.info(f'规则 {rule.id} 未启用')
+        jobs = []
+        for route in routes:
+            rule = rules.get(route.rule_id)
+            if not rule or not rule.enable_rule:
+                logger.info(f'规则 {route.rule_id} 不存在或未启用')
                 continue
-            logger.info(f'处理转发规则 ID: {rule.id} (从 {source_chat.name} 转发到: {target_chat.name})')
-            if rule.use_bot:
-                # 直接使用过滤器模块中的process_forward_rule函数
-                await process_forward_rule(bot_client, event, str(chat_id), rule)
-            else:
-                await user_handler.process_forward_rule(user_client, event, str(chat_id), rule)
+            jobs.append((route, rule))
+
+        if RULE_FANOUT_CONCURRENT and len(jobs) > 1:
+            # 不同规则之间相互独立，并发执行；单条规则失败不影响其他规则
+            results = await asyncio.gather(
+                *(run_rule(route, rule, event, chat_id, user_client, bot_client, prepared) for route, rule in jobs),
+                return_exceptions=True
+            )
+            for (route, rule), result in zip(jobs, results):
+                if isinstance(result, Exception):
+                    logger.error(f'处理转发规则 {rule.id} 时发生错误: {str(result)}')
+                    logger.exception(result)
+        else:
+            for route, rule in jobs:
+                await run_rule(route, rule, event, chat_id, user_client, bot_client, prepared)
         
     except Exception as e:
         logger.error(f'处理用户消息时发生错误: {str(e)}')
         logger.exception(e)  # 添加详细的错误堆栈
     finally:
-        session.close()
+        prepared.cleanup()
+
+async def run_rule(route, rule, event, chat_id, user_client, bot_client, prepared):
+    """执行单条转发规则"""
+    logger.info(f'处理转发规则 ID: {rule.id} (从 {route.source_chat_name} 转发到: {route.target_chat_name})')
+    RULES_EVALUATED.inc('bot' if rule.use_bot else 'user')
+    with span('rule', rule_id=rule.id, mode='bot' if rule.use_bot else 'user'):
+        if rule.use_bot:
+            # 直接使用过滤器模块中的process_forward_rule函数
+            await process_forward_rule(bot_client, event, str(chat_id), rule, prepared)
+        else:
+            await user_handler.process_forward_rule(user_client, event, str(chat_id), rule, prepared)
 
 async def handle_bot_message(event, bot_client):
     """处理机器人客户端收到的消息（命令）"""
@@ -191,8 +364,3 @@ async def handle_bot_message(event, bot_client):
     except Exception as e:
         logger.error(f'处理机器人命令时发生错误: {str(e)}')
         logger.exception(e)
-
-async def clear_group_cache(group_key, delay=300):  # 5分钟后清除缓存
-    """清除已处理的媒体组记录"""
-    await asyncio.sleep(delay)
-    PROCESSED_GROUPS.discard(group_key)
@@ -0,0 +1,151 @@
+"""
+SQLite 多进程读写基准测试
+
+对比默认引擎（create_engine 默认配置）与调优引擎（WAL、pragma、连接池）在多个进程
+同时读写同一数据库文件时的吞吐量和锁冲突次数。写进程模拟添加关键字，读进程模拟
+加载规则及其关键字，与机器人进程和 RSS 进程共享 forward.db 的场景一致。
+
+用法:
+    python -m models.db_benchmark --writers 2 --readers 4 --duration 10
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker, selectinload
+
+from models.models import Base, Chat, ForwardRule, Keyword, create_db_engine
+
+# 预置的规则数量与每条规则的关键字数量
+SEED_RULES = 20
+SEED_KEYWORDS = 50
+
+
+def _seed(url):
+    engine = create_db_engine(url, tuned=False)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        for index in range(SEED_RULES):
+            source = Chat(telegram_chat_id=f'-100{index}', name=f'source {index}')
+            target = Chat(telegram_chat_id=f'-200{index}', name=f'target {index}')
+            session.add_all([source, target])
+            session.flush()
+            rule = ForwardRule(source_chat_id=source.id, target_chat_id=target.id)
+            session.add(rule)
+            session.flush()
+            session.add_all(
+                Keyword(rule_id=rule.id, keyword=f'seed {index}-{n}') for n in range(SEED_KEYWORDS)
+            )
+        session.commit()
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def _worker(url, tuned, role, worker_id, start_at, deadline, results):
+    engine = create_db_engine(url, tuned=tuned)
+    Session = sessionmaker(bind=engine)
+    time.sleep(max(0.0, start_at - time.time()))
+    ops = 0
+    locked = 0
+    latencies = []
+    n = 0
+    while time.time() < deadline:
+        started = time.perf_counter()
+        session = Session()
+        try:
+            if role == 'writer':
+                n += 1
+                session.add(Keyword(rule_id=n % SEED_RULES + 1, keyword=f'{role}{worker_id}-{n}'))
+                session.commit()
+            else:
+                rule = session.query(ForwardRule).options(
+                    selectinload(ForwardRule.keywords)
+                ).filter(ForwardRule.id == n % SEED_RULES + 1).first()
+                len(rule.keywords)
+                n += 1
+            ops += 1
+            latencies.append(time.perf_counter() - started)
+        except OperationalError as e:
+            session.rollback()
+            if 'locked' in str(e) or 'busy' in str(e):
+                locked += 1
+            else:
+                raise
+        finally:
+            session.close()
+    engine.dispose()
+    results.put((role, ops, locked, latencies))
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(tuned, writers, readers, duration):
+    """
+    执行一轮基准测试
+
+    Returns:
+        dict: 各角色的吞吐量（次/秒）、锁冲突次数和 P95 延迟（毫秒）
+    """
+    directory = tempfile.mkdtemp(prefix='tf-db-bench-')
+    url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    try:
+        _seed(url)
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        # 留出进程启动时间，所有进程在同一时刻开始计时
+        start_at = time.time() + 3
+        deadline = start_at + duration
+        processes = [
+            context.Process(target=_worker, args=(url, tuned, role, index, start_at, deadline, results))
+            for role, count in (('writer', writers), ('reader', readers))
+            for index in range(count)
+        ]
+        for process in processes:
+            process.start()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    summary = {}
+    for role in ('writer', 'reader'):
+        rows = [row for row in collected if row[0] == role]
+        latencies = [latency for row in rows for latency in row[3]]
+        summary[role] = {
+            'ops_per_second': sum(row[1] for row in rows) / duration,
+            'locked': sum(row[2] for row in rows),
+            'p95_ms': _percentile(latencies, 0.95) * 1000,
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite 多进程读写基准测试')
+    parser.add_argument('--writers', type=int, default=2, help='写进程数')
+    parser.add_argument('--readers', type=int, default=4, help='读进程数')
+    parser.add_argument('--duration', type=float, default=10, help='每轮测试时长（秒）')
+    args = parser.parse_args()
+
+    print(f'写进程 {args.writers} 个, 读进程 {args.readers} 个, 每轮 {args.duration} 秒')
+    print(f"{'配置':<8}{'角色':<8}{'吞吐(次/秒)':>14}{'锁冲突':>10}{'P95(毫秒)':>12}")
+    for name, tuned in (('默认', False), ('调优', True)):
+        summary = run(tuned, args.writers, args.readers, args.duration)
+        for role, label in (('writer', '写'), ('reader', '读')):
+            stats = summary[role]
+            print(f"{name:<8}{label:<8}{stats['ops_per_second']:>14.1f}{stats['locked']:>10}{stats['p95_ms']:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
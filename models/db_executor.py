@@ -0,0 +1,111 @@
+"""
+数据库执行器
+
+SQLAlchemy 会话是同步的，直接在协程里查询会阻塞 Telethon 的事件循环：一次耗时的
+/copy_rule 或 /import 期间所有消息转发都会停住。这里把数据库操作提交到专用的
+线程池（请求队列）中执行，协程只等待结果。
+
+同一个会话可以先后在不同线程中使用（SQLite 连接已设置 check_same_thread=False），
+但不能同时在多个线程中使用：调用方在 await 返回之前不要再操作同一个会话。
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.constants import DB_EXECUTOR_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+class DBExecutor:
+    """在专用线程池中执行同步数据库操作"""
+
+    def __init__(self, workers=DB_EXECUTOR_WORKERS):
+        self.workers = max(1, workers)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._pending = 0
+        self._busy_seconds = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix='db'
+                    )
+        return self._executor
+
+    def _call(self, func, args, kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._busy_seconds += time.perf_counter() - started
+
+    async def run(self, func, *args, **kwargs):
+        """在数据库线程中执行同步函数并等待结果"""
+        with self._lock:
+            self._submitted += 1
+            self._pending += 1
+        # 复制上下文，日志和追踪信息在数据库线程中保持一致
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(),
+            functools.partial(context.run, self._call, func, args, kwargs)
+        )
+
+    def shutdown(self, wait=True) -> None:
+        """关闭线程池，等待进行中的操作完成"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def reset(self) -> None:
+        """
+        丢弃继承的线程池
+
+        fork 出的子进程只复制了当前线程，父进程的线程池在子进程中不可用。
+        """
+        # 锁可能在 fork 时被其他线程持有，一并重建
+        self._lock = threading.Lock()
+        self._executor = None
+        self._submitted = 0
+        self._pending = 0
+        self._busy_seconds = 0.0
+
+    def get_stats(self) -> dict:
+        """获取执行器统计信息"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'submitted': self._submitted,
+                'pending': self._pending,
+                'busy_seconds': round(self._busy_seconds, 3),
+            }
+
+
+# 创建全局实例
+db_executor = DBExecutor()
+
+
+def run_in_db_thread(func):
+    """
+    装饰器：把同步的数据库函数包装为协程，调用时在数据库线程中执行
+
+    保留原有的 await 调用方式，例如 DBOperations 的方法。
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await db_executor.run(func, *args, **kwargs)
+    return wrapper
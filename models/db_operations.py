@@ -1,4 +1,3 @@
-from sqlalchemy.exc import IntegrityError
 from models.models import Keyword, ReplaceRule, ForwardRule, MediaTypes, MediaExtensions, RSSConfig, RSSPattern, User, RuleSync, PushConfig
 from werkzeug.security import check_password_hash, generate_password_hash
 from sqlalchemy.orm import joinedload
@@ -10,8 +9,12 @@ from pathlib import Path
 from dotenv import load_dotenv
 from ufb.ufb_client import UFBClient
 from models.models import get_session
-from sqlalchemy import text
+from models.db_executor import db_executor, run_in_db_thread
+from sqlalchemy import text, inspect, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
 from enums.enums import ForwardMode, PreviewMode, MessageMode, AddMode, HandleMode
+from utils.regex_guard import screen_patterns, analyze_pattern, RISK_INVALID, RISK_EXPONENTIAL
 
 logger = logging.getLogger(__name__)
 load_dotenv()
@@ -70,85 +73,92 @@ class DBOperations:
             self.ufb_client = None
     
     
+    def _build_ufb_config(self, session, rule_id):
+        """按规则的关键字更新本地UFB配置文件，返回需要同步的配置，规则未开启UFB时返回None"""
+        # 通过rule_id获取规则ufb是否开启
+        rule = session.query(ForwardRule).filter(ForwardRule.id == rule_id).first()
+        ufb_domain = rule.ufb_domain
+        if rule.is_ufb and ufb_domain:
+            item = rule.ufb_item
+            # 获取规则的所有非正则表达关键字
+            normal_keywords = session.query(Keyword).filter(
+                Keyword.rule_id == rule_id,
+                Keyword.is_regex == False
+            ).all()
+            
+            # 获取规则的所有正则表达关键字
+            regex_keywords = session.query(Keyword).filter(
+                Keyword.rule_id == rule_id,
+                Keyword.is_regex == True
+            ).all()
+
+            # 获取../ufb/config/config.json文件
+            config_file = Path(__file__).parent.parent / 'ufb' / 'config' / 'config.json'
+            # 读取文件
+            with open(config_file, 'r', encoding='utf-8') as file:
+                config = json.load(file)
+
+            # 在userConfig中找到对应domain的配置
+            for user_config in config.get('userConfig', []):
+                if user_config.get('domain') == ufb_domain:
+                    # 根据item类型更新关键字
+                    if item == 'main':
+                        keywords_config = user_config.get('mainAndSubPageKeywords', {})
+                    elif item == 'content':
+                        keywords_config = user_config.get('contentPageKeywords', {})
+                    elif item == 'main_username':
+                        keywords_config = user_config.get('mainAndSubPageUserKeywords', {})
+                    elif item == 'content_username':
+                        keywords_config = user_config.get('contentPageUserKeywords', {})
+
+                    # 更新关键字列表
+                    keywords_config['keywords'] = [k.keyword for k in normal_keywords]
+                    keywords_config['regexPatterns'] = [k.keyword for k in regex_keywords]
+
+                    # 保存回对应的位置
+                    if item == 'main':  
+                        user_config['mainAndSubPageKeywords'] = keywords_config
+                    elif item == 'content':
+                        user_config['contentPageKeywords'] = keywords_config
+                    elif item == 'main_username':
+                        user_config['mainAndSubPageUserKeywords'] = keywords_config
+                    elif item == 'content_username':
+                        user_config['contentPageUserKeywords'] = keywords_config
+                    else:
+                        logger.error(f"未设置UFB_ITEM环境变量")
+                        return None
+                    break
+            
+            # 更新时间戳
+            config['globalConfig']['SYNC_CONFIG']['lastSyncTime'] = int(time.time() * 1000)
+            # 保存到本地文件
+            with open(config_file, 'w', encoding='utf-8') as file:
+                json.dump(config, file, ensure_ascii=False, indent=2)
+            return config
+        logger.warning("UFB未开启，无法同步配置")
+        return None
+
     async def sync_to_server(self,session,rule_id):
         """同步UFB配置"""
         if self.ufb_client and os.getenv('UFB_ENABLED').lower() == 'true':
-            # 通过rule_id获取规则ufb是否开启
-            rule = session.query(ForwardRule).filter(ForwardRule.id == rule_id).first()
-            ufb_domain = rule.ufb_domain
-            if rule.is_ufb and ufb_domain:
-                item = rule.ufb_item
-                # 获取规则的所有非正则表达关键字
-                normal_keywords = session.query(Keyword).filter(
-                    Keyword.rule_id == rule_id,
-                    Keyword.is_regex == False
-                ).all()
-                
-                # 获取规则的所有正则表达关键字
-                regex_keywords = session.query(Keyword).filter(
-                    Keyword.rule_id == rule_id,
-                    Keyword.is_regex == True
-                ).all()
-
-                # 获取../ufb/config/config.json文件
-                config_file = Path(__file__).parent.parent / 'ufb' / 'config' / 'config.json'
-                # 读取文件
-                with open(config_file, 'r', encoding='utf-8') as file:
-                    config = json.load(file)
-
-                # 在userConfig中找到对应domain的配置
-                for user_config in config.get('userConfig', []):
-                    if user_config.get('domain') == ufb_domain:
-                        # 根据item类型更新关键字
-                        if item == 'main':
-                            keywords_config = user_config.get('mainAndSubPageKeywords', {})
-                        elif item == 'content':
-                            keywords_config = user_config.get('contentPageKeywords', {})
-                        elif item == 'main_username':
-                            keywords_config = user_config.get('mainAndSubPageUserKeywords', {})
-                        elif item == 'content_username':
-                            keywords_config = user_config.get('contentPageUserKeywords', {})
-
-                        # 更新关键字列表
-                        keywords_config['keywords'] = [k.keyword for k in normal_keywords]
-                        keywords_config['regexPatterns'] = [k.keyword for k in regex_keywords]
-
-                        # 保存回对应的位置
-                        if item == 'main':  
-                            user_config['mainAndSubPageKeywords'] = keywords_config
-                        elif item == 'content':
-                            user_config['contentPageKeywords'] = keywords_config
-                        elif item == 'main_username':
-                            user_config['mainAndSubPageUserKeywords'] = keywords_config
-                        elif item == 'content_username':
-                            user_config['contentPageUserKeywords'] = keywords_config
-                        else:
-                            logger.error(f"未设置UFB_ITEM环境变量")
-                            return
-                        break
-                
-                # 更新时间戳
-                config['globalConfig']['SYNC_CONFIG']['lastSyncTime'] = int(time.time() * 1000)
-                # 保存到本地文件
-                with open(config_file, 'w', encoding='utf-8') as file:
-                    json.dump(config, file, ensure_ascii=False, indent=2)
-
-                # 更新配置到服务器
-                if self.ufb_client.is_connected:
-                    await self.ufb_client.websocket.send(json.dumps({
-                        "additional_info": "to_server",
-                        "type": "update",
-                        **config
-                    }))
-                    logger.info("UFB配置已同步")
-                else:
-                    logger.warning("UFB客户端未连接，无法同步配置")
+            config = await db_executor.run(self._build_ufb_config, session, rule_id)
+            if config is None:
+                return
+            # 更新配置到服务器
+            if self.ufb_client.is_connected:
+                await self.ufb_client.websocket.send(json.dumps({
+                    "additional_info": "to_server",
+                    "type": "update",
+                    **config
+                }))
+                logger.info("UFB配置已同步")
             else:
-                logger.warning("UFB未开启，无法同步配置")
+                logger.warning("UFB客户端未连接，无法同步配置")
         else:
             logger.warning("UFB客户端未初始化，无法同步配置")
 
-    async def sync_from_json(self, config):
+    @run_in_db_thread
+    def sync_from_json(self, config):
         """从收到的JSON配置同步关键字到数据库
         
         Args:
@@ -237,97 +247,141 @@ class DBOperations:
         Returns:
             tuple: (成功数量, 重复数量)
         """
-        success_count = 0
-        duplicate_count = 0
+        # 调用方已检查过正则，这里不会再有被拒绝的正则
+        counts, _ = await self.bulk_add_keywords(
+            session, [rule_id], [(keyword, is_blacklist) for keyword in keywords], is_regex
+        )
+        return counts.get(rule_id, (0, 0))
 
-        # 获取当前规则
-        rule = session.query(ForwardRule).get(rule_id)
-        if not rule:
-            logger.error(f"规则ID {rule_id} 不存在")
-            return 0, 0
-
-        # 处理单个规则的关键字添加
-        for keyword in keywords:
-            try:
-                # 检查是否存在相同的关键字（考虑黑白名单）
-                existing_keyword = session.query(Keyword).filter(
-                    Keyword.rule_id == rule_id,
-                    Keyword.keyword == keyword,
-                    Keyword.is_blacklist == is_blacklist
-                ).first()
+    async def bulk_add_keywords(self, session, rule_ids, items, is_regex=False, sync_server=True):
+        """批量添加关键字到多条规则，启用了同步的规则同时添加到同步目标规则
 
-                if existing_keyword:
-                    duplicate_count += 1
-                    continue
+        Args:
+            session: 数据库会话
+            rule_ids: 规则ID列表
+            items: (关键字, 是否黑名单) 列表
+            is_regex: 是否是正则表达式
+            sync_server: 是否同步UFB配置，分批导入时只在最后同步一次
 
-                new_keyword = Keyword(
-                    rule_id=rule_id,
-                    keyword=keyword,
-                    is_regex=is_regex,
-                    is_blacklist=is_blacklist
+        Returns:
+            tuple: (规则ID -> (成功数量, 重复数量)，不存在的规则不包含在结果中;
+                    被拒绝的正则 [(正则, 原因)])
+        """
+        counts, rejected = await db_executor.run(self._bulk_add_keywords, session, rule_ids, items, is_regex)
+        if sync_server:
+            for rule_id in counts:
+                await self.sync_to_server(session, rule_id)
+        return counts, rejected
+
+    def _bulk_add_keywords(self, session, rule_ids, items, is_regex):
+        rules = self._existing_rules(session, rule_ids)
+        if not rules:
+            return {}, []
+
+        # 拒绝无效或存在灾难性回溯风险的正则
+        rejected = []
+        if is_regex:
+            accepted, rejected = screen_patterns([keyword for keyword, _ in items])
+            accepted = set(accepted)
+            items = [item for item in items if item[0] in accepted]
+
+        sync_targets = self._sync_target_ids(session, rules)
+        target_ids = set(rules) | sync_targets
+
+        # 只查询本批关键字在目标规则中是否已存在，在内存中去重
+        existing = set()
+        for batch in self._batches(sorted({keyword for keyword, _ in items})):
+            existing.update(
+                tuple(row) for row in session.query(Keyword.rule_id, Keyword.keyword, Keyword.is_blacklist).filter(
+                    Keyword.rule_id.in_(target_ids),
+                    Keyword.keyword.in_(batch)
                 )
-                session.add(new_keyword)
-                session.flush()
+            )
+        rows = []
+        counts = {}
+        for rule_id in sorted(target_ids):
+            success_count = 0
+            duplicate_count = 0
+            for keyword, is_blacklist in items:
+                key = (rule_id, keyword, is_blacklist)
+                if key in existing:
+                    duplicate_count += 1
+                    continue
+                existing.add(key)
+                rows.append({
+                    'rule_id': rule_id,
+                    'keyword': keyword,
+                    'is_regex': is_regex,
+                    'is_blacklist': is_blacklist
+                })
                 success_count += 1
-            except Exception as e:
-                logger.error(f"添加关键字时出错: {str(e)}")
-                session.rollback()
-                duplicate_count += 1
-                continue
+            counts[rule_id] = (success_count, duplicate_count)
 
-        # 检查是否启用了同步功能
-        if rule.enable_sync:
-            logger.info(f"规则 {rule_id} 启用了同步功能，正在同步关键字到关联规则")
-            # 获取需要同步的规则列表
-            sync_rules = session.query(RuleSync).filter(RuleSync.rule_id == rule_id).all()
-            
-            # 为每个同步规则添加相同的关键字
-            for sync_rule in sync_rules:
-                sync_rule_id = sync_rule.sync_rule_id
-                logger.info(f"正在同步关键字到规则 {sync_rule_id}")
-                
-                # 获取同步目标规则
-                target_rule = session.query(ForwardRule).get(sync_rule_id)
-                if not target_rule:
-                    logger.warning(f"同步目标规则 {sync_rule_id} 不存在，跳过")
-                    continue
-                
-                # 为同步目标规则添加关键字
-                sync_success = 0
-                sync_duplicate = 0
-                for keyword in keywords:
-                    try:
-                        # 检查同步规则是否已有此关键字
-                        existing_keyword = session.query(Keyword).filter(
-                            Keyword.rule_id == sync_rule_id,
-                            Keyword.keyword == keyword,
-                            Keyword.is_blacklist == is_blacklist
-                        ).first()
-                        
-                        if existing_keyword:
-                            sync_duplicate += 1
-                            continue
-                            
-                        # 添加新关键字到同步规则
-                        new_keyword = Keyword(
-                            rule_id=sync_rule_id,
-                            keyword=keyword,
-                            is_regex=is_regex,
-                            is_blacklist=is_blacklist
-                        )
-                        session.add(new_keyword)
-                        session.flush()
-                        sync_success += 1
-                    except Exception as e:
-                        logger.error(f"同步关键字到规则 {sync_rule_id} 时出错: {str(e)}")
-                        continue
-                
-                logger.info(f"同步规则 {sync_rule_id} 的结果: 成功={sync_success}, 重复={sync_duplicate}")
+        self._insert_ignore_duplicates(session, Keyword, rows, target_ids)
+        self._log_sync_counts('关键字', counts, sync_targets - set(rules))
+        return {rule_id: counts[rule_id] for rule_id in rules}, rejected
 
-        await self.sync_to_server(session, rule_id)
-        return success_count, duplicate_count
+    def _existing_rules(self, session, rule_ids):
+        """按ID加载规则，记录不存在的规则，返回 rule_id -> ForwardRule"""
+        rules = {rule.id: rule for rule in session.query(ForwardRule).filter(ForwardRule.id.in_(set(rule_ids)))}
+        for rule_id in set(rule_ids) - set(rules):
+            logger.error(f"规则ID {rule_id} 不存在")
+        return rules
+
+    def _sync_target_ids(self, session, rules):
+        """启用了同步功能的规则对应的同步目标规则ID（只包含存在的规则）"""
+        source_ids = [rule_id for rule_id, rule in rules.items() if rule.enable_sync]
+        if not source_ids:
+            return set()
+        sync_ids = {
+            sync_rule_id for sync_rule_id, in session.query(RuleSync.sync_rule_id).filter(
+                RuleSync.rule_id.in_(source_ids)
+            )
+        }
+        existing_ids = {
+            rule_id for rule_id, in session.query(ForwardRule.id).filter(ForwardRule.id.in_(sync_ids))
+        } if sync_ids else set()
+        for sync_rule_id in sync_ids - existing_ids:
+            logger.warning(f"同步目标规则 {sync_rule_id} 不存在，跳过")
+        return existing_ids
+
+    @staticmethod
+    def _batches(values, size=500):
+        """按批拆分 IN 查询的参数，避免超过 SQLite 的参数数量限制"""
+        for start in range(0, len(values), size):
+            yield values[start:start + size]
+
+    @staticmethod
+    def _insert_ignore_duplicates(session, model, rows, rule_ids):
+        """用一条 executemany 插入多行，并发写入的重复行由唯一约束跳过（INSERT ... ON CONFLICT DO NOTHING）"""
+        if not rows:
+            return
+        dialect = session.get_bind().dialect.name
+        if dialect == 'sqlite':
+            stmt = sqlite_insert(model).on_conflict_do_nothing()
+        elif dialect == 'postgresql':
+            stmt = postgresql_insert(model).on_conflict_do_nothing()
+        else:
+            stmt = insert(model)
+        # 只通知受影响的规则，而不是全部规则
+        session.execute(stmt.execution_options(config_rule_ids=tuple(rule_ids)), rows)
+
+    @staticmethod
+    def _log_sync_counts(kind, counts, sync_only_ids):
+        if not sync_only_ids:
+            return
+        success_count = sum(counts[rule_id][0] for rule_id in sync_only_ids)
+        duplicate_count = sum(counts[rule_id][1] for rule_id in sync_only_ids)
+        logger.info(f"已同步{kind}到 {len(sync_only_ids)} 条关联规则: 成功={success_count}, 重复={duplicate_count}")
+
+    def _get_keywords(self, session, rule_id, add_mode):
+        return session.query(Keyword).filter(
+            Keyword.rule_id == rule_id,
+            Keyword.is_blacklist == (add_mode == 'blacklist')
+        ).all()
 
-    async def get_keywords(self, session, rule_id, add_mode):
+    @run_in_db_thread
+    def get_keywords(self, session, rule_id, add_mode):
         """获取规则的所有关键字
         
         Args:
@@ -337,10 +391,7 @@ class DBOperations:
         Returns:
             list: 关键字列表
         """
-        return session.query(Keyword).filter(
-            Keyword.rule_id == rule_id,
-            Keyword.is_blacklist == (add_mode == 'blacklist')
-        ).all()
+        return self._get_keywords(session, rule_id, add_mode)
 
     async def delete_keywords(self, session, rule_id, indices):
         """删除指定索引的关键字
@@ -353,16 +404,26 @@ class DBOperations:
         Returns:
             tuple: (删除数量, 剩余关键字列表)
         """
+        result = await db_executor.run(self._delete_keywords, session, rule_id, indices)
+        if result is None:
+            return 0, []
+        deleted_count, add_mode = result
+        await self.sync_to_server(session, rule_id)
+        return deleted_count, await self.get_keywords(session, rule_id, add_mode)
+
+    def _delete_keywords(self, session, rule_id, indices):
+        """删除关键字并同步删除关联规则的关键字，返回(删除数量, 关键字模式)，没有可删除的关键字时返回None"""
         # 获取当前规则
         rule = session.query(ForwardRule).get(rule_id)
         if not rule:
             logger.error(f"规则ID {rule_id} 不存在")
-            return 0, []
+            return None
             
         # 获取当前规则的关键字
-        keywords = await self.get_keywords(session, rule_id, 'blacklist' if rule.add_mode == AddMode.BLACKLIST else 'whitelist')
+        add_mode = 'blacklist' if rule.add_mode == AddMode.BLACKLIST else 'whitelist'
+        keywords = self._get_keywords(session, rule_id, add_mode)
         if not keywords:
-            return 0, []
+            return None
             
         deleted_count = 0
         max_id = len(keywords)
@@ -419,8 +480,7 @@ class DBOperations:
                 
                 logger.info(f"同步删除规则 {sync_rule_id} 的关键字: 删除了 {sync_deleted} 个")
 
-        await self.sync_to_server(session, rule_id)
-        return deleted_count, await self.get_keywords(session, rule_id, 'blacklist' if rule.add_mode == AddMode.BLACKLIST else 'whitelist')
+        return deleted_count, add_mode
 
     async def add_replace_rules(self, session, rule_id, patterns, contents=None):
         """添加替换规则
@@ -434,98 +494,81 @@ class DBOperations:
         Returns:
             tuple: (成功数量, 重复数量)
         """
-        # 获取当前规则
-        rule = session.query(ForwardRule).get(rule_id)
-        if not rule:
-            logger.error(f"规则ID {rule_id} 不存在")
-            return 0, 0
-            
-        success_count = 0
-        duplicate_count = 0
-        
         if contents is None:
             contents = [''] * len(patterns)
-        
-        # 添加替换规则到主规则
-        added_rules = []  # 存储成功添加的规则，用于后续同步
-        for pattern, content in zip(patterns, contents):
-            try:
-                # 检查是否已存在相同的替换规则
-                existing_rule = session.query(ReplaceRule).filter(
-                    ReplaceRule.rule_id == rule_id,
-                    ReplaceRule.pattern == pattern,
-                    ReplaceRule.content == content
-                ).first()
-                
-                if existing_rule:
+        # 调用方已检查过正则，这里不会再有被拒绝的正则
+        counts, _ = await self.bulk_add_replace_rules(session, [rule_id], list(zip(patterns, contents)))
+        return counts.get(rule_id, (0, 0))
+
+    @run_in_db_thread
+    def bulk_add_replace_rules(self, session, rule_ids, pairs):
+        """批量添加替换规则到多条规则，启用了同步的规则同时添加到同步目标规则
+
+        有新增替换规则的规则会自动启用替换模式。
+
+        Args:
+            session: 数据库会话
+            rule_ids: 规则ID列表
+            pairs: (匹配模式, 替换内容) 列表
+
+        Returns:
+            tuple: (规则ID -> (成功数量, 重复数量)，不存在的规则不包含在结果中;
+                    被拒绝的正则 [(正则, 原因)])
+        """
+        rules = self._existing_rules(session, rule_ids)
+        if not rules:
+            return {}, []
+
+        # 拒绝无效或存在灾难性回溯风险的正则
+        accepted, rejected = screen_patterns([pattern for pattern, _ in pairs])
+        accepted = set(accepted)
+        pairs = [(pattern, content or '') for pattern, content in pairs if pattern in accepted]
+
+        sync_targets = self._sync_target_ids(session, rules)
+        target_ids = set(rules) | sync_targets
+
+        # 只查询本批匹配模式在目标规则中是否已存在，在内存中去重
+        existing = set()
+        for batch in self._batches(sorted({pattern for pattern, _ in pairs})):
+            existing.update(
+                (rule_id, pattern, content or '') for rule_id, pattern, content in session.query(
+                    ReplaceRule.rule_id, ReplaceRule.pattern, ReplaceRule.content
+                ).filter(
+                    ReplaceRule.rule_id.in_(target_ids),
+                    ReplaceRule.pattern.in_(batch)
+                )
+            )
+        rows = []
+        counts = {}
+        for rule_id in sorted(target_ids):
+            success_count = 0
+            duplicate_count = 0
+            for pattern, content in pairs:
+                key = (rule_id, pattern, content)
+                if key in existing:
                     duplicate_count += 1
                     continue
-                    
-                new_rule = ReplaceRule(
-                    rule_id=rule_id,
-                    pattern=pattern,
-                    content=content
-                )
-                session.add(new_rule)
-                session.flush()
+                existing.add(key)
+                rows.append({'rule_id': rule_id, 'pattern': pattern, 'content': content})
                 success_count += 1
-                added_rules.append({'pattern': pattern, 'content': content})
-            except IntegrityError:
-                session.rollback()
-                duplicate_count += 1
-                continue
-        
-        # 检查是否启用了同步功能
-        if rule.enable_sync and added_rules:
-            logger.info(f"规则 {rule_id} 启用了同步功能，正在同步添加替换规则到关联规则")
-            # 获取需要同步的规则列表
-            sync_rules = session.query(RuleSync).filter(RuleSync.rule_id == rule_id).all()
-            
-            # 为每个同步规则添加相同的替换规则
-            for sync_rule in sync_rules:
-                sync_rule_id = sync_rule.sync_rule_id
-                logger.info(f"正在同步添加替换规则到规则 {sync_rule_id}")
-                
-                # 获取同步目标规则
-                target_rule = session.query(ForwardRule).get(sync_rule_id)
-                if not target_rule:
-                    logger.warning(f"同步目标规则 {sync_rule_id} 不存在，跳过")
-                    continue
-                
-                # 为同步目标规则添加替换规则
-                sync_success = 0
-                sync_duplicate = 0
-                for rule_info in added_rules:
-                    try:
-                        # 检查同步规则是否已有此替换规则
-                        existing_rule = session.query(ReplaceRule).filter(
-                            ReplaceRule.rule_id == sync_rule_id,
-                            ReplaceRule.pattern == rule_info['pattern'],
-                            ReplaceRule.content == rule_info['content']
-                        ).first()
-                        
-                        if existing_rule:
-                            sync_duplicate += 1
-                            continue
-                            
-                        # 添加新替换规则到同步规则
-                        new_rule = ReplaceRule(
-                            rule_id=sync_rule_id,
-                            pattern=rule_info['pattern'],
-                            content=rule_info['content']
-                        )
-                        session.add(new_rule)
-                        session.flush()
-                        sync_success += 1
-                    except Exception as e:
-                        logger.error(f"同步添加替换规则到规则 {sync_rule_id} 时出错: {str(e)}")
-                        continue
-                
-                logger.info(f"同步规则 {sync_rule_id} 的替换规则添加结果: 成功={sync_success}, 重复={sync_duplicate}")
-        
-        return success_count, duplicate_count
+            counts[rule_id] = (success_count, duplicate_count)
+
+        self._insert_ignore_duplicates(session, ReplaceRule, rows, target_ids)
+        self._log_sync_counts('替换规则', counts, sync_targets - set(rules))
+
+        # 确保启用替换模式
+        for rule_id, rule in rules.items():
+            if counts[rule_id][0] and not rule.is_replace:
+                rule.is_replace = True
+        return {rule_id: counts[rule_id] for rule_id in rules}, rejected
+
+    def _get_replace_rules(self, session, rule_id):
+        return session.query(ReplaceRule).filter(
+            ReplaceRule.rule_id == rule_id
+        ).all()
 
-    async def get_replace_rules(self, session, rule_id):
+    @run_in_db_thread
+    def get_replace_rules(self, session, rule_id):
         """获取规则的所有替换规则
         
         Args:
@@ -535,11 +578,10 @@ class DBOperations:
         Returns:
             list: 替换规则列表
         """
-        return session.query(ReplaceRule).filter(
-            ReplaceRule.rule_id == rule_id
-        ).all()
+        return self._get_replace_rules(session, rule_id)
 
-    async def delete_replace_rules(self, session, rule_id, indices):
+    @run_in_db_thread
+    def delete_replace_rules(self, session, rule_id, indices):
         """删除指定索引的替换规则
         
         Args:
@@ -556,7 +598,7 @@ class DBOperations:
             logger.error(f"规则ID {rule_id} 不存在")
             return 0, []
             
-        rules = await self.get_replace_rules(session, rule_id)
+        rules = self._get_replace_rules(session, rule_id)
         if not rules:
             return 0, []
             
@@ -613,10 +655,9 @@ class DBOperations:
                 
                 logger.info(f"同步删除规则 {sync_rule_id} 的替换规则: 删除了 {sync_deleted} 个")
                 
-        return deleted_count, await self.get_replace_rules(session, rule_id)
+        return deleted_count, self._get_replace_rules(session, rule_id)
 
-    async def get_media_types(self, session, rule_id):
-        """获取媒体类型设置"""
+    def _get_media_types(self, session, rule_id):
         try:
             rule = session.query(ForwardRule).get(rule_id)
             if not rule:
@@ -642,7 +683,13 @@ class DBOperations:
             session.rollback()
             return False, f"获取媒体类型设置时出错: {str(e)}", None
 
-    async def update_media_types(self, session, rule_id, media_types_dict):
+    @run_in_db_thread
+    def get_media_types(self, session, rule_id):
+        """获取媒体类型设置"""
+        return self._get_media_types(session, rule_id)
+
+    @run_in_db_thread
+    def update_media_types(self, session, rule_id, media_types_dict):
         """更新媒体类型设置"""
         try:
             rule = session.query(ForwardRule).get(rule_id)
@@ -666,13 +713,14 @@ class DBOperations:
             session.rollback()
             return False, f"更新媒体类型设置时出错: {str(e)}"
 
-    async def toggle_media_type(self, session, rule_id, media_type):
+    @run_in_db_thread
+    def toggle_media_type(self, session, rule_id, media_type):
         """切换特定媒体类型的启用状态"""
         try:
             if media_type not in ['photo', 'document', 'video', 'audio', 'voice']:
                 return False, f"无效的媒体类型: {media_type}"
                 
-            success, msg, media_types = await self.get_media_types(session, rule_id)
+            success, msg, media_types = self._get_media_types(session, rule_id)
             if not success:
                 return False, msg
             
@@ -687,7 +735,8 @@ class DBOperations:
             session.rollback()
             return False, f"切换媒体类型时出错: {str(e)}"
 
-    async def add_media_extensions(self, session, rule_id, extensions):
+    @run_in_db_thread
+    def add_media_extensions(self, session, rule_id, extensions):
         """添加媒体扩展名
         
         Args:
@@ -727,7 +776,8 @@ class DBOperations:
             logger.error(f"添加媒体扩展名失败: {str(e)}")
             return False, f"添加媒体扩展名失败: {str(e)}"
 
-    async def get_media_extensions(self, session, rule_id):
+    @run_in_db_thread
+    def get_media_extensions(self, session, rule_id):
         """获取规则的媒体扩展名列表
         
         Args:
@@ -760,7 +810,8 @@ class DBOperations:
             logger.error(f"获取媒体扩展名失败: {str(e)}")
             return []
 
-    async def delete_media_extensions(self, session, rule_id, indices):
+    @run_in_db_thread
+    def delete_media_extensions(self, session, rule_id, indices):
         """删除媒体扩展名
         
         Args:
@@ -776,18 +827,13 @@ class DBOperations:
                 return False, "未指定要删除的扩展名"
             
             for index in indices:
-                # 查找并删除扩展名
-                result = session.execute(
-                    text("SELECT id FROM media_extensions WHERE id = :id AND rule_id = :rule_id"),
-                    {"id": index, "rule_id": rule_id}
-                )
-                
-                extension = result.first()
+                # 查找并删除扩展名（通过ORM删除，以便规则快照等缓存感知变更）
+                extension = session.query(MediaExtensions).filter(
+                    MediaExtensions.id == index,
+                    MediaExtensions.rule_id == rule_id
+                ).first()
                 if extension:
-                    session.execute(
-                        text("DELETE FROM media_extensions WHERE id = :id"),
-                        {"id": extension[0]}
-                    )
+                    session.delete(extension)
             
             session.commit()
             return True, f"成功删除 {len(indices)} 个媒体扩展名"
@@ -797,29 +843,36 @@ class DBOperations:
             return False, f"删除媒体扩展名失败: {str(e)}"
 
     # RSS配置相关操作
-    async def get_rss_config(self, session, rule_id):
-        """获取指定规则的RSS配置"""
+    def _get_rss_config(self, session, rule_id):
         return session.query(RSSConfig).filter(RSSConfig.rule_id == rule_id).first()
 
-    async def create_rss_config(self, session, rule_id, **kwargs):
+    @run_in_db_thread
+    def get_rss_config(self, session, rule_id):
+        """获取指定规则的RSS配置"""
+        return self._get_rss_config(session, rule_id)
+
+    @run_in_db_thread
+    def create_rss_config(self, session, rule_id, **kwargs):
         """创建RSS配置"""
         rss_config = RSSConfig(rule_id=rule_id, **kwargs)
         session.add(rss_config)
         session.commit()
         return rss_config
 
-    async def update_rss_config(self, session, rule_id, **kwargs):
+    @run_in_db_thread
+    def update_rss_config(self, session, rule_id, **kwargs):
         """更新RSS配置"""
-        rss_config = await self.get_rss_config(session, rule_id)
+        rss_config = self._get_rss_config(session, rule_id)
         if rss_config:
             for key, value in kwargs.items():
                 setattr(rss_config, key, value)
             session.commit()
         return rss_config
 
-    async def delete_rss_config(self, session, rule_id):
+    @run_in_db_thread
+    def delete_rss_config(self, session, rule_id):
         """删除RSS配置"""
-        rss_config = await self.get_rss_config(session, rule_id)
+        rss_config = self._get_rss_config(session, rule_id)
         if rss_config:
             session.delete(rss_config)
             session.commit()
@@ -827,17 +880,35 @@ class DBOperations:
         return False
 
     # RSS模式相关操作
-    async def get_rss_patterns(self, session, rss_config_id):
-        """获取指定RSS配置的所有模式"""
+    def _get_rss_patterns(self, session, rss_config_id):
         return session.query(RSSPattern).filter(RSSPattern.rss_config_id == rss_config_id).order_by(RSSPattern.priority).all()
 
-    async def get_rss_pattern(self, session, pattern_id):
-        """获取指定的RSS模式"""
+    @run_in_db_thread
+    def get_rss_patterns(self, session, rss_config_id):
+        """获取指定RSS配置的所有模式"""
+        return self._get_rss_patterns(session, rss_config_id)
+
+    def _get_rss_pattern(self, session, pattern_id):
         return session.query(RSSPattern).filter(RSSPattern.id == pattern_id).first()
 
-    async def create_rss_pattern(self, session, rss_config_id, pattern, pattern_type, priority=0):
+    @run_in_db_thread
+    def get_rss_pattern(self, session, pattern_id):
+        """获取指定的RSS模式"""
+        return self._get_rss_pattern(session, pattern_id)
+
+    @staticmethod
+    def _check_rss_pattern(pattern):
+        """拒绝无效或存在灾难性回溯风险的RSS正则"""
+        report = analyze_pattern(pattern)
+        if report.level in (RISK_INVALID, RISK_EXPONENTIAL):
+            logger.warning(f"拒绝RSS模式 \"{pattern}\": {report.reason}")
+            raise ValueError(f"正则表达式存在问题: {report.reason}")
+
+    @run_in_db_thread
+    def create_rss_pattern(self, session, rss_config_id, pattern, pattern_type, priority=0):
         """创建RSS模式"""
         logger.info(f"创建RSS模式：config_id={rss_config_id}, pattern={pattern}, type={pattern_type}, priority={priority}")
+        self._check_rss_pattern(pattern)
         try:
             pattern_obj = RSSPattern(
                 rss_config_id=rss_config_id,
@@ -854,9 +925,12 @@ class DBOperations:
             session.rollback()
             raise
 
-    async def update_rss_pattern(self, session, pattern_id, **kwargs):
+    @run_in_db_thread
+    def update_rss_pattern(self, session, pattern_id, **kwargs):
         """更新RSS模式"""
         logger.info(f"更新RSS模式：pattern_id={pattern_id}, kwargs={kwargs}")
+        if 'pattern' in kwargs:
+            self._check_rss_pattern(kwargs['pattern'])
         try:
             pattern = session.query(RSSPattern).filter(RSSPattern.id == pattern_id).first()
             if not pattern:
@@ -874,18 +948,20 @@ class DBOperations:
             session.rollback()
             raise
 
-    async def delete_rss_pattern(self, session, pattern_id):
+    @run_in_db_thread
+    def delete_rss_pattern(self, session, pattern_id):
         """删除RSS模式"""
-        rss_pattern = await self.get_rss_pattern(session, pattern_id)
+        rss_pattern = self._get_rss_pattern(session, pattern_id)
         if rss_pattern:
             session.delete(rss_pattern)
             session.commit()
             return True
         return False
 
-    async def reorder_rss_patterns(self, session, rss_config_id, pattern_ids):
+    @run_in_db_thread
+    def reorder_rss_patterns(self, session, rss_config_id, pattern_ids):
         """重新排序RSS模式"""
-        patterns = await self.get_rss_patterns(session, rss_config_id)
+        patterns = self._get_rss_patterns(session, rss_config_id)
         pattern_dict = {p.id: p for p in patterns}
         
         for index, pattern_id in enumerate(pattern_ids):
@@ -895,15 +971,21 @@ class DBOperations:
         session.commit()
 
     # 用户相关操作
-    async def get_user(self, session, username):
-        """通过用户名获取用户"""
+    def _get_user(self, session, username):
         return session.query(User).filter(User.username == username).first()
 
-    async def get_user_by_id(self, session, user_id):
+    @run_in_db_thread
+    def get_user(self, session, username):
+        """通过用户名获取用户"""
+        return self._get_user(session, username)
+
+    @run_in_db_thread
+    def get_user_by_id(self, session, user_id):
         """通过ID获取用户"""
         return session.query(User).filter(User.id == user_id).first()
 
-    async def create_user(self, session, username, password):
+    @run_in_db_thread
+    def create_user(self, session, username, password):
         """创建用户"""
 
         user = User(
@@ -914,36 +996,138 @@ class DBOperations:
         session.commit()
         return user
 
-    async def update_user_password(self, session, username, new_password):
+    @run_in_db_thread
+    def update_user_password(self, session, username, new_password):
         """更新用户密码"""
 
-        user = await self.get_user(session, username)
+        user = self._get_user(session, username)
         if user:
             user.password = generate_password_hash(new_password)
             session.commit()
         return user
 
-    async def verify_user(self, session, username, password):
+    @run_in_db_thread
+    def verify_user(self, session, username, password):
         """验证用户密码"""
         
-        user = await self.get_user(session, username)
+        user = self._get_user(session, username)
         if user and check_password_hash(user.password, password):
             return user
         return None
 
     # 批量操作
-    async def get_all_enabled_rss_configs(self, session):
+    @run_in_db_thread
+    def get_all_enabled_rss_configs(self, session):
         """获取所有启用的RSS配置"""
         return session.query(RSSConfig).filter(RSSConfig.enable_rss == True).all()
 
-    async def get_rss_config_with_patterns(self, session, rule_id):
+    @run_in_db_thread
+    def get_rss_config_with_patterns(self, session, rule_id):
         """获取RSS配置及其所有模式"""
         return session.query(RSSConfig).options(
             joinedload(RSSConfig.patterns)
         ).filter(RSSConfig.rule_id == rule_id).first() 
 
+    @run_in_db_thread
+    def copy_rule(self, session, source_rule, target_rule):
+        """复制规则的关键字、替换规则、媒体设置、同步关系和其他设置到目标规则
+
+        规则较多时耗时较长，在数据库线程中执行，不影响消息转发。
+
+        Args:
+            session: 数据库会话
+            source_rule: 源规则
+            target_rule: 目标规则
+
+        Returns:
+            dict: 各部分的 (成功数量, 跳过重复数量)，键为 keywords_normal、keywords_regex、
+                replace_rules、media_extensions、rule_syncs
+        """
+        counts = {key: [0, 0] for key in ('keywords_normal', 'keywords_regex', 'replace_rules', 'media_extensions', 'rule_syncs')}
+
+        # 复制普通关键字和正则关键字
+        for keyword in source_rule.keywords:
+            key = 'keywords_regex' if keyword.is_regex else 'keywords_normal'
+            # 检查是否已存在
+            exists = any(k.keyword == keyword.keyword and k.is_regex == keyword.is_regex and k.is_blacklist == keyword.is_blacklist
+                         for k in target_rule.keywords)
+            if not exists:
+                session.add(Keyword(
+                    rule_id=target_rule.id,
+                    keyword=keyword.keyword,
+                    is_regex=keyword.is_regex,
+                    is_blacklist=keyword.is_blacklist
+                ))
+                counts[key][0] += 1
+            else:
+                counts[key][1] += 1
+
+        # 复制替换规则
+        for replace_rule in source_rule.replace_rules:
+            # 检查是否已存在
+            exists = any(r.pattern == replace_rule.pattern and r.content == replace_rule.content
+                         for r in target_rule.replace_rules)
+            if not exists:
+                session.add(ReplaceRule(
+                    rule_id=target_rule.id,
+                    pattern=replace_rule.pattern,
+                    content=replace_rule.content
+                ))
+                counts['replace_rules'][0] += 1
+            else:
+                counts['replace_rules'][1] += 1
+
+        # 复制媒体扩展名设置
+        for extension in source_rule.media_extensions:
+            # 检查是否已存在
+            exists = any(e.extension == extension.extension for e in target_rule.media_extensions)
+            if not exists:
+                session.add(MediaExtensions(
+                    rule_id=target_rule.id,
+                    extension=extension.extension
+                ))
+                counts['media_extensions'][0] += 1
+            else:
+                counts['media_extensions'][1] += 1
+
+        # 复制媒体类型设置（除了id和rule_id）
+        if source_rule.media_types:
+            target_media_types = session.query(MediaTypes).filter_by(rule_id=target_rule.id).first()
+            if not target_media_types:
+                target_media_types = MediaTypes(rule_id=target_rule.id)
+                session.add(target_media_types)
+            for column in inspect(MediaTypes).columns:
+                if column.key not in ['id', 'rule_id']:
+                    setattr(target_media_types, column.key, getattr(source_rule.media_types, column.key))
+
+        # 复制规则同步表数据
+        for sync in source_rule.rule_syncs:
+            # 检查是否已存在
+            exists = any(s.sync_rule_id == sync.sync_rule_id for s in target_rule.rule_syncs)
+            if not exists:
+                # 确保不会创建自引用的同步关系
+                if sync.sync_rule_id != target_rule.id:
+                    session.add(RuleSync(
+                        rule_id=target_rule.id,
+                        sync_rule_id=sync.sync_rule_id
+                    ))
+                    counts['rule_syncs'][0] += 1
+                    # 启用目标规则的同步功能
+                    target_rule.enable_sync = True
+            else:
+                counts['rule_syncs'][1] += 1
+
+        # 复制规则设置，保留目标规则的源聊天和目标聊天
+        for column in inspect(ForwardRule).columns:
+            if column.key not in ['id', 'source_chat_id', 'target_chat_id']:
+                setattr(target_rule, column.key, getattr(source_rule, column.key))
+
+        session.commit()
+        return {key: tuple(value) for key, value in counts.items()}
+
     # 规则同步相关操作
-    async def add_rule_sync(self, session, rule_id, sync_rule_id):
+    @run_in_db_thread
+    def add_rule_sync(self, session, rule_id, sync_rule_id):
         """添加规则同步关系
         
         Args:
@@ -994,7 +1178,8 @@ class DBOperations:
             logger.error(f"添加规则同步关系时出错: {str(e)}")
             return False, f"添加同步关系失败: {str(e)}"
     
-    async def get_rule_syncs(self, session, rule_id):
+    @run_in_db_thread
+    def get_rule_syncs(self, session, rule_id):
         """获取指定规则的同步关系列表
         
         Args:
@@ -1016,7 +1201,8 @@ class DBOperations:
             logger.error(f"获取规则同步关系时出错: {str(e)}")
             return []
     
-    async def delete_rule_sync(self, session, rule_id, sync_rule_id):
+    @run_in_db_thread
+    def delete_rule_sync(self, session, rule_id, sync_rule_id):
         """删除规则同步关系
         
         Args:
@@ -1061,7 +1247,8 @@ class DBOperations:
             logger.error(f"删除规则同步关系时出错: {str(e)}")
             return False, f"删除同步关系失败: {str(e)}"
 
-    async def get_push_configs(self, session, rule_id):
+    @run_in_db_thread
+    def get_push_configs(self, session, rule_id):
         """获取指定规则的所有推送配置
         
         Args:
@@ -1079,7 +1266,8 @@ class DBOperations:
             logger.error(f"获取推送配置时出错: {str(e)}")
             return []
     
-    async def add_push_config(self, session, rule_id, push_channel, enable_push_channel=True):
+    @run_in_db_thread
+    def add_push_config(self, session, rule_id, push_channel, enable_push_channel=True):
         """添加推送配置
         
         Args:
@@ -1117,7 +1305,8 @@ class DBOperations:
             logger.error(f"添加推送配置时出错: {str(e)}")
             return False, f"添加推送配置失败: {str(e)}", None
     
-    async def toggle_push_config(self, session, config_id):
+    @run_in_db_thread
+    def toggle_push_config(self, session, config_id):
         """切换推送配置的启用状态
         
         Args:
@@ -1142,7 +1331,8 @@ class DBOperations:
             logger.error(f"切换推送配置状态时出错: {str(e)}")
             return False, f"切换推送配置状态失败: {str(e)}"
     
-    async def delete_push_config(self, session, config_id):
+    @run_in_db_thread
+    def delete_push_config(self, session, config_id):
         """删除推送配置
         
         Args:
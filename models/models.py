@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, ForeignKey, Enum, UniqueConstraint, inspect, text, DateTime, JSON
+from sqlalchemy import create_engine, event, Column, Integer, String, Boolean, ForeignKey, Enum, UniqueConstraint, Index, inspect, text, DateTime, JSON
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 from enums.enums import ForwardMode, PreviewMode, MessageMode, AddMode, HandleMode
@@ -6,6 +7,7 @@ import logging
 import os
 from dotenv import load_dotenv
 from datetime import datetime
+from utils.constants import SQLITE_WAL, SQLITE_BUSY_TIMEOUT, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE, DB_POOL_SIZE, DB_MAX_OVERFLOW
 
 load_dotenv()
 Base = declarative_base()
@@ -13,8 +15,58 @@ Base = declarative_base()
 # --- 从环境变量读取数据库URL，提供默认值 ---
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///./db/forward.db')
 
+
+def _is_sqlite_file(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def create_db_engine(url, tuned=True):
+    """
+    创建数据库引擎
+
+    SQLite 文件数据库由机器人进程和 RSS 进程同时读写，默认配置下写事务会阻塞所有读取，
+    并在锁冲突时立即报 database is locked。调优后每个新连接通过 connect 钩子启用 WAL 日志
+    （读写互不阻塞）、NORMAL 同步级别、忙等待、更大的页缓存和内存映射读取，
+    连接池按 DB_POOL_SIZE/DB_MAX_OVERFLOW 复用连接。其他数据库使用 SQLAlchemy 默认配置。
+
+    Args:
+        url: 数据库URL
+        tuned: 是否应用 SQLite 调优（基准测试对比时可关闭）
+
+    Returns:
+        Engine: 数据库引擎
+    """
+    if not tuned or not _is_sqlite_file(url):
+        return create_engine(url)
+
+    db_engine = create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        connect_args={'timeout': SQLITE_BUSY_TIMEOUT / 1000, 'check_same_thread': False},
+    )
+
+    @event.listens_for(db_engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if SQLITE_WAL:
+                cursor.execute('PRAGMA journal_mode=WAL')
+                # WAL 模式下 NORMAL 不会损坏数据库，只在断电时可能丢失最后提交的事务
+                cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}')
+            cursor.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}')
+            cursor.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+            cursor.execute('PRAGMA temp_store=MEMORY')
+        finally:
+            cursor.close()
+
+    return db_engine
+
+
 # --- 创建全局唯一的数据库引擎和会话工厂 ---
-engine = create_engine(DATABASE_URL)
+engine = create_db_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # ------------------------------------------ #
@@ -90,6 +142,10 @@ class ForwardRule(Base):
     # 添加唯一约束
     __table_args__ = (
         UniqueConstraint('source_chat_id', 'target_chat_id', name='unique_source_target'),
+        # 按源聊天查找启用的规则
+        Index('ix_forward_rules_source_chat_enabled', 'source_chat_id', 'enable_rule'),
+        # 按目标聊天查询（删除聊天、查找引用）
+        Index('ix_forward_rules_target_chat_id', 'target_chat_id'),
     )
 
     # 关系
@@ -118,6 +174,8 @@ class Keyword(Base):
     # 添加唯一约束
     __table_args__ = (
         UniqueConstraint('rule_id', 'keyword','is_regex','is_blacklist', name='unique_rule_keyword_is_regex_is_blacklist'),
+        # 按规则分别读取黑名单/白名单、普通/正则关键字
+        Index('ix_keywords_rule_blacklist_regex', 'rule_id', 'is_blacklist', 'is_regex'),
     )
 
 class ReplaceRule(Base):
@@ -176,6 +234,10 @@ class RuleSync(Base):
     # 关系
     rule = relationship('ForwardRule', back_populates='rule_syncs')
 
+    __table_args__ = (
+        Index('ix_rule_syncs_rule_id', 'rule_id'),
+    )
+
 class PushConfig(Base):
     __tablename__ = 'push_configs'
 
@@ -189,6 +251,11 @@ class PushConfig(Base):
     # 关系
     rule = relationship('ForwardRule', back_populates='push_config')
 
+    __table_args__ = (
+        # 按规则读取已启用的推送配置
+        Index('ix_push_configs_rule_enabled', 'rule_id', 'enable_push_channel'),
+    )
+
 class RSSConfig(Base):
     __tablename__ = 'rss_configs'
 
@@ -233,6 +300,8 @@ class RSSPattern(Base):
     # 添加联合唯一约束
     __table_args__ = (
         UniqueConstraint('rss_config_id', 'pattern', 'pattern_type', name='unique_rss_pattern'),
+        # 按配置和类型读取模式并按优先级排序
+        Index('ix_rss_patterns_config_type_priority', 'rss_config_id', 'pattern_type', 'priority'),
     )
 
 class User(Base):
@@ -278,6 +347,23 @@ class ProcessedPost(Base):
         UniqueConstraint('scrape_config_id', 'post_unique_id', name='unique_config_post'),
     )
 
+class ConfigVersion(Base):
+    """配置变更记录，供其他进程轮询以使缓存失效"""
+    __tablename__ = 'config_versions'
+
+    id = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)  # 变更的实体（表名）
+    rule_id = Column(Integer, nullable=True)  # 受影响的规则ID，为空表示无法确定（全部）
+    origin = Column(String, nullable=False)  # 发布变更的进程标识
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # 清理过期记录
+        Index('ix_config_versions_created_at', 'created_at'),
+        # 清理全部记录后ID也不能重新从1开始，否则其他进程的轮询位置会跳过新的变更
+        {'sqlite_autoincrement': True},
+    )
+
 def migrate_db(engine):
     """数据库迁移函数，确保新字段的添加"""
     inspector = inspect(engine)
@@ -296,6 +382,20 @@ def migrate_db(engine):
                 logging.info("创建rule_syncs表...")
                 RuleSync.__table__.create(engine)
 
+            # 如果config_versions表不存在，创建表
+            if 'config_versions' not in existing_tables:
+                logging.info("创建config_versions表...")
+                ConfigVersion.__table__.create(engine)
+            else:
+                # 旧版本创建的表没有 AUTOINCREMENT，变更记录只是临时数据，直接重建
+                table_sql = connection.execute(text(
+                    "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'config_versions'"
+                )).scalar() or ''
+                if 'AUTOINCREMENT' not in table_sql.upper():
+                    logging.info("重建config_versions表（启用AUTOINCREMENT）...")
+                    ConfigVersion.__table__.drop(engine)
+                    ConfigVersion.__table__.create(engine)
+
 
             # 如果users表不存在，创建表
             if 'users' not in existing_tables:
@@ -502,6 +602,23 @@ def migrate_db(engine):
         except Exception as e:
             logging.error(f'更新唯一约束时出错: {str(e)}')
 
+    # 为已有数据库补建索引
+    ensure_indexes(engine)
+
+
+def ensure_indexes(engine):
+    """
+    创建模型中声明的全部索引（已存在的跳过，可重复执行）
+
+    create_all 只会为新建的表创建索引，已有数据库中的表需要在迁移时补建。
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(engine, checkfirst=True)
+            except Exception as e:
+                logging.error(f'创建索引 {index.name} 时出错: {str(e)}')
+
 
 def init_db():
     """初始化数据库"""
@@ -0,0 +1,107 @@
+"""
+热点查询的执行计划检查
+
+对消息处理和配置管理中频繁执行的查询运行 EXPLAIN QUERY PLAN，确认都能使用索引，
+没有对整张表的扫描（SCAN）。规则和关键字越多，全表扫描的代价越高。
+
+用法:
+    python -m models.query_plans            # 在临时数据库上建表、迁移后检查
+    python -m models.query_plans <数据库URL>  # 检查现有数据库（不做修改）
+
+存在全表扫描时以状态码 1 退出。
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+from sqlalchemy import text
+
+from models.models import Base, create_db_engine, migrate_db
+
+# (说明, 表名, 查询)
+HOT_QUERIES = [
+    ('按源聊天加载启用的规则', 'forward_rules',
+     "SELECT * FROM forward_rules WHERE source_chat_id = 1 AND enable_rule = 1"),
+    ('按目标聊天查找规则', 'forward_rules',
+     "SELECT * FROM forward_rules WHERE target_chat_id = 1"),
+    ('加载规则的关键字', 'keywords',
+     "SELECT * FROM keywords WHERE rule_id = 1"),
+    ('加载规则的黑名单正则关键字', 'keywords',
+     "SELECT * FROM keywords WHERE rule_id = 1 AND is_blacklist = 1 AND is_regex = 1"),
+    ('加载规则的替换规则', 'replace_rules',
+     "SELECT * FROM replace_rules WHERE rule_id = 1"),
+    ('加载规则的媒体扩展名', 'media_extensions',
+     "SELECT id, extension FROM media_extensions WHERE rule_id = 1 ORDER BY id"),
+    ('加载规则的媒体类型', 'media_types',
+     "SELECT * FROM media_types WHERE rule_id = 1"),
+    ('加载规则启用的推送配置', 'push_configs',
+     "SELECT * FROM push_configs WHERE rule_id = 1 AND enable_push_channel = 1"),
+    ('加载规则的同步目标', 'rule_syncs',
+     "SELECT * FROM rule_syncs WHERE rule_id = 1"),
+    ('加载规则的RSS配置', 'rss_configs',
+     "SELECT * FROM rss_configs WHERE rule_id = 1"),
+    ('按类型和优先级加载RSS模式', 'rss_patterns',
+     "SELECT * FROM rss_patterns WHERE rss_config_id = 1 AND pattern_type = 'title' ORDER BY priority"),
+    ('轮询配置变更', 'config_versions',
+     "SELECT id, entity, rule_id, origin FROM config_versions WHERE id > 1 ORDER BY id"),
+    ('清理过期配置变更', 'config_versions',
+     "DELETE FROM config_versions WHERE created_at < '2000-01-01'"),
+]
+
+
+def explain(connection, sql):
+    """返回查询计划的每一步描述"""
+    return [row[-1] for row in connection.execute(text(f'EXPLAIN QUERY PLAN {sql}')).all()]
+
+
+def check_query_plans(engine):
+    """
+    检查全部热点查询的执行计划
+
+    Returns:
+        list: (说明, 查询, 计划步骤, 是否使用索引)
+    """
+    results = []
+    with engine.connect() as connection:
+        for name, table, sql in HOT_QUERIES:
+            steps = explain(connection, sql)
+            # SCAN 表示遍历整张表（或整个覆盖索引），SEARCH 表示通过索引定位
+            full_scan = any(step.startswith(f'SCAN {table}') for step in steps)
+            results.append((name, sql, steps, not full_scan))
+    return results
+
+
+def main():
+    directory = None
+    if len(sys.argv) > 1:
+        url = sys.argv[1]
+    else:
+        directory = tempfile.mkdtemp(prefix='tf-query-plans-')
+        url = f"sqlite:///{os.path.join(directory, 'plans.db')}"
+
+    engine = create_db_engine(url, tuned=False)
+    try:
+        if directory:
+            Base.metadata.create_all(engine)
+            migrate_db(engine)
+        results = check_query_plans(engine)
+    finally:
+        engine.dispose()
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    failed = 0
+    for name, sql, steps, ok in results:
+        print(f"[{'OK' if ok else '全表扫描'}] {name}")
+        print(f'    {sql}')
+        for step in steps:
+            print(f'    -> {step}')
+        if not ok:
+            failed += 1
+    print(f'共 {len(results)} 条查询，{failed} 条存在全表扫描')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,27 +6,30 @@ import os
 import json
 from pathlib import Path
 from ...services.feed_generator import FeedService
+from ...services.rss_config_cache import rss_config_cache
 from ...models.entry import Entry
 from ...core.config import settings
 from ...crud.entry import get_entries, create_entry, delete_entry
 import mimetypes
-from models.models import get_session, RSSConfig
 from datetime import datetime
 from ai import get_ai_provider
-from models.models import get_session, ForwardRule
 import re
-from models.models import RSSPattern
 import shutil
 import time
 import os
 import subprocess
 import platform
 from pydantic import ValidationError
-from utils.constants import RSS_MEDIA_BASE_URL
+from utils.constants import RSS_MEDIA_BASE_URL, METRICS_SNAPSHOT_PATH, METRICS_SNAPSHOT_INTERVAL
+from utils.metrics import registry, track_duration, read_snapshot, render_combined
+from utils.regex_guard import regex_guard
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# RSS 指标
+FEED_RENDER_DURATION = registry.histogram('tf_rss_feed_render_seconds', '生成 RSS 订阅源的耗时', ('status',))
+
 # 添加本地访问验证依赖
 async def verify_local_access(request: Request):
     """验证请求是否来自本地或Docker内部网络"""
@@ -65,17 +68,21 @@ async def root():
         "service": "TG Forwarder RSS"
     }
 
+@router.get("/metrics", dependencies=[Depends(verify_local_access)])
+async def metrics():
+    """Prometheus 指标，合并 RSS 进程与主进程（通过快照文件）的数据"""
+    main_snapshot = read_snapshot(METRICS_SNAPSHOT_PATH, max_age=METRICS_SNAPSHOT_INTERVAL * 4)
+    content = render_combined([('rss', registry.dump()), ('main', main_snapshot)])
+    return Response(content=content, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @router.get("/rss/feed/{rule_id}")
+@track_duration(FEED_RENDER_DURATION)
 async def get_feed(rule_id: int, request: Request):
     """返回规则对应的RSS Feed"""
-    session = None
     try:
-        # 创建数据库会话
-        session = get_session()
-        
-        # 查询规则配置
-        rss_config = session.query(RSSConfig).filter(RSSConfig.rule_id == rule_id).first()
-        if not rss_config or not rss_config.enable_rss:
+        # 查询规则配置（缓存，配置变更后由 config_bus 通知失效）
+        feed_config = await rss_config_cache.get_async(rule_id)
+        if not feed_config or not feed_config.config.enable_rss:
             logger.warning(f"规则 {rule_id} 的RSS未启用或不存在")
             raise HTTPException(status_code=404, detail="RSS feed 未启用或不存在")
         
@@ -196,10 +203,6 @@ async def get_feed(rule_id: int, request: Request):
     except Exception as e:
         logger.error(f"生成RSS feed时出错: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-    finally:
-        # 确保会话被关闭
-        if session:
-            session.close()
 
 @router.get("/media/{rule_id}/{filename}")
 async def get_media(rule_id: int, filename: str, request: Request):
@@ -274,13 +277,9 @@ async def add_entry(rule_id: int, entry_data: Dict[str, Any] = Body(...)):
         logger.info(f"接收到新条目数据: 规则ID={rule_id}, 标题='{entry_data.get('title', '无标题')}', 媒体数量={media_count}, 包含上下文={has_context}")
         
         # 获取 RSS 配置信息，确定最大条目数量
-        session = get_session()
-        max_items = None
-        try:
-            rss_config = session.query(RSSConfig).filter(RSSConfig.rule_id == rule_id).first()
-            max_items = rss_config.max_items
-        finally:
-            session.close()
+        feed_config = await rss_config_cache.get_async(rule_id)
+        rss_config = feed_config.config
+        max_items = rss_config.max_items
         
         # 验证媒体数据
         if media_count > 0:
@@ -373,12 +372,11 @@ async def add_entry(rule_id: int, entry_data: Dict[str, Any] = Body(...)):
         # 使用AI提取内容
         if rss_config.is_ai_extract:
             try:
-                rule = session.query(ForwardRule).filter(ForwardRule.id == rule_id).first()
-                provider = await get_ai_provider(rule.ai_model)
+                provider = await get_ai_provider(feed_config.ai_model)
                 json_text = await provider.process_message(
                     message=entry.content or "",
                     prompt=rss_config.ai_extract_prompt,
-                    model=rule.ai_model
+                    model=feed_config.ai_model
                 )
                 logger.info(f"AI提取内容: {json_text}")
                 
@@ -425,9 +423,6 @@ async def add_entry(rule_id: int, entry_data: Dict[str, Any] = Body(...)):
                     logger.error(f"处理JSON数据时出错: {str(e)}")
             except Exception as e:
                 logger.error(f"AI提取内容时出错: {str(e)}")
-            finally:
-                if session:
-                    session.close()
         
         logger.info(f"启用自定义标题模式: {rss_config.enable_custom_title_pattern}, 启用自定义内容模式: {rss_config.enable_custom_content_pattern}")
         if rss_config.enable_custom_title_pattern or rss_config.enable_custom_content_pattern:
@@ -438,11 +433,8 @@ async def add_entry(rule_id: int, entry_data: Dict[str, Any] = Body(...)):
                 
                 # 如果启用了标题正则表达式提取
                 if rss_config.enable_custom_title_pattern:
-                    # 直接使用会话查询标题模式并按优先级排序
-                    title_patterns = session.query(RSSPattern).filter_by(
-                        rss_config_id=rss_config.id, 
-                        pattern_type='title'
-                    ).order_by(RSSPattern.priority).all()
+                    # 标题模式（已按优先级排序）
+                    title_patterns = feed_config.title_patterns
                     
                     logger.info(f"找到 {len(title_patterns)} 个标题模式")
                     
@@ -452,30 +444,27 @@ async def add_entry(rule_id: int, entry_data: Dict[str, Any] = Body(...)):
                     
                     # 依次应用每个模式，每次处理后的结果作为下一个模式的输入
                     for pattern in title_patterns:
-                        logger.info(f"开始尝试标题模式: {pattern.pattern}")
+                        logger.info(f"开始尝试标题模式: {pattern}")
                         try:
-                            logger.info(f"对内容应用正则表达式: {pattern.pattern}")
-                            match = re.search(pattern.pattern, processing_content)
+                            logger.info(f"对内容应用正则表达式: {pattern}")
+                            match = await regex_guard.search(pattern, processing_content)
                             if match:
                                 logger.info(f"找到匹配: {match.groups()}")
                                 if match.groups():
                                     entry.title = match.group(1)
-                                    logger.info(f"使用标题模式 '{pattern.pattern}' 提取到标题: {entry.title}")
+                                    logger.info(f"使用标题模式 '{pattern}' 提取到标题: {entry.title}")
                                 else:
-                                    logger.warning(f"模式 '{pattern.pattern}' 匹配成功但没有捕获组")
+                                    logger.warning(f"模式 '{pattern}' 匹配成功但没有捕获组")
                             else:
-                                logger.info(f"模式 '{pattern.pattern}' 未找到匹配")
+                                logger.info(f"模式 '{pattern}' 未找到匹配")
                         except Exception as e:
-                            logger.error(f"应用标题正则表达式 '{pattern.pattern}' 时出错: {str(e)}")
+                            logger.error(f"应用标题正则表达式 '{pattern}' 时出错: {str(e)}")
                             logger.exception("详细错误信息:")
                 
                 # 如果启用了内容正则表达式提取
                 if rss_config.enable_custom_content_pattern:
-                    # 直接使用会话查询内容模式并按优先级排序
-                    content_patterns = session.query(RSSPattern).filter_by(
-                        rss_config_id=rss_config.id, 
-                        pattern_type='content'
-                    ).order_by(RSSPattern.priority).all()
+                    # 内容模式（已按优先级排序）
+                    content_patterns = feed_config.content_patterns
                     
                     logger.info(f"找到 {len(content_patterns)} 个内容模式")
                     
@@ -486,21 +475,21 @@ async def add_entry(rule_id: int, entry_data: Dict[str, Any] = Body(...)):
                     # 依次应用每个模式，每次处理后的结果作为下一个模式的输入
                     for i, pattern in enumerate(content_patterns):
                         try:
-                            logger.info(f"[步骤 {i+1}/{len(content_patterns)}] 对内容应用正则表达式: {pattern.pattern}")
+                            logger.info(f"[步骤 {i+1}/{len(content_patterns)}] 对内容应用正则表达式: {pattern}")
                             logger.info(f"处理前的内容长度: {len(processing_content)}, 预览: {processing_content[:150]}..." if len(processing_content) > 150 else processing_content)
                             
-                            match = re.search(pattern.pattern, processing_content)
+                            match = await regex_guard.search(pattern, processing_content)
                             if match and match.groups():
                                 extracted_content = match.group(1)
                                 processing_content = extracted_content  # 更新处理内容为提取结果
                                 entry.content = extracted_content
                                 
-                                logger.info(f"使用内容模式 '{pattern.pattern}' 提取到内容，长度: {len(extracted_content)}")
+                                logger.info(f"使用内容模式 '{pattern}' 提取到内容，长度: {len(extracted_content)}")
                                 logger.info(f"处理后的内容长度: {len(processing_content)}, 预览: {processing_content[:150]}..." if len(processing_content) > 150 else processing_content)
                             else:
-                                logger.info(f"模式 '{pattern.pattern}' 未找到匹配或没有捕获组，内容保持不变")
+                                logger.info(f"模式 '{pattern}' 未找到匹配或没有捕获组，内容保持不变")
                         except Exception as e:
-                            logger.error(f"应用内容正则表达式 '{pattern.pattern}' 时出错: {str(e)}")
+                            logger.error(f"应用内容正则表达式 '{pattern}' 时出错: {str(e)}")
                 
                 
                 # 如果执行到这里但没有提取到标题，则恢复原标题
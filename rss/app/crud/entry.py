@@ -74,11 +74,9 @@ async def create_entry(entry: Entry) -> bool:
         
         # 获取规则的RSS配置，获取最大条目数量
         try:
-            from models.models import get_session, RSSConfig
-            session = get_session()
-            rss_config = session.query(RSSConfig).filter(RSSConfig.rule_id == entry.rule_id).first()
-            max_items = rss_config.max_items if rss_config and hasattr(rss_config, 'max_items') else 50
-            session.close()
+            from ..services.rss_config_cache import rss_config_cache
+            feed_config = await rss_config_cache.get_async(entry.rule_id)
+            max_items = feed_config.config.max_items if feed_config and feed_config.config.max_items else 50
         except Exception as e:
             logger.warning(f"获取RSS配置失败，使用默认最大条目数量(50): {str(e)}")
             max_items = 50
@@ -10,11 +10,11 @@ from feedgen.feed import FeedGenerator
 from datetime import datetime
 import logging
 import base64
-import re
 from utils.common import get_db_ops
 import os
 import aiohttp
 from utils.constants import RSS_HOST, RSS_PORT, RSS_BASE_URL
+from utils.regex_guard import regex_guard, analyze_pattern, RISK_SAFE, RISK_INVALID
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -424,15 +424,21 @@ async def test_regex(user = Depends(get_current_user),
         logger.info(f"测试类型: {pattern_type}")
         logger.info(f"测试文本长度: {len(test_text)} 字符")
         
-        # 执行正则匹配
-        match = re.search(pattern, test_text)
+        # 先分析回溯风险，再在沙箱中限时执行
+        report = analyze_pattern(pattern)
+        if report.level == RISK_INVALID:
+            return JSONResponse({"success": False, "message": report.reason})
+        warning = f"（警告: {report.reason}）" if report.level != RISK_SAFE else ""
+        
+        match = await regex_guard.search(pattern, test_text, sandbox=True)
         
         # 检查是否有匹配
         if not match:
             return JSONResponse({
                 "success": True,
                 "matched": False,
-                "message": "未找到匹配"
+                "risk": report.level,
+                "message": "未找到匹配（或超过执行时间限制）" + warning
             })
             
         # 检查捕获组
@@ -441,7 +447,8 @@ async def test_regex(user = Depends(get_current_user),
                 "success": True,
                 "matched": True,
                 "has_groups": False,
-                "message": "匹配成功，但没有捕获组。请使用括号 () 来创建捕获组。"
+                "risk": report.level,
+                "message": "匹配成功，但没有捕获组。请使用括号 () 来创建捕获组。" + warning
             })
             
         # 成功匹配且有捕获组
@@ -453,7 +460,8 @@ async def test_regex(user = Depends(get_current_user),
             "matched": True,
             "has_groups": True,
             "extracted": extracted_content,
-            "message": "匹配成功！"
+            "risk": report.level,
+            "message": "匹配成功！" + warning
         })
         
     except Exception as e:
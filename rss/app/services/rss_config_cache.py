@@ -0,0 +1,101 @@
+import logging
+import threading
+from collections import namedtuple
+from typing import Dict, Optional
+
+from sqlalchemy.orm import joinedload
+
+from models.models import get_session, ForwardRule, RSSConfig, RSSPattern
+from models.db_executor import db_executor
+from managers.config_bus import config_bus, changed_rule_ids
+from managers.rule_snapshot import RSSConfigSnapshot
+
+logger = logging.getLogger(__name__)
+
+# 生成订阅源和添加条目需要的 RSS 配置，模式按优先级排序
+RSSFeedConfig = namedtuple('RSSFeedConfig', ['config', 'ai_model', 'title_patterns', 'content_patterns'])
+
+_MISSING = object()
+
+
+class RSSConfigCache:
+    """
+    RSS 配置缓存：rule_id -> RSSFeedConfig
+
+    RSS 服务每次请求都需要规则的 RSS 配置和正则模式，缓存后不再逐次查询。
+    配置在 RSS 面板（本进程）或机器人命令（主进程）中修改后，由 config_bus 通知失效。
+    """
+
+    def __init__(self):
+        self._configs: Dict[int, Optional[RSSFeedConfig]] = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def get(self, rule_id) -> Optional[RSSFeedConfig]:
+        """
+        获取规则的 RSS 配置
+
+        Returns:
+            RSSFeedConfig: RSS 配置，规则没有 RSS 配置时返回 None
+        """
+        cached = self._configs.get(rule_id, _MISSING)
+        if cached is not _MISSING:
+            return cached
+
+        version = self._version
+        session = get_session()
+        try:
+            rss_config = session.query(RSSConfig).options(
+                joinedload(RSSConfig.patterns),
+                joinedload(RSSConfig.rule)
+            ).filter(RSSConfig.rule_id == rule_id).first()
+            feed_config = self._build(rss_config) if rss_config else None
+        finally:
+            session.close()
+
+        with self._lock:
+            if self._version == version:
+                self._configs[rule_id] = feed_config
+        return feed_config
+
+    async def get_async(self, rule_id) -> Optional[RSSFeedConfig]:
+        """获取规则的 RSS 配置，未命中缓存时在数据库线程中加载，不阻塞事件循环"""
+        cached = self._configs.get(rule_id, _MISSING)
+        if cached is not _MISSING:
+            return cached
+        return await db_executor.run(self.get, rule_id)
+
+    @staticmethod
+    def _build(rss_config):
+        patterns = sorted(rss_config.patterns, key=lambda p: (p.priority or 0, p.id))
+        return RSSFeedConfig(
+            config=RSSConfigSnapshot(*(getattr(rss_config, field) for field in RSSConfigSnapshot._fields)),
+            ai_model=rss_config.rule.ai_model if rss_config.rule else None,
+            title_patterns=tuple(p.pattern for p in patterns if p.pattern_type == 'title'),
+            content_patterns=tuple(p.pattern for p in patterns if p.pattern_type == 'content'),
+        )
+
+    def invalidate(self, rule_ids=None) -> None:
+        """丢弃缓存，rule_ids 为空时丢弃全部"""
+        with self._lock:
+            self._version += 1
+            if rule_ids is None:
+                self._configs.clear()
+            else:
+                for rule_id in rule_ids:
+                    self._configs.pop(rule_id, None)
+        logger.debug(f"RSS 配置缓存已失效: {'全部' if rule_ids is None else sorted(rule_ids)}")
+
+
+# 创建全局实例
+rss_config_cache = RSSConfigCache()
+
+
+def _on_config_change(changes):
+    """RSS 模式不直接关联规则，变更时整体失效"""
+    rss_config_cache.invalidate(changed_rule_ids(changes))
+
+
+config_bus.subscribe(_on_config_change, entities=(
+    RSSConfig.__tablename__, RSSPattern.__tablename__, ForwardRule.__tablename__
+))
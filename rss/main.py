@@ -10,6 +10,9 @@ import sys
 import os
 from pathlib import Path
 from utils.log_config import setup_logging
+from utils.constants import CONFIG_BUS_POLL_INTERVAL
+from managers.config_bus import config_bus
+import asyncio
 
 
 
@@ -27,6 +30,22 @@ app.include_router(auth_router)
 app.include_router(rss_router)
 app.include_router(feed.router)
 
+# 配置变更轮询任务
+config_bus_task = None
+
+
+@app.on_event("startup")
+async def start_config_bus():
+    """轮询主进程的配置变更，使 RSS 配置缓存失效（过期记录由主进程清理）"""
+    global config_bus_task
+    config_bus_task = asyncio.create_task(config_bus.poll_loop(CONFIG_BUS_POLL_INTERVAL))
+
+
+@app.on_event("shutdown")
+async def stop_config_bus():
+    if config_bus_task:
+        config_bus_task.cancel()
+
 # 模板配置
 templates = Jinja2Templates(directory="rss/app/templates")
 
@@ -6,8 +6,10 @@ import logging
 from dotenv import load_dotenv
 from telethon import TelegramClient
 from models.models import get_session, Chat
+from models.db_executor import db_executor
 import traceback
 from utils.constants import DEFAULT_TIMEZONE
+from utils.metrics import SCHEDULER_RUN_DURATION, track_duration
 logger = logging.getLogger(__name__)
 
 class ChatUpdater:
@@ -70,13 +72,14 @@ class ChatUpdater:
                 logger.error(f"错误详情: {traceback.format_exc()}")
                 await asyncio.sleep(60)  # 出错后等待一分钟再重试
     
+    @track_duration(SCHEDULER_RUN_DURATION, 'chat_updater')
     async def _update_all_chats(self):
         """更新所有聊天信息"""
         logger.info("开始更新所有聊天信息...")
         session = get_session()
         try:
             # 获取所有聊天
-            chats = session.query(Chat).all()
+            chats = await db_executor.run(session.query(Chat).all)
             total_chats = len(chats)
             logger.info(f"找到 {total_chats} 个聊天需要更新信息")
             
@@ -114,7 +117,7 @@ class ChatUpdater:
                         if chat.name != new_name:
                             old_name = chat.name or "未命名"
                             chat.name = new_name
-                            session.commit()
+                            await db_executor.run(session.commit)
                             logger.info(f"已更新聊天 {chat_id}: {old_name} -> {new_name}")
                             updated_count += 1
                         else:
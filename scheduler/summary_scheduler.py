@@ -1,7 +1,9 @@
 import asyncio
 from datetime import datetime, timedelta
 import pytz
+from sqlalchemy.orm import joinedload
 from models.models import get_session, ForwardRule
+from models.db_executor import db_executor
 import logging
 import os
 from dotenv import load_dotenv
@@ -9,6 +11,7 @@ from telethon import TelegramClient, errors
 from ai import get_ai_provider
 import traceback
 from utils.constants import DEFAULT_TIMEZONE,DEFAULT_AI_MODEL,DEFAULT_SUMMARY_PROMPT
+from utils.metrics import SCHEDULER_RUN_DURATION, track_duration
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +22,17 @@ MAX_MESSAGE_PART_LENGTH = TELEGRAM_MAX_MESSAGE_LENGTH - 300
 # Maximum number of attempts for sending messages
 MAX_SEND_ATTEMPTS = 2
 
+
+def _query_summary_rules(session, rule_id=None):
+    """加载指定规则或所有启用了总结功能的规则，同时加载源聊天和目标聊天"""
+    query = session.query(ForwardRule).options(
+        joinedload(ForwardRule.source_chat),
+        joinedload(ForwardRule.target_chat)
+    )
+    if rule_id is not None:
+        return query.filter(ForwardRule.id == rule_id).first()
+    return query.filter(ForwardRule.is_summary == True).all()
+
 class SummaryScheduler:
     def __init__(self, user_client: TelegramClient, bot_client: TelegramClient):
         self.tasks = {}  # 存储所有定时任务 {rule_id: task}
@@ -123,11 +137,12 @@ class SummaryScheduler:
 
         return next_time
 
+    @track_duration(SCHEDULER_RUN_DURATION, 'summary')
     async def _execute_summary(self, rule_id, is_now=False):
         """执行单个规则的总结任务"""
         session = get_session()
         try:
-            rule = session.query(ForwardRule).get(rule_id)
+            rule = await db_executor.run(_query_summary_rules, session, rule_id)
             if not is_now:
                 if not rule or not rule.is_summary:
                     return
@@ -320,7 +335,7 @@ class SummaryScheduler:
         session = get_session()
         try:
             # 获取所有启用了总结功能的规则
-            rules = session.query(ForwardRule).filter_by(is_summary=True).all()
+            rules = await db_executor.run(_query_summary_rules, session)
             logger.info(f"找到 {len(rules)} 个启用了总结功能的规则")
 
             for rule in rules:
@@ -357,7 +372,7 @@ class SummaryScheduler:
         """立即执行所有启用了总结功能的规则"""
         session = get_session()
         try:
-            rules = session.query(ForwardRule).filter_by(is_summary=True).all()
+            rules = await db_executor.run(_query_summary_rules, session)
             # 使用 gather 但限制并发数
             tasks = [self._execute_summary(rule.id, is_now=True) for rule in rules]
             for i in range(0, len(tasks), 2):  # 每次执行2个任务
@@ -5,11 +5,13 @@ import string
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from models.models import get_session, WebScrapeConfig, ProcessedPost
+from models.db_executor import db_executor
 from crawler.web_scraper import scrape_page
 from ai import get_ai_provider
 from utils.common import get_bot_client
 from datetime import datetime
 from playwright.async_api import async_playwright
+from utils.metrics import SCHEDULER_RUN_DURATION, track_duration
 
 logger = logging.getLogger(__name__)
 
@@ -26,17 +28,23 @@ def set_web_scrape_scheduler(scheduler):
     _global_web_scrape_scheduler = scheduler
 URL_TEMPLATE = "https://coinmarketcap.com/community/coins/{coin_name}/latest/"
 
+@track_duration(SCHEDULER_RUN_DURATION, 'web_scrape')
 async def execute_scrape_task(task_id: int, bot_client):
     """执行单个抓取、总结和发送任务"""
     logger.info(f"开始执行网页抓取任务 ID: {task_id}")
     session = get_session()
     task = None
     try:
-        task = session.query(WebScrapeConfig).get(task_id)
+        task = await db_executor.run(session.query(WebScrapeConfig).get, task_id)
         if not (task and task.is_enabled and task.target_channel_id):
             logger.warning(f"任务 {task_id} 不存在、已禁用或未设置目标频道，跳过执行。")
             return
 
+        # 数据库中已处理过的帖子ID
+        db_processed_ids = await db_executor.run(
+            lambda: {post.post_unique_id for post in task.processed_posts}
+        )
+
         all_new_posts = []
         posts_by_coin = {}
         processed_unique_ids = set()  # 跟踪本次任务已处理的帖子ID，防止重复
@@ -67,7 +75,6 @@ async def execute_scrape_task(task_id: int, bot_client):
                             )
 
                         # 筛选真正的新帖子（数据库中没有且本次任务未处理过）
-                        db_processed_ids = {post.post_unique_id for post in task.processed_posts}
                         coin_new_posts = []
 
                         for post in scraped_posts:
@@ -137,7 +144,7 @@ async def execute_scrape_task(task_id: int, bot_client):
                 session.add(processed)
             
             task.last_run_at = datetime.now()
-            session.commit()
+            await db_executor.run(session.commit)
             logger.info(f"任务 {task.id}: 已将 {len(all_new_posts)} 个新帖子标记为已处理。")
         else:
             logger.info(f"任务 {task.id}: 执行完毕，未发现新内容。")
@@ -161,7 +168,7 @@ class WebScrapeScheduler:
         logger.info("正在启动网页抓取调度器...")
         session = get_session()
         try:
-            tasks = session.query(WebScrapeConfig).filter_by(is_enabled=True).all()
+            tasks = await db_executor.run(session.query(WebScrapeConfig).filter_by(is_enabled=True).all)
             logger.info(f"找到 {len(tasks)} 个已启用的网页抓取任务。")
             for task in tasks:
                 self.scheduler.add_job(
@@ -192,7 +199,7 @@ class WebScrapeScheduler:
         """重新调度指定任务"""
         session = get_session()
         try:
-            task = session.query(WebScrapeConfig).filter_by(id=task_id, is_enabled=True).first()
+            task = await db_executor.run(session.query(WebScrapeConfig).filter_by(id=task_id, is_enabled=True).first)
             if not task:
                 logger.warning(f"任务 ID {task_id} 不存在或已禁用，无法重新调度")
                 return False
@@ -6,12 +6,13 @@ from telethon.tl.types import ChannelParticipantsAdmins
 from ai import get_ai_provider
 from enums.enums import ForwardMode
 from models.models import Chat, ForwardRule
-import re
 import telethon
 from utils.auto_delete import respond_and_delete,reply_and_delete,async_delete_user_message
-from datetime import datetime, timedelta
 
 from utils.constants import AI_SETTINGS_TEXT,MEDIA_SETTINGS_TEXT
+from utils.ttl_cache import TTLCache
+from managers.keyword_index import keyword_index
+from models.db_executor import db_executor, run_in_db_thread
 
 logger = logging.getLogger(__name__)
 
@@ -78,46 +79,54 @@ async def get_user_id():
     return int(user_id_str)
 
 
-async def get_current_rule(session, event):
-    """获取当前选中的规则"""
-    try:
-        # 获取当前聊天
-        current_chat = await event.get_chat()
-        logger.info(f'获取当前聊天: {current_chat.id}')
+def _query_current_rule(session, chat_id):
+    """查询聊天当前选中的规则，返回 (规则, 源聊天, 提示消息)"""
+    current_chat_db = session.query(Chat).filter(
+        Chat.telegram_chat_id == str(chat_id)
+    ).first()
 
-        current_chat_db = session.query(Chat).filter(
-            Chat.telegram_chat_id == str(current_chat.id)
-        ).first()
+    if not current_chat_db or not current_chat_db.current_add_id:
+        logger.info('未找到当前聊天或未选择源聊天')
+        return None, None, '请先使用 /switch 选择一个源聊天'
 
-        if not current_chat_db or not current_chat_db.current_add_id:
-            logger.info('未找到当前聊天或未选择源聊天')
-            await reply_and_delete(event,'请先使用 /switch 选择一个源聊天')
-            return None
+    logger.info(f'当前选中的源聊天ID: {current_chat_db.current_add_id}')
+
+    # 查找对应的规则
+    source_chat = session.query(Chat).filter(
+        Chat.telegram_chat_id == current_chat_db.current_add_id
+    ).first()
 
-        logger.info(f'当前选中的源聊天ID: {current_chat_db.current_add_id}')
+    if source_chat:
+        logger.info(f'找到源聊天: {source_chat.name}')
+    else:
+        logger.error('未找到源聊天')
+        return None, None, None
 
-        # 查找对应的规则
-        source_chat = session.query(Chat).filter(
-            Chat.telegram_chat_id == current_chat_db.current_add_id
-        ).first()
+    rule = session.query(ForwardRule).filter(
+        ForwardRule.source_chat_id == source_chat.id,
+        ForwardRule.target_chat_id == current_chat_db.id
+    ).first()
 
-        if source_chat:
-            logger.info(f'找到源聊天: {source_chat.name}')
-        else:
-            logger.error('未找到源聊天')
-            return None
+    if not rule:
+        logger.info('未找到对应的转发规则')
+        return None, None, '转发规则不存在'
+
+    logger.info(f'找到转发规则 ID: {rule.id}')
+    return rule, source_chat, None
 
-        rule = session.query(ForwardRule).filter(
-            ForwardRule.source_chat_id == source_chat.id,
-            ForwardRule.target_chat_id == current_chat_db.id
-        ).first()
 
+async def get_current_rule(session, event):
+    """获取当前选中的规则"""
+    try:
+        # 获取当前聊天
+        current_chat = await event.get_chat()
+        logger.info(f'获取当前聊天: {current_chat.id}')
+
+        rule, source_chat, message = await db_executor.run(_query_current_rule, session, current_chat.id)
         if not rule:
-            logger.info('未找到对应的转发规则')
-            await reply_and_delete(event,'转发规则不存在')
+            if message:
+                await reply_and_delete(event, message)
             return None
-
-        logger.info(f'找到转发规则 ID: {rule.id}')
         return rule, source_chat
     except Exception as e:
         logger.error(f'获取当前规则时出错: {str(e)}')
@@ -126,6 +135,24 @@ async def get_current_rule(session, event):
         return None
 
 
+def _query_all_rules(session, chat_id):
+    """查询以聊天为目标的所有规则，聊天不存在时返回None"""
+    current_chat_db = session.query(Chat).filter(
+        Chat.telegram_chat_id == str(chat_id)
+    ).first()
+
+    if not current_chat_db:
+        logger.info('未找到当前聊天')
+        return None
+
+    logger.info(f'找到当前聊天数据库记录 ID: {current_chat_db.id}')
+
+    # 查找所有以当前聊天为目标的规则
+    return session.query(ForwardRule).filter(
+        ForwardRule.target_chat_id == current_chat_db.id
+    ).all()
+
+
 async def get_all_rules(session, event):
     """获取当前聊天的所有规则"""
     try:
@@ -133,21 +160,7 @@ async def get_all_rules(session, event):
         current_chat = await event.get_chat()
         logger.info(f'获取当前聊天: {current_chat.id}')
 
-        current_chat_db = session.query(Chat).filter(
-            Chat.telegram_chat_id == str(current_chat.id)
-        ).first()
-
-        if not current_chat_db:
-            logger.info('未找到当前聊天')
-            await reply_and_delete(event,'当前聊天没有任何转发规则')
-            return None
-
-        logger.info(f'找到当前聊天数据库记录 ID: {current_chat_db.id}')
-
-        # 查找所有以当前聊天为目标的规则
-        rules = session.query(ForwardRule).filter(
-            ForwardRule.target_chat_id == current_chat_db.id
-        ).all()
+        rules = await db_executor.run(_query_all_rules, session, current_chat.id)
 
         if not rules:
             logger.info('未找到任何转发规则')
@@ -164,21 +177,17 @@ async def get_all_rules(session, event):
 
 
 
-# 添加缓存字典
-_admin_cache = {}
-_CACHE_DURATION = timedelta(minutes=30)  # 缓存30分钟
+# 频道管理员缓存，30分钟过期
+_admin_cache = TTLCache(ttl=30 * 60, maxsize=1000, name='channel_admins')
 
 
 
 async def get_channel_admins(client, chat_id):
     """获取频道管理员列表，带缓存机制"""
-    current_time = datetime.now()
-    
     # 检查缓存是否存在且未过期
-    if chat_id in _admin_cache:
-        cache_data = _admin_cache[chat_id]
-        if current_time - cache_data['timestamp'] < _CACHE_DURATION:
-            return cache_data['admin_ids']
+    admin_ids = _admin_cache.get(chat_id)
+    if admin_ids is not None:
+        return admin_ids
     
     # 缓存不存在或已过期，重新获取管理员列表
     try:
@@ -186,10 +195,7 @@ async def get_channel_admins(client, chat_id):
         admin_ids = [admin.id for admin in admins]
         
         # 更新缓存
-        _admin_cache[chat_id] = {
-            'admin_ids': admin_ids,
-            'timestamp': current_time
-        }
+        _admin_cache.set(chat_id, admin_ids)
         return admin_ids
     except Exception as e:
         logger.error(f'获取频道管理员列表失败: {str(e)}')
@@ -317,7 +323,8 @@ async def get_sender_info(event, rule_id):
         logger.error(f'获取发送者信息出错: {str(e)}')
         return None
 
-async def check_and_clean_chats(session, rule=None):
+@run_in_db_thread
+def check_and_clean_chats(session, rule=None):
     """
     检查并清理不再与任何规则关联的聊天记录
     
@@ -428,105 +435,74 @@ async def check_keywords(rule, message_text, event = None):
     logger.info(f"当前转发模式: {rule.forward_mode}")
     forward_mode = rule.forward_mode
 
+    # 使用缓存的编译匹配器，消息文本只转换一次小写
+    matcher = keyword_index.get_matcher(rule)
+    message_text = message_text or ''
+    lowered_text = message_text.lower()
+
     # 仅白名单模式
     if forward_mode == ForwardMode.WHITELIST:
-        return await process_whitelist_mode(rule, message_text, reverse_blacklist)
+        return await process_whitelist_mode(matcher, message_text, lowered_text, reverse_blacklist)
 
     # 仅黑名单模式
     elif forward_mode == ForwardMode.BLACKLIST:
-        return await process_blacklist_mode(rule, message_text, reverse_whitelist)
+        return await process_blacklist_mode(matcher, message_text, lowered_text, reverse_whitelist)
 
     # 先白后黑模式
     elif forward_mode == ForwardMode.WHITELIST_THEN_BLACKLIST:
-        return await process_whitelist_then_blacklist_mode(rule, message_text, reverse_blacklist)
+        return await process_whitelist_then_blacklist_mode(matcher, message_text, lowered_text, reverse_blacklist)
 
     # 先黑后白模式
     elif forward_mode == ForwardMode.BLACKLIST_THEN_WHITELIST:
-        return await process_blacklist_then_whitelist_mode(rule, message_text, reverse_whitelist)
+        return await process_blacklist_then_whitelist_mode(matcher, message_text, lowered_text, reverse_whitelist)
 
     logger.error(f"未知的转发模式: {forward_mode}")
     return False
 
-async def process_whitelist_mode(rule, message_text, reverse_blacklist):
+async def process_whitelist_mode(matcher, message_text, lowered_text, reverse_blacklist):
     """处理仅白名单模式"""
     logger.info("进入仅白名单模式")
-    should_forward = False
 
     # 检查普通白名单关键词
-    whitelist_keywords = [k for k in rule.keywords if not k.is_blacklist]
-    logger.info(f"普通白名单关键词: {[k.keyword for k in whitelist_keywords]}")
-    
-    for keyword in whitelist_keywords:
-        if await check_keyword_match(keyword, message_text):
-            should_forward = True
-            break
-    
-    if not should_forward:
+    logger.info(f"普通白名单关键词数量: {len(matcher.whitelist)}")
+    matched = await matcher.whitelist.search(message_text, lowered_text)
+    if matched is None:
         logger.info("未匹配到普通白名单关键词，不转发")
         return False
+    logger.info(f"匹配到白名单关键词 '{matched}'")
 
     # 如果启用了黑名单反转，还需要匹配反转后的黑名单（作为第二重白名单）
     if reverse_blacklist:
-        logger.info("检查反转后的黑名单关键词（作为白名单）")
-        reversed_blacklist = [k for k in rule.keywords if k.is_blacklist]
-        logger.info(f"反转后的黑名单关键词: {[k.keyword for k in reversed_blacklist]}")
-        
-        reversed_match = False
-        for keyword in reversed_blacklist:
-            if await check_keyword_match(keyword, message_text):
-                reversed_match = True
-                break
-        
-        if not reversed_match:
+        logger.info(f"检查反转后的黑名单关键词（作为白名单），数量: {len(matcher.blacklist)}")
+        if await matcher.blacklist.search(message_text, lowered_text) is None:
             logger.info("未匹配到反转后的黑名单关键词，不转发")
             return False
 
     logger.info("所有白名单条件都满足，允许转发")
     return True
 
-async def process_blacklist_mode(rule, message_text, reverse_whitelist):
+async def process_blacklist_mode(matcher, message_text, lowered_text, reverse_whitelist):
     """处理仅黑名单模式"""
     logger.info("进入仅黑名单模式")
 
     # 检查普通黑名单关键词
-    blacklist_keywords = [k for k in rule.keywords if k.is_blacklist]
-    logger.info(f"普通黑名单关键词: {[k.keyword for k in blacklist_keywords]}")
-    
-    for keyword in blacklist_keywords:
-        if await check_keyword_match(keyword, message_text):
-            logger.info(f"匹配到黑名单关键词 '{keyword.keyword}'，不转发")
-            return False
+    logger.info(f"普通黑名单关键词数量: {len(matcher.blacklist)}")
+    matched = await matcher.blacklist.search(message_text, lowered_text)
+    if matched is not None:
+        logger.info(f"匹配到黑名单关键词 '{matched}'，不转发")
+        return False
 
     # 如果启用了白名单反转，检查反转后的白名单（作为黑名单）
     if reverse_whitelist:
-        logger.info("检查反转后的白名单关键词（作为黑名单）")
-        reversed_whitelist = [k for k in rule.keywords if not k.is_blacklist]
-        logger.info(f"反转后的白名单关键词: {[k.keyword for k in reversed_whitelist]}")
-        
-        for keyword in reversed_whitelist:
-            if await check_keyword_match(keyword, message_text):
-                logger.info(f"匹配到反转后的白名单关键词 '{keyword.keyword}'，不转发")
-                return False
+        logger.info(f"检查反转后的白名单关键词（作为黑名单），数量: {len(matcher.whitelist)}")
+        matched = await matcher.whitelist.search(message_text, lowered_text)
+        if matched is not None:
+            logger.info(f"匹配到反转后的白名单关键词 '{matched}'，不转发")
+            return False
 
     logger.info("未匹配到任何黑名单关键词，允许转发")
     return True
 
-async def check_keyword_match(keyword, message_text):
-    """检查单个关键词是否匹配"""
-    logger.info(f"检查关键字: {keyword.keyword} (正则: {keyword.is_regex})")
-    if keyword.is_regex:
-        try:
-            if re.search(keyword.keyword, message_text):
-                logger.info(f"正则匹配成功: {keyword.keyword}")
-                return True
-        except re.error:
-            logger.error(f"正则表达式错误: {keyword.keyword}")
-    else:
-        if keyword.keyword.lower() in message_text.lower():
-            logger.info(f"关键字匹配成功: {keyword.keyword}")
-            return True
-    return False
-
 async def process_user_info(event, rule_id, message_text):
     """处理用户信息过滤"""
     username = await get_sender_info(event, rule_id)
@@ -556,7 +532,7 @@ async def process_user_info(event, rule_id, message_text):
         return message_text
 
 
-async def process_whitelist_then_blacklist_mode(rule, message_text, reverse_blacklist):
+async def process_whitelist_then_blacklist_mode(matcher, message_text, lowered_text, reverse_blacklist):
     """处理先白后黑模式
     
     先检查白名单（必须匹配），然后检查黑名单（不能匹配）
@@ -565,48 +541,31 @@ async def process_whitelist_then_blacklist_mode(rule, message_text, reverse_blac
     logger.info("进入先白后黑模式")
 
     # 检查普通白名单（必须匹配）
-    whitelist_match = False
-    whitelist_keywords = [k for k in rule.keywords if not k.is_blacklist]
-    logger.info(f"检查普通白名单关键词: {[k.keyword for k in whitelist_keywords]}")
-    
-    for keyword in whitelist_keywords:
-        if await check_keyword_match(keyword, message_text):
-            whitelist_match = True
-            break
-    
-    if not whitelist_match:
+    logger.info(f"检查普通白名单关键词，数量: {len(matcher.whitelist)}")
+    if await matcher.whitelist.search(message_text, lowered_text) is None:
         logger.info("未匹配到白名单关键词，不转发")
         return False
 
     # 根据反转设置处理黑名单
-    blacklist_keywords = [k for k in rule.keywords if k.is_blacklist]
+    matched = await matcher.blacklist.search(message_text, lowered_text)
     
     if reverse_blacklist:
         # 黑名单反转为白名单，必须匹配才转发
-        logger.info("黑名单已反转，作为第二重白名单检查")
-        logger.info(f"反转后的黑名单关键词: {[k.keyword for k in blacklist_keywords]}")
-        
-        blacklist_match = False
-        for keyword in blacklist_keywords:
-            if await check_keyword_match(keyword, message_text):
-                blacklist_match = True
-                break
-        
-        if not blacklist_match:
+        logger.info(f"黑名单已反转，作为第二重白名单检查，数量: {len(matcher.blacklist)}")
+        if matched is None:
             logger.info("未匹配到反转后的黑名单关键词，不转发")
             return False
     else:
         # 正常黑名单，匹配则不转发
-        logger.info(f"检查普通黑名单关键词: {[k.keyword for k in blacklist_keywords]}")
-        for keyword in blacklist_keywords:
-            if await check_keyword_match(keyword, message_text):
-                logger.info(f"匹配到黑名单关键词 '{keyword.keyword}'，不转发")
-                return False
+        logger.info(f"检查普通黑名单关键词，数量: {len(matcher.blacklist)}")
+        if matched is not None:
+            logger.info(f"匹配到黑名单关键词 '{matched}'，不转发")
+            return False
 
     logger.info("所有条件都满足，允许转发")
     return True
 
-async def process_blacklist_then_whitelist_mode(rule, message_text, reverse_whitelist):
+async def process_blacklist_then_whitelist_mode(matcher, message_text, lowered_text, reverse_whitelist):
     """处理先黑后白模式
     
     先检查黑名单（不能匹配），然后检查白名单（必须匹配）
@@ -615,36 +574,25 @@ async def process_blacklist_then_whitelist_mode(rule, message_text, reverse_whit
     logger.info("进入先黑后白模式")
 
     # 检查普通黑名单（匹配则拒绝）
-    blacklist_keywords = [k for k in rule.keywords if k.is_blacklist]
-    logger.info(f"检查普通黑名单关键词: {[k.keyword for k in blacklist_keywords]}")
-    
-    for keyword in blacklist_keywords:
-        if await check_keyword_match(keyword, message_text):
-            logger.info(f"匹配到黑名单关键词 '{keyword.keyword}'，不转发")
-            return False
+    logger.info(f"检查普通黑名单关键词，数量: {len(matcher.blacklist)}")
+    matched = await matcher.blacklist.search(message_text, lowered_text)
+    if matched is not None:
+        logger.info(f"匹配到黑名单关键词 '{matched}'，不转发")
+        return False
 
     # 处理白名单
-    whitelist_keywords = [k for k in rule.keywords if not k.is_blacklist]
+    matched = await matcher.whitelist.search(message_text, lowered_text)
     
     if reverse_whitelist:
         # 白名单反转为黑名单，匹配则不转发
-        logger.info("白名单已反转，作为第二重黑名单检查")
-        logger.info(f"反转后的白名单关键词: {[k.keyword for k in whitelist_keywords]}")
-        
-        for keyword in whitelist_keywords:
-            if await check_keyword_match(keyword, message_text):
-                logger.info(f"匹配到反转后的白名单关键词 '{keyword.keyword}'，不转发")
-                return False
+        logger.info(f"白名单已反转，作为第二重黑名单检查，数量: {len(matcher.whitelist)}")
+        if matched is not None:
+            logger.info(f"匹配到反转后的白名单关键词 '{matched}'，不转发")
+            return False
     else:
         # 正常白名单，必须匹配才转发
-        logger.info(f"检查普通白名单关键词: {[k.keyword for k in whitelist_keywords]}")
-        whitelist_match = False
-        for keyword in whitelist_keywords:
-            if await check_keyword_match(keyword, message_text):
-                whitelist_match = True
-                break
-        
-        if not whitelist_match:
+        logger.info(f"检查普通白名单关键词，数量: {len(matcher.whitelist)}")
+        if matched is None:
             logger.info("未匹配到白名单关键词，不转发")
             return False
 
@@ -64,6 +64,108 @@ MEDIA_SIZE_COLS = int(os.getenv('MEDIA_SIZE_COLS', 6))
 MEDIA_EXTENSIONS_ROWS = int(os.getenv('MEDIA_EXTENSIONS_ROWS', 6))
 MEDIA_EXTENSIONS_COLS = int(os.getenv('MEDIA_EXTENSIONS_COLS', 6))
 
+# 消息分发器配置
+DISPATCHER_WORKERS = int(os.getenv('DISPATCHER_WORKERS', 4))
+DISPATCHER_QUEUE_SIZE = int(os.getenv('DISPATCHER_QUEUE_SIZE', 100))
+# 队列满时的策略: block(阻塞) / drop_oldest(丢弃最旧) / spill(落盘)
+DISPATCHER_OVERFLOW_POLICY = os.getenv('DISPATCHER_OVERFLOW_POLICY', 'block').lower()
+DISPATCHER_SPILL_DIR = os.path.join(BASE_DIR, 'db', 'spill')
+# 同一消息命中多条规则时是否并发执行各规则
+RULE_FANOUT_CONCURRENT = os.getenv('RULE_FANOUT_CONCURRENT', 'true').lower() == 'true'
+
+# 媒体组聚合配置：组内消息停止到达超过静默期后视为收集完成（静默期在上下限之间自适应）
+MEDIA_GROUP_MIN_WAIT = float(os.getenv('MEDIA_GROUP_MIN_WAIT', 0.5))
+MEDIA_GROUP_MAX_WAIT = float(os.getenv('MEDIA_GROUP_MAX_WAIT', 2.0))
+
+# 投递去重日志配置：避免重启或重连后重放的消息被重复转发
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'true').lower() == 'true'
+DEDUP_RETENTION_HOURS = int(os.getenv('DEDUP_RETENTION_HOURS', 48))
+DEDUP_CACHE_SIZE = int(os.getenv('DEDUP_CACHE_SIZE', 200000))
+DEDUP_DB_PATH = os.path.join(BASE_DIR, 'db', 'dedup.db')
+
+# 指标汇总日志输出间隔（秒），0 表示不输出
+METRICS_LOG_INTERVAL = int(os.getenv('METRICS_LOG_INTERVAL', 300))
+# 主进程指标快照文件，RSS 服务的 /metrics 端点读取后合并导出
+METRICS_SNAPSHOT_PATH = os.getenv('METRICS_SNAPSHOT_PATH', os.path.join(BASE_DIR, 'db', 'metrics', 'main.json'))
+# 主进程指标快照写入间隔（秒）
+METRICS_SNAPSHOT_INTERVAL = int(os.getenv('METRICS_SNAPSHOT_INTERVAL', 15))
+
+# 是否为每条消息记录处理追踪
+TRACE_ENABLED = os.getenv('TRACE_ENABLED', 'true').lower() == 'true'
+# 慢追踪阈值（秒），超过阈值或处理出错的追踪会被保留
+TRACE_SLOW_THRESHOLD = float(os.getenv('TRACE_SLOW_THRESHOLD', 3))
+# 保留的慢追踪数量
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', 100))
+
+# 用户正则的执行方式: risky（仅有回溯风险的正则在沙箱进程中执行）、all（全部在沙箱中执行）、off（不使用沙箱）
+REGEX_SANDBOX_MODE = os.getenv('REGEX_SANDBOX_MODE', 'risky').lower()
+# 单次正则匹配的时间预算（秒）
+REGEX_TIMEOUT = float(os.getenv('REGEX_TIMEOUT', 0.5))
+# 同一正则超时达到该次数后禁用
+REGEX_MAX_TIMEOUTS = int(os.getenv('REGEX_MAX_TIMEOUTS', 3))
+# 正则沙箱进程数
+REGEX_SANDBOX_WORKERS = int(os.getenv('REGEX_SANDBOX_WORKERS', 1))
+# 被禁用的正则列表
+REGEX_DISABLED_PATH = os.path.join(BASE_DIR, 'db', 'regex_disabled.json')
+
+# SQLite 性能配置：是否启用 WAL 日志（多进程读写时读不阻塞写）
+SQLITE_WAL = os.getenv('SQLITE_WAL', 'true').lower() == 'true'
+# 数据库被锁时的等待时间（毫秒）
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', 10000))
+# 每个连接的页缓存大小（KB）
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', 16384))
+# 内存映射读取的大小（字节），0 表示关闭
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 64 * 1024 * 1024))
+# 数据库连接池大小与可额外创建的连接数
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+# 执行数据库操作的线程数，数据库操作在这些线程中进行，不阻塞事件循环
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', 2))
+
+# 配置变更通知：轮询其他进程变更记录的间隔（秒）
+CONFIG_BUS_POLL_INTERVAL = float(os.getenv('CONFIG_BUS_POLL_INTERVAL', 2))
+# 配置变更记录保留时长（秒）
+CONFIG_BUS_RETENTION = int(os.getenv('CONFIG_BUS_RETENTION', 3600))
+
+# 关键字/替换规则导入：每批写入数据库的行数
+LIST_IMPORT_CHUNK_SIZE = int(os.getenv('LIST_IMPORT_CHUNK_SIZE', 2000))
+# 关键字/替换规则导出：每次从数据库读取的行数
+LIST_EXPORT_BATCH_SIZE = int(os.getenv('LIST_EXPORT_BATCH_SIZE', 1000))
+# 导入导出进度消息的最小编辑间隔（秒），避免触发 Telegram 限流
+PROGRESS_EDIT_INTERVAL = float(os.getenv('PROGRESS_EDIT_INTERVAL', 3))
+
+# 媒体缓存：同一媒体文件只下载一次，供所有规则和处理阶段共用
+MEDIA_CACHE_DIR = os.path.join(TEMP_DIR, 'media_cache')
+# 媒体缓存占用磁盘的上限（MB），超出时淘汰最久未使用且没有被引用的文件
+MEDIA_CACHE_MAX_SIZE_MB = int(os.getenv('MEDIA_CACHE_MAX_SIZE_MB', 1024))
+# 发送媒体时优先直接引用原文件（不下载再上传），引用不可用时自动回退为下载上传
+SEND_BY_REFERENCE = os.getenv('SEND_BY_REFERENCE', 'true').lower() == 'true'
+
+# 媒体下载：同时进行的下载数（所有规则共享）
+DOWNLOAD_CONCURRENCY = int(os.getenv('DOWNLOAD_CONCURRENCY', 4))
+# 分块下载的每块大小（KB），须为 4 的倍数，最大 512
+DOWNLOAD_PART_SIZE_KB = int(os.getenv('DOWNLOAD_PART_SIZE_KB', 512))
+# 下载总带宽上限（KB/秒），0 表示不限制
+DOWNLOAD_BANDWIDTH_LIMIT_KB = int(os.getenv('DOWNLOAD_BANDWIDTH_LIMIT_KB', 0))
+# 网络错误时的重试次数，重试时从已下载的位置继续
+DOWNLOAD_RETRIES = int(os.getenv('DOWNLOAD_RETRIES', 3))
+
+# AI图片上传：图片长边缩放到的最大像素（提供方超过该尺寸也会缩小）
+AI_IMAGE_MAX_SIDE = int(os.getenv('AI_IMAGE_MAX_SIDE', 1568))
+# AI图片上传：压缩后单张图片的大小上限（KB）
+AI_IMAGE_MAX_KB = int(os.getenv('AI_IMAGE_MAX_KB', 512))
+# AI图片上传：处理结果缓存的图片数量，多条规则共用同一张图片的处理结果
+AI_IMAGE_CACHE_SIZE = int(os.getenv('AI_IMAGE_CACHE_SIZE', 64))
+
+# 临时目录总配额（MB，含媒体缓存），超出时新的下载等待空间释放；0 表示不限制
+TEMP_QUOTA_MB = int(os.getenv('TEMP_QUOTA_MB', 2048))
+# 超出配额时新的下载最多等待的秒数，超时后仍继续下载并记录
+TEMP_QUOTA_WAIT = float(os.getenv('TEMP_QUOTA_WAIT', 60))
+# 清理孤立临时文件的间隔（秒）
+TEMP_SWEEP_INTERVAL = int(os.getenv('TEMP_SWEEP_INTERVAL', 600))
+# 未被任何操作使用、且超过该时间（秒）未修改的临时文件视为孤立文件
+TEMP_ORPHAN_AGE = int(os.getenv('TEMP_ORPHAN_AGE', 3600))
+
 LOG_MAX_SIZE_MB = 10
 LOG_BACKUP_COUNT = 3
 
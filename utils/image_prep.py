@@ -0,0 +1,144 @@
+"""
+AI图片上传前的预处理
+
+把图片缩放到提供方实际使用的分辨率，并压缩到大小上限以内，再编码为 base64。
+JPEG 使用 Pillow 的 draft 模式直接按缩小的比例解码，不需要先解码出全尺寸图像；
+处理结果按媒体缓存键保存，同一张图片被多条规则使用时只处理一次。
+
+未安装 Pillow 时不缩放，直接从文件分块编码。
+"""
+import asyncio
+import base64
+import io
+import logging
+import os
+
+from managers.media_cache import MediaCache, media_cache
+from utils.constants import AI_IMAGE_MAX_SIDE, AI_IMAGE_MAX_KB, AI_IMAGE_CACHE_SIZE
+from utils.ttl_cache import TTLCache
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# 分块编码的块大小，须为 3 的倍数，保证各块的 base64 结果可以直接拼接
+ENCODE_BLOCK = 3 * 64 * 1024
+
+# 依次尝试的 JPEG 质量，直到满足大小上限
+JPEG_QUALITIES = (85, 75, 65, 50)
+
+
+def image_mime_type(message):
+    """获取消息图片的MIME类型，不是图片时返回 None"""
+    if getattr(message, 'photo', None):
+        return 'image/jpeg'
+    mime_type = getattr(getattr(message, 'document', None), 'mime_type', None)
+    if mime_type and mime_type.startswith('image/'):
+        return mime_type
+    return None
+
+
+def encode_file(file_path):
+    """从文件分块编码为 base64，不在内存中保留完整的原始内容"""
+    parts = []
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(ENCODE_BLOCK), b''):
+            parts.append(base64.b64encode(block).decode('ascii'))
+    return ''.join(parts)
+
+
+def prepare_image(file_path, mime_type, max_side=AI_IMAGE_MAX_SIDE, max_bytes=AI_IMAGE_MAX_KB * 1024):
+    """
+    缩放并压缩图片，返回可直接交给AI提供方的图片字典
+
+    尺寸和大小都在限制以内的图片原样编码；其余图片缩放后重新编码为 JPEG。
+
+    Returns:
+        dict: {"data": base64字符串, "mime_type": MIME类型}
+    """
+    file_size = os.path.getsize(file_path)
+    if Image is None:
+        return {"data": encode_file(file_path), "mime_type": mime_type}
+
+    with Image.open(file_path) as image:
+        if file_size <= max_bytes and max(image.size) <= max_side:
+            return {"data": encode_file(file_path), "mime_type": mime_type}
+
+        # JPEG 按接近目标尺寸的比例（1/2、1/4、1/8）解码，大幅减少解码内存
+        image.draft('RGB', (max_side, max_side))
+        image.thumbnail((max_side, max_side))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        buffer = io.BytesIO()
+        for quality in JPEG_QUALITIES:
+            buffer.seek(0)
+            buffer.truncate()
+            image.save(buffer, format='JPEG', quality=quality, optimize=True)
+            if buffer.tell() <= max_bytes:
+                break
+
+    logger.info(f'图片已压缩: {file_size // 1024} KB -> {buffer.tell() // 1024} KB')
+    return {"data": base64.b64encode(buffer.getbuffer()).decode('ascii'), "mime_type": "image/jpeg"}
+
+
+class ImagePreparer:
+    """按媒体缓存键缓存图片预处理结果，同一张图片同时只处理一次"""
+
+    def __init__(self, cache_size=AI_IMAGE_CACHE_SIZE):
+        self._results = TTLCache(ttl=30 * 60, maxsize=cache_size, name='ai_images')
+        self._inflight = {}
+
+    async def prepare(self, message):
+        """
+        获取消息图片的预处理结果
+
+        进行中的处理可能被多条规则共用，因此由处理任务自己持有媒体缓存引用，
+        不借用某一次调用方的引用（调用方清理时文件可能被淘汰）。
+
+        Args:
+            message: 包含图片的消息
+
+        Returns:
+            dict: {"data": base64字符串, "mime_type": MIME类型}，不是图片或处理失败时返回 None
+        """
+        mime_type = image_mime_type(message)
+        if not mime_type:
+            return None
+
+        key = MediaCache.media_key(message)
+        if key is None:
+            return await self._prepare(message, mime_type)
+
+        result = self._results.get(key)
+        if result is not None:
+            return result
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._prepare(message, mime_type))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _, key=key: self._inflight.pop(key, None))
+        result = await asyncio.shield(task)
+        if result is not None:
+            self._results.set(key, result)
+        return result
+
+    async def _prepare(self, message, mime_type):
+        file_path = await media_cache.acquire(message)
+        if not file_path:
+            return None
+        try:
+            return await asyncio.to_thread(prepare_image, file_path, mime_type)
+        except Exception as e:
+            logger.error(f'处理消息 {message.id} 的图片时出错: {str(e)}')
+            return None
+        finally:
+            media_cache.release(file_path)
+
+
+# 创建全局实例
+image_preparer = ImagePreparer()
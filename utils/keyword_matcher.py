@@ -0,0 +1,191 @@
+import logging
+import re
+import time
+from collections import deque
+
+from utils.regex_guard import regex_guard
+
+logger = logging.getLogger(__name__)
+
+# 普通关键字少于该数量时直接逐个 in 查找（C 实现的子串查找在少量关键字时更快）
+AHO_CORASICK_MIN_KEYWORDS = 16
+
+# 会改变分组编号或只能出现在开头的写法，这类正则不能并入组合正则
+_UNCOMBINABLE = re.compile(r'\\[1-9]|\(\?P=|\(\?[aiLmsux]+\)')
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick 多模式匹配自动机
+
+    一次扫描文本即可判断是否包含任一模式，耗时与文本长度成正比，与模式数量无关。
+    """
+
+    def __init__(self, patterns):
+        # 每个节点: 转移表、失败指针、命中的模式（含失败链上继承的）
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        for pattern in patterns:
+            self._insert(pattern)
+        self._build_links()
+
+    def _insert(self, pattern):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._goto[node][char] = next_node
+            node = next_node
+        if self._output[node] is None:
+            self._output[node] = pattern
+
+    def _build_links(self):
+        # 根节点的子节点失败指针指向根，其余节点按层次遍历沿父节点的失败链查找
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                if self._output[child] is None:
+                    self._output[child] = self._output[self._fail[child]]
+
+    def search(self, text):
+        """
+        查找文本中出现的第一个模式
+
+        Returns:
+            str: 命中的模式，未命中返回 None
+        """
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node] is not None:
+                return output[node]
+        return None
+
+
+class KeywordSet:
+    """
+    一组关键字（黑名单或白名单）的编译结果
+
+    普通关键字不区分大小写，在小写文本上匹配；正则关键字区分大小写，在原文上匹配，
+    可以合并的正则合并为一个带命名分组的组合正则，只扫描一次文本。
+    有回溯风险的正则不参与合并，交给 regex_guard 在时间预算内执行；
+    在当前进程执行的正则同样计时，超时后上报 regex_guard，改为在沙箱中执行。
+    """
+
+    def __init__(self, keywords):
+        plain = []
+        regexes = []
+        for keyword in keywords:
+            if keyword.keyword is None:
+                continue
+            if keyword.is_regex:
+                regexes.append(keyword.keyword)
+            else:
+                plain.append(keyword.keyword.lower())
+
+        self.size = len(plain) + len(regexes)
+        # 去重并保持顺序
+        plain = list(dict.fromkeys(plain))
+        self._match_all = '' in plain
+        self._plain = plain
+        self._automaton = AhoCorasick(plain) if len(plain) >= AHO_CORASICK_MIN_KEYWORDS else None
+        regexes = list(dict.fromkeys(regexes))
+        self._guarded = [pattern for pattern in regexes if regex_guard.should_sandbox(pattern)]
+        guarded = set(self._guarded)
+        self._combined, self._combined_names, self._patterns = self._compile_regexes(
+            [pattern for pattern in regexes if pattern not in guarded]
+        )
+
+    @staticmethod
+    def _compile_regexes(regexes):
+        combinable = []
+        patterns = []
+        for pattern in regexes:
+            try:
+                compiled = re.compile(pattern)
+            except re.error:
+                logger.error(f"正则表达式错误: {pattern}")
+                continue
+            if compiled.groupindex or _UNCOMBINABLE.search(pattern):
+                patterns.append(compiled)
+            else:
+                combinable.append(compiled)
+
+        if len(combinable) < 2:
+            return None, {}, combinable + patterns
+
+        names = {f'k{index}': compiled.pattern for index, compiled in enumerate(combinable)}
+        try:
+            combined = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in names.items()))
+        except re.error:
+            return None, {}, combinable + patterns
+        return combined, names, patterns
+
+    def __len__(self):
+        return self.size
+
+    async def search(self, message_text, lowered_text):
+        """
+        查找命中的关键字
+
+        Args:
+            message_text: 原始文本（用于正则关键字）
+            lowered_text: 小写文本（用于普通关键字）
+
+        Returns:
+            str: 命中的关键字，未命中返回 None
+        """
+        if self._match_all:
+            return ''
+        if self._automaton is not None:
+            matched = self._automaton.search(lowered_text)
+            if matched is not None:
+                return matched
+        else:
+            for keyword in self._plain:
+                if keyword in lowered_text:
+                    return keyword
+
+        if self._combined is not None:
+            started = time.perf_counter()
+            match = self._combined.search(message_text)
+            await regex_guard.report_inline(self._combined_names.values(), time.perf_counter() - started)
+            if match:
+                return self._combined_names[match.lastgroup]
+        for compiled in self._patterns:
+            started = time.perf_counter()
+            match = compiled.search(message_text)
+            await regex_guard.report_inline((compiled.pattern,), time.perf_counter() - started)
+            if match:
+                return compiled.pattern
+        for pattern in self._guarded:
+            if await regex_guard.search(pattern, message_text):
+                return pattern
+        return None
+
+
+class RuleKeywordMatcher:
+    """单条规则的关键字匹配器，分别编译黑名单和白名单"""
+
+    def __init__(self, keywords):
+        # 编译时 regex_guard 的风险和禁用状态版本，状态变化后需要重新编译
+        self.generation = regex_guard.generation
+        keywords = list(keywords)
+        self.blacklist = KeywordSet(k for k in keywords if k.is_blacklist)
+        self.whitelist = KeywordSet(k for k in keywords if not k.is_blacklist)
@@ -0,0 +1,176 @@
+"""
+关键字和替换规则列表的流式导入导出
+
+导入时按块读取上传的文件，每块交给批量写入路径；导出时用游标分批读取数据库，
+边读边写文件。列表有十万条时内存占用也保持平稳。
+"""
+import asyncio
+import logging
+import time
+
+from sqlalchemy import select
+
+from models.models import Keyword, ReplaceRule
+from utils.auto_delete import delete_after, reply_and_delete
+from utils.constants import LIST_IMPORT_CHUNK_SIZE, LIST_EXPORT_BATCH_SIZE, PROGRESS_EDIT_INTERVAL, BOT_MESSAGE_DELETE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+def parse_keyword_line(line):
+    """解析关键字行：关键字<空格>黑名单标志(0/1)，格式错误时返回 None"""
+    # 最后一个部分为标志，前面的部分组合为关键字
+    parts = line.split()
+    if len(parts) < 2 or parts[-1] not in ('0', '1'):
+        return None
+    return ' '.join(parts[:-1]), parts[-1] == '1'
+
+
+def parse_replace_line(line):
+    """解析替换规则行：匹配模式<制表符>替换内容，格式错误时返回 None"""
+    # 按第一个制表符分割
+    parts = line.split('\t', 1)
+    pattern = parts[0].strip()
+    if not pattern:
+        return None
+    return pattern, parts[1].strip() if len(parts) > 1 else ''
+
+
+def iter_chunks(file_path, parse_line, chunk_size=LIST_IMPORT_CHUNK_SIZE):
+    """
+    按块读取导入文件，文件逐行读取，不会一次载入内存
+
+    Yields:
+        tuple: (本块解析结果列表, 本块行数, 本块格式错误行数)，空行不计入
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        items = []
+        line_count = 0
+        invalid_count = 0
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            line_count += 1
+            item = parse_line(line)
+            if item is None:
+                invalid_count += 1
+            else:
+                items.append(item)
+            if line_count == chunk_size:
+                yield items, line_count, invalid_count
+                items = []
+                line_count = 0
+                invalid_count = 0
+        if line_count:
+            yield items, line_count, invalid_count
+
+
+async def aiter_chunks(file_path, parse_line, chunk_size=LIST_IMPORT_CHUNK_SIZE):
+    """iter_chunks 的异步版本，文件读取在线程池中进行"""
+    chunks = iter_chunks(file_path, parse_line, chunk_size)
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        chunks.close()
+
+
+def export_keywords(session, rule_id, normal_path, regex_path, batch_size=LIST_EXPORT_BATCH_SIZE):
+    """
+    把规则的关键字分批写入普通关键字文件和正则关键字文件，每行为 关键字<空格>黑名单标志(0/1)
+
+    在数据库线程中执行。
+
+    Returns:
+        tuple: (普通关键字数量, 正则关键字数量)
+    """
+    stmt = select(Keyword.keyword, Keyword.is_regex, Keyword.is_blacklist).where(
+        Keyword.rule_id == rule_id
+    ).order_by(Keyword.id).execution_options(yield_per=batch_size)
+
+    normal_count = 0
+    regex_count = 0
+    with open(normal_path, 'w', encoding='utf-8') as normal_file, \
+            open(regex_path, 'w', encoding='utf-8') as regex_file:
+        for keyword, is_regex, is_blacklist in session.execute(stmt):
+            line = f"{keyword} {1 if is_blacklist else 0}\n"
+            if is_regex:
+                regex_file.write(line)
+                regex_count += 1
+            else:
+                normal_file.write(line)
+                normal_count += 1
+    return normal_count, regex_count
+
+
+def export_replace_rules(session, rule_id, file_path, batch_size=LIST_EXPORT_BATCH_SIZE):
+    """
+    把规则的替换规则分批写入文件，每行为 匹配模式<制表符>替换内容
+
+    在数据库线程中执行。
+
+    Returns:
+        int: 导出的替换规则数量
+    """
+    stmt = select(ReplaceRule.pattern, ReplaceRule.content).where(
+        ReplaceRule.rule_id == rule_id
+    ).order_by(ReplaceRule.id).execution_options(yield_per=batch_size)
+
+    count = 0
+    with open(file_path, 'w', encoding='utf-8') as file:
+        for pattern, content in session.execute(stmt):
+            file.write(f"{pattern}\t{content if content else ''}\n")
+            count += 1
+    return count
+
+
+class ProgressMessage:
+    """
+    通过编辑同一条消息向管理员报告长时间操作的进度
+
+    两次编辑之间至少间隔 PROGRESS_EDIT_INTERVAL 秒，避免触发 Telegram 限流。
+    """
+
+    def __init__(self, event, interval=PROGRESS_EDIT_INTERVAL):
+        self.event = event
+        self.interval = interval
+        self.message = None
+        self._last_edit = 0.0
+
+    async def update(self, text):
+        """更新进度，距上次编辑不足间隔时跳过"""
+        now = time.monotonic()
+        if self.message is not None and now - self._last_edit < self.interval:
+            return
+        self._last_edit = now
+        try:
+            if self.message is None:
+                self.message = await self.event.reply(text)
+            else:
+                await self.message.edit(text)
+        except Exception as e:
+            logger.warning(f'更新进度消息失败: {str(e)}')
+
+    async def finish(self, text, **kwargs):
+        """显示最终结果，并按默认时间安排删除"""
+        if self.message is not None:
+            try:
+                await self.message.edit(text, **kwargs)
+                if BOT_MESSAGE_DELETE_TIMEOUT != -1:
+                    asyncio.create_task(delete_after(self.message, BOT_MESSAGE_DELETE_TIMEOUT))
+                return self.message
+            except Exception as e:
+                logger.warning(f'更新进度消息失败: {str(e)}')
+                await self.discard()
+        return await reply_and_delete(self.event, text, **kwargs)
+
+    async def discard(self):
+        """删除进度消息"""
+        if self.message is not None:
+            message, self.message = self.message, None
+            await delete_after(message, 0)
@@ -2,6 +2,7 @@ import os
 import logging
 from pathlib import Path
 from dotenv import load_dotenv
+from utils.tracing import TraceLogFilter
 
 def setup_logging():
     """
@@ -21,11 +22,14 @@ def setup_logging():
     console_handler = logging.StreamHandler()
     
     # 创建格式化器
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(trace)s%(message)s')
     
     # 将格式化器添加到处理器
     console_handler.setFormatter(formatter)
     
+    # 附加当前消息的追踪ID
+    console_handler.addFilter(TraceLogFilter())
+    
     # 将处理器添加到根日志记录器
     root_logger.addHandler(console_handler)
     
@@ -0,0 +1,394 @@
+import asyncio
+import bisect
+import functools
+import json
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# 默认的延迟直方图分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.extend(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """单调递增计数器"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def reset(self):
+        self._values.clear()
+
+    def dump(self):
+        return [[list(key), value] for key, value in self._values.items()]
+
+    def load(self, values, extra=()):
+        for key, value in values:
+            self._values[tuple(key) + tuple(extra)] = value
+
+    def inc(self, *labelvalues, amount=1):
+        """
+        计数增加
+
+        Args:
+            labelvalues: 按 labelnames 顺序给出的标签值
+            amount: 增加的数量
+        """
+        key = tuple(str(value) for value in labelvalues)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, total, *labelvalues):
+        """
+        同步组件自身维护的累计值（如缓存的命中次数），导出前由收集回调调用
+
+        Args:
+            total: 只增不减的累计值
+            labelvalues: 按 labelnames 顺序给出的标签值
+        """
+        self._values[tuple(str(value) for value in labelvalues)] = total
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, key, None, value
+
+    def items(self):
+        return self._values.items()
+
+
+class Gauge(Counter):
+    """可增可减的瞬时值"""
+
+    type_name = 'gauge'
+
+    def set(self, value, *labelvalues):
+        self._values[tuple(str(v) for v in labelvalues)] = value
+
+
+class _HistogramSeries:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """分桶直方图，用于延迟等分布统计"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def reset(self):
+        self._series.clear()
+
+    def dump(self):
+        return [[list(key), series.counts, series.sum, series.count] for key, series in self._series.items()]
+
+    def load(self, values, extra=()):
+        for key, counts, total, count in values:
+            series = _HistogramSeries(len(self.buckets) + 1)
+            series.counts = list(counts)
+            series.sum = total
+            series.count = count
+            self._series[tuple(key) + tuple(extra)] = series
+
+    def observe(self, value, *labelvalues):
+        """
+        记录一次观测值
+
+        Args:
+            value: 观测值
+            labelvalues: 按 labelnames 顺序给出的标签值
+        """
+        key = tuple(str(v) for v in labelvalues)
+        series = self._series.get(key)
+        if series is None:
+            series = _HistogramSeries(len(self.buckets) + 1)
+            self._series[key] = series
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    def samples(self):
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series.counts):
+                cumulative += count
+                yield self.name + '_bucket', key, (('le', _format_value(bound)),), cumulative
+            yield self.name + '_sum', key, None, series.sum
+            yield self.name + '_count', key, None, series.count
+
+    def items(self):
+        return self._series.items()
+
+    def quantile(self, series, q):
+        """根据分桶估算分位数（取所在桶的上界）"""
+        if not series.count:
+            return 0.0
+        target = q * series.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), series.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound if bound != math.inf else self.buckets[-1]
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """进程内指标注册表，按名称去重，可渲染为 Prometheus 文本格式"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def add_collector(self, collector):
+        """注册在导出前调用的回调，用于刷新队列深度等瞬时指标"""
+        self._collectors.append(collector)
+
+    def collect(self):
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f'刷新指标时出错: {str(e)}')
+
+    def reset(self):
+        """清空所有指标的值和刷新回调（子进程启动时丢弃从父进程继承的数据）"""
+        for metric in self._metrics.values():
+            metric.reset()
+        # 父进程注册的回调读取的是 fork 时复制的状态，不能在子进程中导出
+        self._collectors.clear()
+
+    def dump(self):
+        """导出为可 JSON 序列化的快照"""
+        self.collect()
+        return {
+            'generated_at': time.time(),
+            'metrics': [
+                {
+                    'name': metric.name,
+                    'type': metric.type_name,
+                    'documentation': metric.documentation,
+                    'labelnames': list(metric.labelnames),
+                    'buckets': list(getattr(metric, 'buckets', ())),
+                    'values': metric.dump(),
+                }
+                for metric in self._metrics.values()
+            ],
+        }
+
+    def load(self, snapshot, process):
+        """
+        合并其他进程导出的快照，所有序列附加 process 标签
+
+        Args:
+            snapshot: dump() 的结果
+            process: 进程名称
+        """
+        for item in snapshot.get('metrics', []):
+            labelnames = tuple(item['labelnames']) + ('process',)
+            if item['type'] == Histogram.type_name:
+                metric = self.histogram(item['name'], item['documentation'], labelnames, item['buckets'])
+            elif item['type'] == Gauge.type_name:
+                metric = self.gauge(item['name'], item['documentation'], labelnames)
+            else:
+                metric = self.counter(item['name'], item['documentation'], labelnames)
+            metric.load(item['values'], (process,))
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = cls(name, documentation, labelnames, **kwargs)
+            self._metrics[name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """渲染为 Prometheus 文本格式"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            for sample_name, key, extra, value in metric.samples():
+                lines.append(f'{sample_name}{_format_labels(metric.labelnames, key, extra)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# 创建全局实例
+registry = MetricsRegistry()
+
+# 各调度任务共用的执行耗时指标
+SCHEDULER_RUN_DURATION = registry.histogram(
+    'tf_scheduler_run_duration_seconds', '调度任务单次执行耗时', ('scheduler', 'status')
+)
+
+
+def track_duration(histogram, *labelvalues):
+    """
+    记录异步函数执行耗时的装饰器，最后一个标签为 ok/error
+
+    Args:
+        histogram: 直方图
+        labelvalues: 除状态外的标签值
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            status = 'error'
+            try:
+                result = await func(*args, **kwargs)
+                status = 'ok'
+                return result
+            finally:
+                histogram.observe(time.perf_counter() - started, *labelvalues, status)
+        return wrapper
+    return decorator
+
+
+def write_snapshot(path):
+    """将本进程的指标快照原子写入文件，供其他进程合并导出"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(registry.dump(), f)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path, max_age=None):
+    """读取其他进程写入的指标快照，不存在或过期时返回 None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if max_age and time.time() - snapshot.get('generated_at', 0) > max_age:
+        return None
+    return snapshot
+
+
+async def snapshot_loop(path, interval):
+    """定期写入指标快照"""
+    while True:
+        try:
+            write_snapshot(path)
+        except Exception as e:
+            logger.error(f'写入指标快照时出错: {str(e)}')
+        await asyncio.sleep(interval)
+
+
+def render_combined(snapshots):
+    """
+    合并多个进程的指标快照并渲染为 Prometheus 文本格式
+
+    Args:
+        snapshots: [(进程名称, 快照)]
+    """
+    combined = MetricsRegistry()
+    for process, snapshot in snapshots:
+        if snapshot:
+            combined.load(snapshot, process)
+    return combined.render()
+
+
+def summarize_histogram(histogram, group_by=0, top=10):
+    """
+    汇总直方图，按指定标签分组
+
+    Args:
+        histogram: 直方图
+        group_by: 用于分组的标签下标
+        top: 按总耗时返回前几项
+
+    Returns:
+        list: [(标签值, 次数, 平均值, p95, p99, 总和)]
+    """
+    merged = {}
+    for key, series in histogram.items():
+        name = key[group_by] if key else ''
+        target = merged.get(name)
+        if target is None:
+            target = _HistogramSeries(len(histogram.buckets) + 1)
+            merged[name] = target
+        target.counts = [a + b for a, b in zip(target.counts, series.counts)]
+        target.sum += series.sum
+        target.count += series.count
+
+    rows = [
+        (name, series.count, series.sum / series.count if series.count else 0.0,
+         histogram.quantile(series, 0.95), histogram.quantile(series, 0.99), series.sum)
+        for name, series in merged.items()
+    ]
+    rows.sort(key=lambda row: row[5], reverse=True)
+    return rows[:top]
+
+
+async def log_summary_loop(interval, histograms):
+    """
+    定期将直方图汇总写入日志
+
+    Args:
+        interval: 间隔秒数
+        histograms: [(标题, 直方图, 分组标签下标)]
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            for title, histogram, group_by in histograms:
+                rows = summarize_histogram(histogram, group_by)
+                if not rows:
+                    continue
+                lines = [
+                    f'  {name}: 次数={count} 平均={avg * 1000:.1f}ms p95<={p95 * 1000:.0f}ms p99<={p99 * 1000:.0f}ms 总计={total:.2f}s'
+                    for name, count, avg, p95, p99, total in rows
+                ]
+                logger.info(f'{title}（累计）:\n' + '\n'.join(lines))
+        except Exception as e:
+            logger.error(f'输出指标汇总时出错: {str(e)}')
@@ -0,0 +1,576 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import string
+import threading
+import time
+from collections import namedtuple
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+from utils.constants import (
+    REGEX_SANDBOX_MODE, REGEX_TIMEOUT, REGEX_MAX_TIMEOUTS, REGEX_SANDBOX_WORKERS, REGEX_DISABLED_PATH
+)
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# 风险等级
+RISK_SAFE = 'safe'
+RISK_POLYNOMIAL = 'polynomial'
+RISK_EXPONENTIAL = 'exponential'
+RISK_INVALID = 'invalid'
+
+_SEVERITY = {RISK_SAFE: 0, RISK_POLYNOMIAL: 1, RISK_EXPONENTIAL: 2}
+
+# 分析结果
+PatternReport = namedtuple('PatternReport', ['level', 'reason'])
+
+# 上界超过该值的量词按无界处理
+_LARGE_REPEAT = 10
+
+# 用于近似计算字符集是否相交的样本字符
+_SAMPLE = frozenset(string.printable + '中文字符测试，。！？　 ')
+
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+_CATEGORY_PATTERNS = {
+    sre_constants.CATEGORY_DIGIT: r'\d', sre_constants.CATEGORY_NOT_DIGIT: r'\D',
+    sre_constants.CATEGORY_SPACE: r'\s', sre_constants.CATEGORY_NOT_SPACE: r'\S',
+    sre_constants.CATEGORY_WORD: r'\w', sre_constants.CATEGORY_NOT_WORD: r'\W',
+}
+
+REGEX_CALLS = registry.counter(
+    'tf_regex_sandbox_calls_total', '正则沙箱执行次数（ok/timeout/error/disabled）', ('outcome',)
+)
+
+
+class RegexTimeout(Exception):
+    """正则执行超过时间预算"""
+
+
+class _Analyzer:
+    """基于正则语法树的回溯风险分析（启发式，宁可误报）"""
+
+    def __init__(self):
+        self.level = RISK_SAFE
+        self.reason = ''
+
+    def flag(self, level, reason):
+        if _SEVERITY[level] > _SEVERITY[self.level]:
+            self.level = level
+            self.reason = reason
+
+    @staticmethod
+    def charset(op, av):
+        """单字符操作可匹配的字符集合"""
+        if op == sre_constants.LITERAL:
+            return frozenset((chr(av),))
+        if op == sre_constants.NOT_LITERAL:
+            return _SAMPLE - {chr(av)}
+        if op == sre_constants.ANY:
+            return _SAMPLE
+        if op == sre_constants.IN:
+            negate = False
+            chars = set()
+            for item_op, item_av in av:
+                if item_op == sre_constants.NEGATE:
+                    negate = True
+                elif item_op == sre_constants.LITERAL:
+                    chars.add(chr(item_av))
+                elif item_op == sre_constants.RANGE:
+                    chars.update(c for c in _SAMPLE if item_av[0] <= ord(c) <= item_av[1])
+                elif item_op == sre_constants.CATEGORY and item_av in _CATEGORY_PATTERNS:
+                    category = re.compile(_CATEGORY_PATTERNS[item_av])
+                    chars.update(c for c in _SAMPLE if category.match(c))
+                else:
+                    chars.update(_SAMPLE)
+            return frozenset(_SAMPLE - chars if negate else chars)
+        return None
+
+    def first(self, items):
+        """
+        计算序列的首字符集合
+
+        Returns:
+            tuple: (首字符集合, 是否可以匹配空串)
+        """
+        chars = set()
+        for op, av in items:
+            item_chars, nullable = self.first_item(op, av)
+            chars |= item_chars
+            if not nullable:
+                return frozenset(chars), False
+        return frozenset(chars), True
+
+    def first_item(self, op, av):
+        single = self.charset(op, av)
+        if single is not None:
+            return single, False
+        if op in _REPEATS or op == getattr(sre_constants, 'POSSESSIVE_REPEAT', None):
+            chars, nullable = self.first(av[2])
+            return chars, nullable or av[0] == 0
+        if op == sre_constants.SUBPATTERN:
+            return self.first(av[-1])
+        if op == getattr(sre_constants, 'ATOMIC_GROUP', None):
+            return self.first(av)
+        if op == sre_constants.BRANCH:
+            chars = set()
+            nullable = False
+            for branch in av[1]:
+                branch_chars, branch_nullable = self.first(branch)
+                chars |= branch_chars
+                nullable = nullable or branch_nullable
+            return frozenset(chars), nullable
+        if op == sre_constants.GROUPREF:
+            return _SAMPLE, True
+        # 断言、锚点等零宽操作
+        return frozenset(), True
+
+    def walk(self, items, outer_first=None):
+        """
+        遍历语法树
+
+        Args:
+            items: 语法树序列
+            outer_first: 所在无界量词循环体的首字符集合，不在无界量词内时为 None
+        """
+        previous_repeat = None
+        for index, (op, av) in enumerate(items):
+            if op in _REPEATS:
+                low, high, body = av
+                unbounded = high == sre_constants.MAXREPEAT or high > _LARGE_REPEAT
+                body_first, _ = self.first(body)
+                if unbounded:
+                    # 循环体内的无界量词与循环体开头可以匹配同一字符：迭代边界有指数种划分
+                    if outer_first is not None and body_first & outer_first:
+                        self.flag(RISK_EXPONENTIAL, '嵌套的无界量词（如 (a+)+）')
+                    # 相邻的无界量词匹配相同字符，中间没有必须匹配的内容（如 \d+\d+）
+                    if previous_repeat is not None and previous_repeat & body_first:
+                        self.flag(RISK_POLYNOMIAL, '相邻的无界量词可以匹配相同字符（如 \\d+\\d+）')
+                    follow, _ = self.first(items[index + 1:])
+                    self.walk_body(body, body_first, follow)
+                    previous_repeat = body_first
+                else:
+                    self.walk(body, outer_first)
+                    if low:
+                        previous_repeat = None
+                continue
+            if op == sre_constants.SUBPATTERN:
+                self.walk(av[-1], outer_first)
+            elif op == sre_constants.BRANCH:
+                for branch in av[1]:
+                    self.walk(branch, outer_first)
+            elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+                self.walk(av[1], None)
+            # 占有量词和原子组不会回溯，无需检查
+            _, nullable = self.first_item(op, av)
+            if not nullable:
+                previous_repeat = None
+
+    def walk_body(self, body, body_first, follow):
+        """检查无界量词的循环体，包括其中的分支能否匹配相同的开头"""
+        self.check_branches(body, body_first | follow)
+        self.walk(body, body_first)
+
+    def check_branches(self, items, after):
+        """
+        检查序列中的分支
+
+        Args:
+            items: 语法树序列
+            after: 序列之后可能出现的首字符集合（循环体内包括下一次迭代的开头）
+        """
+        for index, (op, av) in enumerate(items):
+            if op not in (sre_constants.BRANCH, sre_constants.SUBPATTERN):
+                continue
+            rest_first, rest_nullable = self.first(items[index + 1:])
+            item_after = rest_first | after if rest_nullable else rest_first
+            if op == sre_constants.SUBPATTERN:
+                self.check_branches(av[-1], item_after)
+                continue
+            seen = frozenset()
+            for branch in av[1]:
+                chars, nullable = self.first(branch)
+                if nullable:
+                    chars = chars | item_after
+                if chars & seen:
+                    self.flag(RISK_EXPONENTIAL, '无界量词内的分支可以匹配相同的开头（如 (a|aa)*）')
+                    return
+                seen |= chars
+                self.check_branches(branch, item_after)
+
+
+def analyze_pattern(pattern):
+    """
+    分析正则表达式的回溯风险
+
+    Args:
+        pattern: 正则表达式
+
+    Returns:
+        PatternReport: level 为 safe/polynomial/exponential/invalid
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (re.error, RecursionError, OverflowError) as e:
+        return PatternReport(RISK_INVALID, f'正则表达式错误: {str(e)}')
+    analyzer = _Analyzer()
+    try:
+        analyzer.walk(list(parsed))
+    except RecursionError:
+        return PatternReport(RISK_POLYNOMIAL, '正则表达式嵌套过深')
+    return PatternReport(analyzer.level, analyzer.reason)
+
+
+def is_risky(pattern):
+    """是否需要放到沙箱中执行"""
+    return analyze_pattern(pattern).level in (RISK_POLYNOMIAL, RISK_EXPONENTIAL)
+
+
+def screen_patterns(patterns):
+    """
+    添加正则前的检查，拒绝无效和存在指数级回溯风险的正则
+
+    Args:
+        patterns: 正则表达式列表
+
+    Returns:
+        tuple: (可以添加的正则列表, [(被拒绝的正则, 原因)])
+    """
+    accepted = []
+    rejected = []
+    for pattern in patterns:
+        report = analyze_pattern(pattern)
+        if report.level in (RISK_INVALID, RISK_EXPONENTIAL):
+            logger.warning(f'拒绝正则表达式 "{pattern}": {report.reason}')
+            rejected.append((pattern, report.reason))
+            continue
+        if report.level == RISK_POLYNOMIAL:
+            logger.warning(f'正则表达式 "{pattern}" 存在回溯风险，将在沙箱中执行: {report.reason}')
+        # 重新添加通过检查的正则时解除之前的禁用
+        regex_guard.enable(pattern)
+        accepted.append(pattern)
+    return accepted, rejected
+
+
+class RegexMatch:
+    """沙箱返回的匹配结果，提供与 re.Match 相同的常用方法"""
+
+    __slots__ = ('_span', '_groups', '_group0')
+
+    def __init__(self, span, group0, groups):
+        self._span = span
+        self._group0 = group0
+        self._groups = groups
+
+    def span(self):
+        return self._span
+
+    def groups(self):
+        return self._groups
+
+    def group(self, index=0):
+        if index == 0:
+            return self._group0
+        return self._groups[index - 1]
+
+
+def _worker_main(conn):
+    """沙箱进程：循环执行正则请求"""
+    compiled = {}
+    # 启动完成后通知父进程，进程启动耗时不计入正则超时
+    conn.send(('ready', None))
+    while True:
+        try:
+            op, pattern, text, repl = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            regex = compiled.get(pattern)
+            if regex is None:
+                if len(compiled) > 256:
+                    compiled.clear()
+                regex = compiled[pattern] = re.compile(pattern)
+            if op == 'search':
+                match = regex.search(text)
+                result = (match.span(), match.group(0), match.groups()) if match else None
+            else:
+                result = regex.subn(repl, text)
+            conn.send(('ok', result))
+        except Exception as e:
+            conn.send(('error', str(e)))
+
+
+class _SandboxWorker:
+    """
+    单个沙箱进程，超时后直接终止并重启
+
+    主进程中有数据库线程、下载线程等，fork 出的子进程可能继承被其他线程持有的锁而死锁，
+    因此使用 spawn 方式启动全新的解释器。
+    """
+
+    _context = multiprocessing.get_context('spawn')
+
+    def __init__(self):
+        self._process = None
+        self._conn = None
+
+    def _start(self):
+        parent_conn, child_conn = self._context.Pipe()
+        self._process = self._context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+        try:
+            self._conn.recv()
+        except (EOFError, OSError):
+            self.stop()
+            raise
+
+    def call(self, request, timeout):
+        if self._process is None or not self._process.is_alive():
+            self._start()
+        self._conn.send(request)
+        if not self._conn.poll(timeout):
+            self.stop()
+            raise RegexTimeout()
+        status, result = self._conn.recv()
+        if status == 'error':
+            raise re.error(result)
+        return result
+
+    def stop(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.join()
+        if self._conn is not None:
+            self._conn.close()
+        self._process = None
+        self._conn = None
+
+
+class RegexGuard:
+    """
+    用户正则执行服务
+
+    - 有回溯风险的正则（或 REGEX_SANDBOX_MODE=all 时所有正则）在独立进程中执行，
+      超过 REGEX_TIMEOUT 秒直接终止进程，不会阻塞事件循环
+    - 安全的正则在当前进程执行，但同样计时，超时的正则之后改为在沙箱中执行
+    - 同一正则超时达到 REGEX_MAX_TIMEOUTS 次后被禁用（视为不匹配），并通过机器人通知
+    - 预编译的关键字匹配器和替换程序在当前进程执行正则时通过 report_inline 上报耗时；
+      风险或禁用状态变化时 generation 递增，编译结果据此重新编译
+    """
+
+    def __init__(self, mode=REGEX_SANDBOX_MODE, timeout=REGEX_TIMEOUT, max_timeouts=REGEX_MAX_TIMEOUTS,
+                 workers=REGEX_SANDBOX_WORKERS, disabled_path=REGEX_DISABLED_PATH):
+        self.mode = mode
+        self.timeout = timeout
+        self.max_timeouts = max_timeouts
+        self.worker_count = max(1, workers)
+        self.disabled_path = disabled_path
+        self._workers = None
+        self._risky = {}
+        self._timeouts = {}
+        self._disabled = None
+        self._notifier = None
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def set_notifier(self, notifier):
+        """设置禁用正则时的通知回调（async 函数，参数为通知文本）"""
+        self._notifier = notifier
+
+    def reset(self):
+        """丢弃沙箱进程（子进程启动时调用，不能复用父进程的管道）"""
+        self._workers = None
+        self._notifier = None
+
+    # ---------- 禁用列表 ----------
+
+    def _load_disabled(self):
+        if self._disabled is None:
+            try:
+                with open(self.disabled_path, 'r', encoding='utf-8') as f:
+                    self._disabled = dict(json.load(f))
+            except (OSError, ValueError):
+                self._disabled = {}
+        return self._disabled
+
+    def _save_disabled(self):
+        try:
+            os.makedirs(os.path.dirname(self.disabled_path), exist_ok=True)
+            tmp_path = f'{self.disabled_path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._disabled, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.disabled_path)
+        except OSError as e:
+            logger.error(f'保存禁用正则列表时出错: {str(e)}')
+
+    def is_disabled(self, pattern):
+        return pattern in self._load_disabled()
+
+    def enable(self, pattern):
+        """解除正则的禁用状态"""
+        self._timeouts.pop(pattern, None)
+        if self._load_disabled().pop(pattern, None) is not None:
+            self._save_disabled()
+            self.generation += 1
+            logger.info(f'已解除正则禁用: {pattern}')
+
+    def get_disabled(self):
+        """获取被禁用的正则 {正则: 禁用时间戳}"""
+        return dict(self._load_disabled())
+
+    # ---------- 执行 ----------
+
+    def should_sandbox(self, pattern):
+        """是否需要在沙箱中执行"""
+        if self.mode == 'off':
+            return False
+        if self.mode == 'all':
+            return True
+        risky = self._risky.get(pattern)
+        if risky is None:
+            risky = self._risky[pattern] = is_risky(pattern)
+        return risky
+
+    def _acquire_worker(self):
+        with self._lock:
+            if self._workers is None:
+                self._workers = queue.Queue()
+                for _ in range(self.worker_count):
+                    self._workers.put(_SandboxWorker())
+        return self._workers.get()
+
+    def _call_sandbox(self, request):
+        worker = self._acquire_worker()
+        try:
+            return worker.call(request, self.timeout)
+        finally:
+            self._workers.put(worker)
+
+    async def _strike(self, pattern, elapsed):
+        """记录一次超时，达到次数后禁用"""
+        if not self._risky.get(pattern):
+            self._risky[pattern] = True
+            self.generation += 1
+        count = self._timeouts.get(pattern, 0) + 1
+        self._timeouts[pattern] = count
+        logger.warning(f'正则执行超时 ({elapsed:.2f}s, 第 {count} 次): {pattern}')
+        if count < self.max_timeouts:
+            return
+        self._load_disabled()[pattern] = time.time()
+        self._save_disabled()
+        self.generation += 1
+        logger.error(f'正则多次超时，已禁用: {pattern}')
+        if self._notifier:
+            try:
+                await self._notifier(
+                    f'⚠️ 正则表达式执行多次超时（{count} 次，每次超过 {self.timeout} 秒），已被禁用，视为不匹配：\n'
+                    f'{pattern}\n请修改后重新添加。'
+                )
+            except Exception as e:
+                logger.error(f'发送正则禁用通知时出错: {str(e)}')
+
+    async def _execute(self, op, pattern, text, repl=None, sandbox=None):
+        if self.is_disabled(pattern):
+            REGEX_CALLS.inc('disabled')
+            return None if op == 'search' else (text, 0)
+
+        started = time.perf_counter()
+        if not (sandbox if sandbox is not None else self.should_sandbox(pattern)):
+            regex = re.compile(pattern)
+            if op == 'search':
+                result = regex.search(text)
+            else:
+                result = regex.subn(repl, text)
+            await self.report_inline((pattern,), time.perf_counter() - started)
+            REGEX_CALLS.inc('ok')
+            return result
+
+        try:
+            result = await asyncio.to_thread(self._call_sandbox, (op, pattern, text, repl))
+        except RegexTimeout:
+            REGEX_CALLS.inc('timeout')
+            await self._strike(pattern, time.perf_counter() - started)
+            return None if op == 'search' else (text, 0)
+        except re.error:
+            REGEX_CALLS.inc('error')
+            raise
+        REGEX_CALLS.inc('ok')
+        if op == 'search' and result is not None:
+            return RegexMatch(*result)
+        return result
+
+    async def report_inline(self, patterns, elapsed):
+        """
+        上报在当前进程中执行正则的耗时
+
+        当前进程中无法中断，只能事后记录：单个正则超时计一次超时，之后改在沙箱中执行；
+        组合正则无法确定是哪一个正则超时，其中的正则全部改在沙箱中单独执行，由沙箱计次。
+
+        Args:
+            patterns: 本次执行的正则列表
+            elapsed: 耗时（秒）
+        """
+        if elapsed <= self.timeout:
+            return
+        patterns = list(patterns)
+        if len(patterns) == 1:
+            await self._strike(patterns[0], elapsed)
+            return
+        for pattern in patterns:
+            self._risky[pattern] = True
+        self.generation += 1
+        logger.warning(f'组合正则执行超时 ({elapsed:.2f}s)，{len(patterns)} 个正则改为在沙箱中执行')
+
+    async def search(self, pattern, text, sandbox=None):
+        """
+        在时间预算内执行 re.search
+
+        Args:
+            pattern: 正则表达式
+            text: 文本
+            sandbox: 是否强制在沙箱中执行，为空时按风险分析和 REGEX_SANDBOX_MODE 决定
+
+        Returns:
+            匹配结果（re.Match 或 RegexMatch），未匹配、超时或已禁用时返回 None
+        """
+        return await self._execute('search', pattern, text, sandbox=sandbox)
+
+    async def subn(self, pattern, repl, text):
+        """
+        在时间预算内执行 re.subn
+
+        Returns:
+            tuple: (替换后的文本, 替换次数)，超时或已禁用时原样返回
+        """
+        return await self._execute('subn', pattern, text, repl)
+
+    def get_stats(self):
+        return {
+            'mode': self.mode,
+            'timeout': self.timeout,
+            'tracked_timeouts': len(self._timeouts),
+            'disabled': len(self._load_disabled()),
+        }
+
+    def stop(self):
+        if self._workers is None:
+            return
+        while not self._workers.empty():
+            self._workers.get_nowait().stop()
+        self._workers = None
+
+
+# 创建全局实例
+regex_guard = RegexGuard()
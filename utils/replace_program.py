@@ -0,0 +1,139 @@
+import logging
+import re
+import time
+
+from utils.metrics import registry
+from utils.regex_guard import regex_guard
+from utils.tracing import record_span
+
+logger = logging.getLogger(__name__)
+
+# 全文替换的模式
+FULL_REPLACE_PATTERN = '.*'
+
+# 单个替换模式耗时超过该值（秒）时告警，通常意味着灾难性回溯
+SLOW_PATTERN_SECONDS = 0.1
+
+# 不含正则元字符的模式可以直接按字符串替换
+_REGEX_META = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+# 不带规则和替换规则ID标签，避免序列数随规则数增长；慢模式的规则和替换规则ID记录在追踪 span 中
+REPLACE_PATTERN_DURATION = registry.histogram(
+    'tf_replace_pattern_seconds', '单个替换模式的执行耗时', (),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+
+
+class ReplaceStep:
+    """替换程序中的一步：预编译的正则（或字面量）与替换模板"""
+
+    __slots__ = ('replace_id', 'pattern', 'content', 'compiled', 'literal', 'guarded')
+
+    def __init__(self, replace_id, pattern, content, compiled=None, literal=False, guarded=False):
+        self.replace_id = replace_id
+        self.pattern = pattern
+        self.content = content
+        self.compiled = compiled
+        self.literal = literal
+        self.guarded = guarded
+
+    async def apply(self, text):
+        """
+        执行替换
+
+        Returns:
+            tuple: (替换后的文本, 替换次数)
+        """
+        if self.literal:
+            count = text.count(self.pattern)
+            if not count:
+                return text, 0
+            return text.replace(self.pattern, self.content), count
+        if self.guarded:
+            # 有回溯风险的模式在沙箱中限时执行
+            return await regex_guard.subn(self.pattern, self.content, text)
+        # 在当前进程执行的模式同样计时，超时后上报，之后改在沙箱中执行
+        started = time.perf_counter()
+        result = self.compiled.subn(self.content, text)
+        await regex_guard.report_inline((self.pattern,), time.perf_counter() - started)
+        return result
+
+
+class ReplaceProgram:
+    """
+    单条规则的替换程序
+
+    规则按顺序编译为预编译的替换步骤：无效的正则、永远不会改变文本的规则在编译时剔除；
+    存在全文替换（.*）时结果必然是第一条全文替换的内容，程序只保留这一步。
+    """
+
+    def __init__(self, rule_id, replace_rules):
+        self.rule_id = rule_id
+        # 编译时 regex_guard 的风险和禁用状态版本，状态变化后需要重新编译
+        self.generation = regex_guard.generation
+        self.full_replace = None
+        self.steps = []
+        self.skipped = 0
+        for replace_rule in replace_rules:
+            content = replace_rule.content or ''
+            if replace_rule.pattern == FULL_REPLACE_PATTERN:
+                # 全文替换会覆盖之前所有替换的结果，之后的规则也不再执行
+                self.full_replace = content
+                self.steps = []
+                break
+            step = self._compile(replace_rule.id, replace_rule.pattern, content)
+            if step is None:
+                self.skipped += 1
+            else:
+                self.steps.append(step)
+
+    def _compile(self, replace_id, pattern, content):
+        if not pattern:
+            # 空模式会在每个字符之间插入替换内容，替换内容为空时不会改变文本
+            if not content:
+                return None
+        elif not _REGEX_META.search(pattern) and '\\' not in content:
+            return ReplaceStep(replace_id, pattern, content, literal=True)
+
+        try:
+            compiled = re.compile(pattern)
+            # 提前解析替换模板，无效的分组引用在编译时即可发现
+            compiled.sub(content, '')
+        except (re.error, IndexError) as e:
+            logger.error(f'替换规则格式错误: {pattern}, 错误: {str(e)}')
+            return None
+        return ReplaceStep(replace_id, pattern, content, compiled, guarded=regex_guard.should_sandbox(pattern))
+
+    def __len__(self):
+        return len(self.steps) + (1 if self.full_replace is not None else 0)
+
+    async def run(self, message_text):
+        """
+        对文本执行替换程序
+
+        Args:
+            message_text: 原始文本
+
+        Returns:
+            str: 替换后的文本
+        """
+        if self.full_replace is not None:
+            logger.info(f'执行全文替换:\n原文: "{message_text}"\n替换为: "{self.full_replace}"')
+            return self.full_replace
+
+        for step in self.steps:
+            started = time.perf_counter()
+            old_text = message_text
+            message_text, count = await step.apply(message_text)
+            elapsed = time.perf_counter() - started
+            REPLACE_PATTERN_DURATION.observe(elapsed)
+            if elapsed >= SLOW_PATTERN_SECONDS:
+                logger.warning(
+                    f'替换规则耗时过长 ({elapsed * 1000:.0f}ms)，可能存在灾难性回溯: '
+                    f'规则 {self.rule_id} 模式 "{step.pattern}" 文本长度 {len(old_text)}'
+                )
+                record_span('replace:slow_pattern', elapsed, pattern=step.pattern,
+                            rule_id=self.rule_id, replace_id=step.replace_id)
+            if count:
+                logger.info(f'执行部分替换:\n原文: "{old_text}"\n替换次数: {count}\n替换规则: "{step.pattern}" -> "{step.content}"\n替换后: "{message_text}"')
+        return message_text
@@ -0,0 +1,195 @@
+import contextvars
+import logging
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from utils.constants import TRACE_ENABLED, TRACE_SLOW_THRESHOLD, TRACE_BUFFER_SIZE
+
+logger = logging.getLogger(__name__)
+
+# 单条追踪最多记录的 span 数，防止异常情况下无限增长
+MAX_SPANS = 500
+
+# 当前协程所属的追踪，asyncio 任务创建时会复制上下文，子任务自动继承
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+class Span:
+    """追踪中的一段耗时记录"""
+
+    __slots__ = ('name', 'start', 'duration', 'status', 'attrs')
+
+    def __init__(self, name, start, duration, status='ok', attrs=None):
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.status = status
+        self.attrs = attrs or {}
+
+    def to_dict(self, origin):
+        return {
+            'name': self.name,
+            'offset_ms': round((self.start - origin) * 1000, 2),
+            'duration_ms': round(self.duration * 1000, 2),
+            'status': self.status,
+            **({'attrs': self.attrs} if self.attrs else {}),
+        }
+
+
+class Trace:
+    """一条消息从监听器到发送完成的完整处理过程"""
+
+    def __init__(self, name, **attrs):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.status = 'ok'
+        self.spans = []
+        self.dropped_spans = 0
+
+    def add_span(self, span):
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped_spans += 1
+            return
+        self.spans.append(span)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration_ms': round((self.duration or 0) * 1000, 2),
+            'status': self.status,
+            'attrs': self.attrs,
+            'spans': [span.to_dict(self.start) for span in sorted(self.spans, key=lambda s: s.start)],
+            'dropped_spans': self.dropped_spans,
+        }
+
+
+class TraceBuffer:
+    """
+    慢追踪环形缓冲区
+
+    只保留耗时超过阈值（或处理出错）的最近若干条追踪，用于事后排查单条慢转发，
+    无需开启全局调试日志。
+    """
+
+    def __init__(self, maxlen=TRACE_BUFFER_SIZE, threshold=TRACE_SLOW_THRESHOLD):
+        self.threshold = threshold
+        self._traces = deque(maxlen=maxlen)
+        self.finished = 0
+        self.kept = 0
+
+    def offer(self, trace):
+        self.finished += 1
+        if trace.duration >= self.threshold or trace.status != 'ok':
+            self._traces.append(trace)
+            self.kept += 1
+
+    def recent(self, limit=None):
+        """按时间倒序返回最近的慢追踪"""
+        traces = list(reversed(self._traces))
+        return traces[:limit] if limit else traces
+
+    def get(self, trace_id):
+        for trace in self._traces:
+            if trace.trace_id == trace_id:
+                return trace
+        return None
+
+    def dump(self, limit=None):
+        """导出为可 JSON 序列化的列表"""
+        return [trace.to_dict() for trace in self.recent(limit)]
+
+    def get_stats(self):
+        return {
+            'finished': self.finished,
+            'kept': self.kept,
+            'buffered': len(self._traces),
+            'threshold': self.threshold,
+        }
+
+
+# 创建全局实例
+slow_traces = TraceBuffer()
+
+
+def current_trace():
+    """获取当前上下文中的追踪，没有时返回 None"""
+    return _current_trace.get()
+
+
+def current_trace_id():
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+@contextmanager
+def trace(name, **attrs):
+    """
+    开始一条新的追踪，退出时计算总耗时并按阈值放入慢追踪缓冲区
+
+    Args:
+        name: 追踪名称
+        attrs: 附加属性，如聊天ID、消息ID
+    """
+    if not TRACE_ENABLED:
+        yield None
+        return
+    new_trace = Trace(name, **attrs)
+    token = _current_trace.set(new_trace)
+    try:
+        yield new_trace
+    except BaseException:
+        new_trace.status = 'error'
+        raise
+    finally:
+        new_trace.duration = time.perf_counter() - new_trace.start
+        _current_trace.reset(token)
+        slow_traces.offer(new_trace)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    在当前追踪中记录一段耗时，不在追踪内时不做任何事
+
+    Args:
+        name: span 名称，如 filter:KeywordFilter、telegram:send_file、db:load_rules
+        attrs: 附加属性
+    """
+    parent = _current_trace.get()
+    if parent is None:
+        yield
+        return
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        yield
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        parent.add_span(Span(name, start, time.perf_counter() - start, status, attrs))
+
+
+def record_span(name, duration, status='ok', **attrs):
+    """记录一段已经结束的耗时（用于只在结束时才知道耗时的调用）"""
+    parent = _current_trace.get()
+    if parent is None:
+        return
+    parent.add_span(Span(name, time.perf_counter() - duration, duration, status, attrs))
+
+
+class TraceLogFilter(logging.Filter):
+    """为日志记录附加当前追踪ID，便于关联同一条消息的日志"""
+
+    def filter(self, record):
+        trace_id = current_trace_id()
+        record.trace = f'[{trace_id}] ' if trace_id else ''
+        return True
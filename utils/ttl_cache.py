@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+import weakref
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# 所有缓存实例，由同一个后台任务定期清理
+_caches = weakref.WeakSet()
+_sweeper_task = None
+SWEEP_INTERVAL = 60
+
+
+class TTLCache:
+    """
+    带过期时间和容量上限的缓存
+
+    条目按写入顺序保存在 OrderedDict 中，同一缓存内所有条目的存活时间相同，
+    因此最早写入的条目总是最先过期：过期清理只需从头部依次弹出，
+    容量满时淘汰最早写入的条目，均为 O(1)。
+    所有实例共用一个后台清理任务，读取时也会检查过期。
+    """
+
+    def __init__(self, ttl, maxsize=10000, name=None):
+        """
+        初始化缓存
+
+        Args:
+            ttl: 条目存活时间（秒）
+            maxsize: 最大条目数
+            name: 缓存名称，用于日志和统计
+        """
+        self.ttl = ttl
+        self.maxsize = max(1, int(maxsize))
+        self.name = name or 'cache'
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        _caches.add(self)
+
+    def get(self, key, default=None):
+        """获取未过期的条目"""
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value=True, ttl=None):
+        """
+        写入条目，重新写入会刷新过期时间
+
+        ttl 可覆盖默认存活时间（如从持久化记录恢复时只保留剩余时间），
+        但需保证按写入顺序过期时间不减，expire 按写入顺序清理
+        """
+        if key in self._data:
+            self._data.move_to_end(key)
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+        _ensure_sweeper()
+
+    def add(self, key):
+        """作为集合使用时记录一个键"""
+        self.set(key, True)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def discard(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+    def expire(self):
+        """清理所有已过期的条目，返回清理数量"""
+        now = time.monotonic()
+        removed = 0
+        while self._data:
+            key, (expires_at, _) = next(iter(self._data.items()))
+            if expires_at > now:
+                break
+            self._data.popitem(last=False)
+            removed += 1
+        self.expirations += removed
+        return removed
+
+    def get_stats(self):
+        """获取命中、未命中和淘汰统计"""
+        return {
+            'name': self.name,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+def _ensure_sweeper():
+    """在事件循环中启动唯一的后台清理任务"""
+    global _sweeper_task
+    if _sweeper_task is not None and not _sweeper_task.done():
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # 没有运行中的事件循环时只依赖读取时的过期检查
+        return
+    _sweeper_task = loop.create_task(_sweep_loop())
+
+
+async def _sweep_loop():
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        for cache in list(_caches):
+            try:
+                removed = cache.expire()
+                if removed:
+                    logger.debug(f'缓存 {cache.name} 清理了 {removed} 个过期条目')
+            except Exception as e:
+                logger.error(f'清理缓存 {cache.name} 时出错: {str(e)}')
+
+
+def get_all_cache_stats():
+    """获取所有缓存实例的统计信息"""
+    return [cache.get_stats() for cache in list(_caches)]